@@ -0,0 +1,76 @@
+"""
+Compares the running median trend with the FFT low-pass filters on a synthetic total field line.
+Run from the tool directory: python -m benchmarks.residual [--sizes 10000 100000 1000000]
+"""
+import argparse
+
+import numpy as np
+
+from preprocessing.magnetic_field import RESIDUAL_SCALE_M
+from preprocessing.trend import FILTER_KINDS, lowpass, median_trend
+from benchmarks.segmentation import timed
+
+SAMPLE_RATE_HZ = 200
+SPEED_M_S = 5.0
+
+
+def survey_line(n, anomaly_every_m=50.0, seed=0):
+    """
+    Total field (nT) along a straight line flown at SPEED_M_S: the main field with a diurnal drift and a
+    regional gradient, plus short dipole-like anomalies and sensor noise. Returns the field and the anomalies.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) / SAMPLE_RATE_HZ
+    x = t * SPEED_M_S
+    background = 50000 + 20 * np.sin(2 * np.pi * t / 3600) + 0.002 * x
+    centres = np.arange(anomaly_every_m / 2, x[-1] + anomaly_every_m, anomaly_every_m)
+    depth = rng.uniform(1.0, 3.0, len(centres))
+    amplitude = rng.uniform(-20, 20, len(centres))
+    nearest = np.clip(np.round(x / anomaly_every_m - 0.5).astype(int), 0, len(centres) - 1)
+    r2 = (x - centres[nearest])**2 + depth[nearest]**2
+    anomaly = amplitude[nearest] * depth[nearest]**3 * (2 * depth[nearest]**2 - (x - centres[nearest])**2) / r2**2.5
+    return background + anomaly + rng.normal(0, 0.05, n), anomaly
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--short_sizes", type=int, nargs="+", default=[1000, 2000, 5000],
+                        help="Lengths of the short lines whose largest error is reported")
+    parser.add_argument("--wavelength", type=float, default=RESIDUAL_SCALE_M,
+                        help="Length of the median window and cutoff wavelength of the filters (m)")
+    args = parser.parse_args()
+
+    window = int(np.ceil(args.wavelength / SPEED_M_S * SAMPLE_RATE_HZ))
+    cutoff_hz = SPEED_M_S / args.wavelength
+    methods = [('median', lambda tf: median_trend(tf, window))]
+    methods += [(kind, lambda tf, kind=kind: lowpass(tf, cutoff_hz, SAMPLE_RATE_HZ, kind)) for kind in FILTER_KINDS]
+
+    print(f"window {window} samples, cutoff {cutoff_hz:.3g} Hz; errors of the residual against the anomalies, "
+          f"edge is over the first and last {window} samples")
+    print(f"{'samples':>10} " + " ".join(f"{name + ' s':>14} {'rms nT':>7} {'edge nT':>8}" for name, _ in methods))
+    for n in args.sizes:
+        tf, anomaly = survey_line(n)
+        row = []
+        for _, trend in methods:
+            result, seconds = timed(trend, tf)
+            error = tf - result - anomaly
+            edges = np.concatenate([error[:window], error[-window:]])
+            row.append(f"{seconds:>14.3f} {np.sqrt(np.mean(error**2)):>7.3f} {np.sqrt(np.mean(edges**2)):>8.3f}")
+        print(f"{n:>10} " + " ".join(row))
+
+    print(f"\nshort lines, largest error (nT) of the trend of the line without anomalies and of the residual")
+    print(f"{'samples':>10} " + " ".join(f"{name + ' trend':>18} {'residual':>9}" for name, _ in methods))
+    for n in args.short_sizes:
+        tf, anomaly = survey_line(n)
+        row = []
+        for _, trend in methods:
+            background = tf - anomaly
+            trend_error = np.abs(trend(background) - background).max()
+            residual_error = np.abs(tf - trend(tf) - anomaly).max()
+            row.append(f"{trend_error:>18.3f} {residual_error:>9.3f}")
+        print(f"{n:>10} " + " ".join(row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Compares segment_by_heading with the incremental loop it replaces on synthetic flights.
+Run from the tool directory: python -m benchmarks.segmentation [--sizes 10000 100000 1000000]
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from preprocessing.trajectory_segmentation import segment_by_heading, segment_by_heading_incremental
+
+MAX_ANGLE_DIFF = 30
+MIN_SEGMENT_LEN = 10
+
+
+def survey_flight(n, line_len=2000, speed=0.5, noise_deg=1e-7, seed=0):
+    """Lawnmower pattern near Kyiv: lines of `line_len` points `speed` m apart, 20 m between them, GNSS noise."""
+    rng = np.random.default_rng(seed)
+    k = np.arange(n)
+    line, along = np.divmod(k, line_len)
+    along = np.where(line % 2 == 0, along, line_len - 1 - along)
+    north = along * speed
+    east = line * 20.0
+    lat = 50.45 + north / 111320 + rng.normal(0, noise_deg, n)
+    lon = 30.52 + east / (111320 * np.cos(np.radians(50.45))) + rng.normal(0, noise_deg, n)
+    return lat, lon
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--reference_max", type=int, default=10_000,
+                        help="Largest size the incremental loop is run for")
+    args = parser.parse_args()
+
+    print(f"{'points':>10} {'segments':>9} {'incremental s':>14} {'engine s':>9} {'speedup':>8}  identical")
+    for n in args.sizes:
+        lat, lon = survey_flight(n)
+        (track_ids, headings), engine_time = timed(segment_by_heading, lat, lon, MAX_ANGLE_DIFF, MIN_SEGMENT_LEN)
+        segments = int(np.nanmax(track_ids)) + 1 if np.isfinite(track_ids).any() else 0
+
+        if n > args.reference_max:
+            print(f"{n:>10} {segments:>9} {'-':>14} {engine_time:>9.3f} {'-':>8}  -")
+            continue
+        df = pd.DataFrame({'lat': lat, 'lon': lon})
+        (ref_ids, ref_headings), reference_time = timed(segment_by_heading_incremental, df, 'lat', 'lon',
+                                                        MAX_ANGLE_DIFF, MIN_SEGMENT_LEN)
+        identical = np.array_equal(track_ids, ref_ids, equal_nan=True) and np.array_equal(headings, ref_headings,
+                                                                                          equal_nan=True)
+        print(f"{n:>10} {segments:>9} {reference_time:>14.3f} {engine_time:>9.3f} "
+              f"{reference_time / engine_time:>7.0f}x  {identical}")
+
+
+if __name__ == "__main__":
+    main()
@@ -53,5 +53,11 @@ class SensorData:
         self.by = row.By
         self.bz = row.Bz
 
+    @classmethod
+    def from_values(cls, bx, by, bz):
+        sensor = cls.__new__(cls)
+        sensor.bx, sensor.by, sensor.bz = bx, by, bz
+        return sensor
+
     def export_to_csv(self, d="\t"):
         return f"{self.bx:.2f}{d}{self.by:.2f}{d}{self.bz:.2f}{d}"
@@ -0,0 +1,121 @@
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from .combinedRow import CombinedRow, SensorData
+
+# column key -> header label of the _RF product
+RF_COLUMNS = {
+    'timestamp': 'Timestamp [ms]',
+    'b1x': ' B1x [nT]',
+    'b1y': ' B1y [nT]',
+    'b1z': ' B1z [nT]',
+    'b2x': ' B2x [nT]',
+    'b2y': ' B2y [nT]',
+    'b2z': ' B2z [nT]',
+    'acc_x': ' AccX [g]',
+    'acc_y': ' AccY [g]',
+    'acc_z': ' AccZ [g]',
+    'temp': ' Temp [Deg]',
+    'latitude': ' Latitude [Decimal Degrees]',
+    'longitude': ' Longitude [Decimal Degrees]',
+    'altitude': ' Altitude [m]',
+    'satellites': ' Satellites',
+    'quality': ' Quality',
+    'gps_time': ' GPSTime',
+    'gps_date': ' GPSDate',
+    'gps_time_hms': ' GPSTime [hh:mm:ss.sss]',
+}
+
+RF_HEADER = ";".join(RF_COLUMNS.values())
+
+# number of decimals each column has in the _RF product
+RF_PRECISIONS = {
+    'b1x': 2, 'b1y': 2, 'b1z': 2,
+    'b2x': 2, 'b2y': 2, 'b2z': 2,
+    'acc_x': 3, 'acc_y': 3, 'acc_z': 3,
+    'temp': 2,
+    'latitude': 7, 'longitude': 7, 'altitude': 1,
+    'gps_time': 3,
+}
+
+
+def round_like_csv(values: np.ndarray, decimals: int) -> np.ndarray:
+    """
+    Values as they are read back from the '%.{decimals}f' text of the CSV product. np.round scales
+    by 10**decimals first and rounds some values next to a half the other way than the text does.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    scaled = values * 10.0**decimals
+    rounded = np.round(scaled) / 10.0**decimals
+    # elsewhere the direction is the same and k / 10**decimals is the double the text is read as
+    near_half = np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) < 1e-6
+    rounded[near_half] = np.char.mod(f'%.{decimals}f', values[near_half]).astype(np.float64)
+    return rounded
+
+
+def _optional(value):
+    return None if np.isnan(value) else float(value)
+
+
+class CombinedTable:
+    """
+    Columnar counterpart of a list of CombinedRow, one array per RF_COLUMNS key.
+    Missing values (no ACC or GPS match) are NaN.
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        missing = set(RF_COLUMNS) - set(columns)
+        if missing:
+            raise ValueError(f"Missing columns: {sorted(missing)}")
+        self.columns = {key: columns[key] for key in RF_COLUMNS}
+
+    @classmethod
+    def empty(cls, n: int = 0):
+        columns = {key: np.full(n, np.nan) for key in RF_COLUMNS}
+        columns['timestamp'] = np.zeros(n, dtype=np.int64)
+        return cls(columns)
+
+    @classmethod
+    def concat(cls, tables: List['CombinedTable']):
+        if not tables:
+            return cls.empty()
+        return cls({key: np.concatenate([t.columns[key] for t in tables]) for key in RF_COLUMNS})
+
+    def __len__(self):
+        return len(self.columns['timestamp'])
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        return self.columns[key]
+
+    def take(self, index) -> 'CombinedTable':
+        return CombinedTable({key: values[index] for key, values in self.columns.items()})
+
+    def labelled_columns(self, rounded: bool = True) -> Dict[str, np.ndarray]:
+        """Columns under their RF header labels, rounded like in the CSV product."""
+        return {
+            RF_COLUMNS[key]: round_like_csv(values, RF_PRECISIONS[key]) if rounded and key in RF_PRECISIONS else values
+            for key, values in self.columns.items()
+        }
+
+    def to_dataframe(self, rounded: bool = True):
+        import pandas as pd
+        return pd.DataFrame(self.labelled_columns(rounded))
+
+    def rows(self, index: Optional[np.ndarray] = None) -> Iterator[CombinedRow]:
+        """Lazily builds CombinedRow objects, e.g. for export_to_csv."""
+        c = self.columns
+        for i in range(len(self)) if index is None else index:
+            yield CombinedRow(
+                timestamp=int(c['timestamp'][i]),
+                sensor1=SensorData.from_values(float(c['b1x'][i]), float(c['b1y'][i]), float(c['b1z'][i])),
+                sensor2=SensorData.from_values(float(c['b2x'][i]), float(c['b2y'][i]), float(c['b2z'][i])),
+                acc_x=_optional(c['acc_x'][i]),
+                acc_y=_optional(c['acc_y'][i]),
+                acc_z=_optional(c['acc_z'][i]),
+                temp=float(c['temp'][i]),
+                latitude=_optional(c['latitude'][i]),
+                longitude=_optional(c['longitude'][i]),
+                altitude=_optional(c['altitude'][i]),
+                gps_time=_optional(c['gps_time'][i]),
+            )
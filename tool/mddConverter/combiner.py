@@ -0,0 +1,178 @@
+from typing import Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+from .combinedTable import CombinedTable
+from .decoder import DecodedRecords
+from .magRow import MagRowType
+
+# how far (in ms) the stream has to move past a combined row before no GPS record can match it any more
+GPS_MATCH_HORIZON_MS = 1000
+GPS_MATCH_TOLERANCE_MS = 3
+
+# ACC records are paired when strictly closer than this (timestamps are integer ms)
+ACC_MATCH_TOLERANCE_MS = 3
+# and only if they are among the records from ACC_NEIGHBOURHOOD_BEFORE before the magnetometer record
+# to ACC_NEIGHBOURHOOD_SIZE records from there, as the row-by-row combiner looked for them
+ACC_NEIGHBOURHOOD_BEFORE = 3
+ACC_NEIGHBOURHOOD_SIZE = 6
+
+
+def match_first(target_ts: np.ndarray, query_ts: np.ndarray, lo: int, hi: int) -> np.ndarray:
+    """
+    For every query timestamp q finds the earliest target with q + lo <= ts <= q + hi.
+    Returns indices into target_ts, -1 where nothing matches.
+    """
+    if len(target_ts) == 0:
+        return np.full(len(query_ts), -1, dtype=np.int64)
+
+    order = np.argsort(target_ts, kind='stable')
+    sorted_ts = target_ts[order]
+    pos = np.searchsorted(sorted_ts, query_ts + lo, side='left')
+    pos_clipped = np.minimum(pos, len(sorted_ts) - 1)
+    found = (pos < len(sorted_ts)) & (sorted_ts[pos_clipped] <= query_ts + hi)
+    return np.where(found, order[pos_clipped], -1)
+
+
+def match_neighbour(target_ids: np.ndarray, target_ts: np.ndarray, query_ids: np.ndarray, query_ts: np.ndarray,
+                    tolerance: int, before: int, size: int) -> np.ndarray:
+    """
+    For every query record finds the first target (in record order) among the `size` records starting
+    `before` records ahead of it whose timestamp is closer than `tolerance`. target_ids must be sorted.
+    Returns indices into the targets, -1 where nothing matches.
+    """
+    result = np.full(len(query_ids), -1, dtype=np.int64)
+    if len(target_ids) == 0:
+        return result
+    start = np.maximum(query_ids - before, 0)
+    pos = np.searchsorted(target_ids, start, side='left')
+    for k in range(size):
+        candidate = np.minimum(pos + k, len(target_ids) - 1)
+        hit = ((result < 0) & (pos + k < len(target_ids)) & (target_ids[candidate] < start + size)
+               & (np.abs(target_ts[candidate] - query_ts) < tolerance))
+        result[hit] = candidate[hit]
+    return result
+
+
+def last_per_target(targets: np.ndarray) -> np.ndarray:
+    """Positions of the last occurrence of every matched target (later records overwrite earlier ones)."""
+    hits = np.flatnonzero(targets >= 0)[::-1]
+    _, first_in_reversed = np.unique(targets[hits], return_index=True)
+    return hits[first_in_reversed]
+
+
+def join_records(records: DecodedRecords) -> Tuple[CombinedTable, np.ndarray, np.ndarray]:
+    """
+    Builds one combined row per channel 1 magnetometer record, with raw timestamps.
+    Returns the table, a mask of rows that found their sensor 2 record and, for every
+    GPS record, the index of the row it was written to (-1 if none).
+    """
+    mag = records.of_type(MagRowType.MAG)
+    mag1 = mag[mag['channel'] == 1]
+    mag2 = mag[mag['channel'] == 2]
+    acc = records.of_type(MagRowType.ACC)
+    gps = records.of_type(MagRowType.GPS)
+
+    ts = mag1['timestamp'].astype(np.int64)
+    table = CombinedTable.empty(len(ts))
+    c = table.columns
+    c['timestamp'] = ts
+    c['b1x'], c['b1y'], c['b1z'] = (mag1[f].astype(np.float64) for f in ('Bx', 'By', 'Bz'))
+    c['temp'] = mag1['temp'].astype(np.float64)
+
+    i2 = match_first(mag2['timestamp'].astype(np.int64), ts, 0, 0)
+    found2 = i2 >= 0
+    for key, f in (('b2x', 'Bx'), ('b2y', 'By'), ('b2z', 'Bz')):
+        c[key][found2] = mag2[f][i2[found2]]
+
+    i_acc = match_neighbour(records.ids_of_type(MagRowType.ACC), acc['timestamp'].astype(np.int64),
+                            records.ids_of_type(MagRowType.MAG)[mag['channel'] == 1], ts,
+                            ACC_MATCH_TOLERANCE_MS, ACC_NEIGHBOURHOOD_BEFORE, ACC_NEIGHBOURHOOD_SIZE)
+    has_acc = i_acc >= 0
+    for f in ('acc_x', 'acc_y', 'acc_z'):
+        c[f][has_acc] = acc[f][i_acc[has_acc]]
+
+    tol = GPS_MATCH_TOLERANCE_MS
+    gps_target = match_first(ts, gps['timestamp'].astype(np.int64), -tol, tol)
+    chosen = last_per_target(gps_target)
+    rows = gps_target[chosen]
+    for f in ('latitude', 'longitude', 'altitude', 'gps_time'):
+        c[f][rows] = gps[f][chosen]
+
+    return table, found2, gps_target
+
+
+def combine_records(records: DecodedRecords) -> CombinedTable:
+    """Columnar version of the row-by-row combiner: pairs records by timestamp instead of scanning neighbours."""
+    combiner = StreamingCombiner()
+    return CombinedTable.concat([combiner.push(records), combiner.finish()])
+
+
+class StreamingCombiner:
+    """
+    Combines record blocks as they arrive. Rows newer than `horizon_ms` behind the
+    latest timestamp are held back, together with the records they may still pair with.
+    """
+
+    def __init__(self, horizon_ms: int = GPS_MATCH_HORIZON_MS, first_ts: Optional[int] = None):
+        self.horizon_ms = horizon_ms
+        # raw timestamp that becomes 0, by default the one of the first row
+        self.first_ts = first_ts
+        self._carry = DecodedRecords.concat([])
+
+    def push(self, block: DecodedRecords) -> CombinedTable:
+        records = DecodedRecords.concat([self._carry, block])
+        if not len(records):
+            return CombinedTable.empty()
+        cut = int(records.records['timestamp'].max()) - self.horizon_ms
+        return self._combine(records, cut)
+
+    def finish(self, until: Optional[int] = None) -> CombinedTable:
+        """Emits the held rows, only those up to the raw timestamp `until` if the input was cut off there."""
+        records, self._carry = self._carry, DecodedRecords.concat([])
+        return self._combine(records, None if until is None else until + 1, keep_carry=False)
+
+    def _combine(self, records: DecodedRecords, cut: Optional[int], keep_carry=True) -> CombinedTable:
+        table, found2, gps_target = join_records(records)
+        ts = table['timestamp']
+        done = np.ones(len(ts), dtype=bool) if cut is None else ts < cut
+
+        if not found2[done].all():
+            raise Exception("Sensor 2 data not found")
+
+        if cut is not None and keep_carry:
+            self._carry = records.take(self._carry_mask(records, cut, gps_target, done))
+
+        table = table.take(done)
+        if len(table):
+            if self.first_ts is None:
+                self.first_ts = int(table['timestamp'][0])
+            table.columns['timestamp'] = table['timestamp'] - self.first_ts
+        return table
+
+    @staticmethod
+    def _carry_mask(records: DecodedRecords, cut: int, gps_target: np.ndarray, done: np.ndarray) -> np.ndarray:
+        rec_ts = records.records['timestamp'].astype(np.int64)
+        keep = np.zeros(len(records), dtype=bool)
+
+        # held rows and their sensor 2 partners have ts >= cut, their ACC records ts > cut - tolerance
+        keep |= records.mask(MagRowType.MAG) & (rec_ts >= cut)
+        keep |= records.mask(MagRowType.ACC) & (rec_ts > cut - ACC_MATCH_TOLERANCE_MS)
+
+        # GPS records already written to an emitted row are finished
+        gps = records.mask(MagRowType.GPS)
+        used = (gps_target >= 0) & done[np.maximum(gps_target, 0)] if len(done) else np.zeros(len(gps_target), dtype=bool)
+        keep[np.flatnonzero(gps)] = ~used & (rec_ts[gps] >= cut - GPS_MATCH_TOLERANCE_MS)
+        return keep
+
+
+def iter_combined_tables(blocks: Iterable[DecodedRecords], horizon_ms: int = GPS_MATCH_HORIZON_MS,
+                         first_ts: Optional[int] = None, until: Optional[int] = None) -> Iterator[CombinedTable]:
+    combiner = StreamingCombiner(horizon_ms, first_ts)
+    for block in blocks:
+        table = combiner.push(block)
+        if len(table):
+            yield table
+    table = combiner.finish(until)
+    if len(table):
+        yield table
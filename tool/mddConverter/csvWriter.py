@@ -0,0 +1,77 @@
+from typing import List, Optional, TextIO
+
+import numpy as np
+
+from .combinedTable import CombinedTable, RF_HEADER, RF_PRECISIONS
+from .decoder import DecodedRecords, ROW_CLASSES
+from .magRow import MagRowType
+
+BLOCK_ROWS = 100_000
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# column key -> (printf format, empty when missing); None format -> always empty
+RF_FORMATS = {
+    'timestamp': ('%d', False),
+    **{key: (f'%.{RF_PRECISIONS[key]}f', False) for key in ('b1x', 'b1y', 'b1z', 'b2x', 'b2y', 'b2z')},
+    **{key: (f'%.{RF_PRECISIONS[key]}f', True) for key in ('acc_x', 'acc_y', 'acc_z', 'temp', 'latitude', 'longitude', 'altitude')},
+    'satellites': ('%d', True),
+    'quality': ('%d', True),
+    'gps_time': (f'%.{RF_PRECISIONS["gps_time"]}f', True),
+    # GPS date and time of day are never decoded from MDD files
+    'gps_date': (None, True),
+    'gps_time_hms': (None, True),
+}
+
+_TYPE_NAMES = np.array([str(MagRowType.get_name(i)) for i in range(256)], dtype=object)
+_TYPES_WITH_VALUES = np.isin(np.arange(256), list(ROW_CLASSES))
+
+
+def format_column(values: np.ndarray, fmt: Optional[str], optional: bool) -> List[str]:
+    """Formats a whole column like format(value, spec) would, '' for missing values."""
+    if fmt is None:
+        return [''] * len(values)
+    if not optional:
+        return [fmt % v for v in values.tolist()]
+
+    out = np.full(len(values), '', dtype=object)
+    present = ~np.isnan(values)
+    out[present] = [fmt % v for v in values[present].tolist()]
+    return out.tolist()
+
+
+def open_csv(path) -> TextIO:
+    return open(path, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE)
+
+
+def write_rf_header(f: TextIO, d=";"):
+    f.write(RF_HEADER.replace(";", d) + "\n")
+
+
+def write_rf_csv(f: TextIO, table: CombinedTable, d=";", block_rows=BLOCK_ROWS):
+    """Same lines as CombinedRow.export_to_csv, built a column at a time."""
+    for start in range(0, len(table), block_rows):
+        stop = start + block_rows
+        columns = [format_column(table[key][start:stop], fmt, optional) for key, (fmt, optional) in RF_FORMATS.items()]
+        f.write("\n".join(map(d.join, zip(*columns))) + "\n")
+
+
+def write_of_csv(f: TextIO, records: DecodedRecords, block_rows=BLOCK_ROWS):
+    """Same lines as str(MagRow), built a column at a time."""
+    for start in range(0, len(records), block_rows):
+        r = records.records[start:start + block_rows]
+        head = zip(
+            map(str, r['first'].tolist()),
+            _TYPE_NAMES[r['data_type']].tolist(),
+            map(str, r['channel'].tolist()),
+            map(str, r['type2'].tolist()),
+            map(str, r['timestamp'].tolist()),
+        )
+        # floats go through Python's repr, as in the f-strings of MagRow.__str__
+        tail = zip(*(map(str, r[name].astype(np.float64).tolist()) for name in ('value1', 'value2', 'value3', 'trailer')))
+        has_values = _TYPES_WITH_VALUES[r['data_type']].tolist()
+
+        lines = (
+            "\t".join(h) + ("\t" + "\t".join(t) if v else "")
+            for h, t, v in zip(head, tail, has_values)
+        )
+        f.write("\n".join(lines) + "\n")
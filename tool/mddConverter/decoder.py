@@ -0,0 +1,115 @@
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from .magRow import MagRow, MagRowB, MagRowAcc, MagRowGps, MagRowType
+
+RECORD_WIDTH = 36
+
+_HEADER_FIELDS = [
+    ('first', 'u1'),
+    ('data_type', 'u1'),
+    ('channel', 'u1'),
+    ('type2', 'u1'),
+    ('timestamp', '<u4'),
+]
+
+# generic layout, used when the record type is not known yet
+RECORD_DTYPE = np.dtype(_HEADER_FIELDS + [
+    ('value1', '<f8'), ('value2', '<f8'), ('value3', '<f8'),
+    ('trailer', '<f4'),
+])
+
+MAG_DTYPE = np.dtype(_HEADER_FIELDS + [
+    ('Bx', '<f8'), ('By', '<f8'), ('Bz', '<f8'),
+    ('temp', '<f4'),
+])
+
+ACC_DTYPE = np.dtype(_HEADER_FIELDS + [
+    ('acc_x', '<f8'), ('acc_y', '<f8'), ('acc_z', '<f8'),
+    ('temp', '<f4'),
+])
+
+GPS_DTYPE = np.dtype(_HEADER_FIELDS + [
+    ('latitude', '<f8'), ('longitude', '<f8'), ('altitude', '<f8'),
+    ('gps_time', '<f4'),
+])
+
+DTYPES = {
+    MagRowType.MAG: MAG_DTYPE,
+    MagRowType.ACC: ACC_DTYPE,
+    MagRowType.GPS: GPS_DTYPE,
+}
+
+ROW_CLASSES = {
+    MagRowType.MAG: MagRowB,
+    MagRowType.ACC: MagRowAcc,
+    MagRowType.GPS: MagRowGps,
+}
+
+
+class DecodedRecords:
+    """
+    Columnar view over a buffer of 36-byte MDD records.
+    `records` is a structured array with RECORD_DTYPE, `ids` are the record
+    numbers in the source file (what MagRow.id used to be).
+    """
+
+    def __init__(self, records: np.ndarray, ids: Optional[np.ndarray] = None):
+        self.records = records
+        self.ids = ids if ids is not None else np.arange(len(records), dtype=np.int64)
+        self.byte_offset = 0  # file offset of the first record, set by the readers
+        self._masks: Dict[int, np.ndarray] = {}
+
+    @classmethod
+    def concat(cls, parts: List['DecodedRecords']) -> 'DecodedRecords':
+        parts = [p for p in parts if len(p)]
+        if not parts:
+            return cls(np.empty(0, dtype=RECORD_DTYPE))
+        if len(parts) == 1:
+            return parts[0]
+        return cls(np.concatenate([p.records for p in parts]), np.concatenate([p.ids for p in parts]))
+
+    def __len__(self):
+        return len(self.records)
+
+    def take(self, index) -> 'DecodedRecords':
+        return DecodedRecords(self.records[index], self.ids[index])
+
+    def mask(self, data_type: int) -> np.ndarray:
+        if data_type not in self._masks:
+            self._masks[data_type] = self.records['data_type'] == data_type
+        return self._masks[data_type]
+
+    def of_type(self, data_type: MagRowType) -> np.ndarray:
+        """Records of one type, viewed with the layout of that type."""
+        return self.records[self.mask(data_type)].view(DTYPES[data_type])
+
+    def ids_of_type(self, data_type: MagRowType) -> np.ndarray:
+        return self.ids[self.mask(data_type)]
+
+    def columns(self, data_type: MagRowType) -> Dict[str, np.ndarray]:
+        records = self.of_type(data_type)
+        return {name: records[name] for name in records.dtype.names}
+
+    def raw_columns(self) -> Dict[str, np.ndarray]:
+        """All records with the generic layout, columns as in the _OF product."""
+        return {name: self.records[name] for name in RECORD_DTYPE.names}
+
+    def rows(self) -> Iterator[MagRow]:
+        """Lazily builds the MagRow objects, for code that still works row by row."""
+        raw = self.records.view(np.uint8).reshape(-1, RECORD_WIDTH)
+        for idx, data_type, row_data in zip(self.ids, self.records['data_type'], raw):
+            row_class = ROW_CLASSES.get(int(data_type), MagRow)
+            yield row_class(int(idx), row_data.tobytes())
+
+
+def decode_records(data, first_id: int = 0) -> DecodedRecords:
+    """
+    Views a whole buffer of MDD records as a structured array, without copying.
+    A trailing incomplete record is ignored, as create_rows always did.
+    """
+    count = len(data) // RECORD_WIDTH
+    records = np.frombuffer(data, dtype=RECORD_DTYPE, count=count)
+    ids = np.arange(first_id, first_id + count, dtype=np.int64)
+    return DecodedRecords(records, ids)
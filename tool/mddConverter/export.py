@@ -0,0 +1,106 @@
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+# output format -> file extension
+OUTPUT_FORMATS = {
+    'csv': '.csv',
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+    'npz': '.npz',
+}
+
+
+def output_path(input_path: Path, suffix: str, output_format: str) -> Path:
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format}. Expected one of {list(OUTPUT_FORMATS)}")
+    return input_path.with_name(input_path.stem + suffix + OUTPUT_FORMATS[output_format])
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError("Parquet and Arrow output need pyarrow. Install it or use the 'npz' format") from e
+    return pyarrow
+
+
+class ColumnWriter:
+    """Writes blocks of columns (name -> array) to one typed, columnar file."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def write(self, columns: Dict[str, np.ndarray]):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class NpzWriter(ColumnWriter):
+    """No extra dependencies, but NPZ can't be appended to, so blocks are kept until close()."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._blocks: List[Dict[str, np.ndarray]] = []
+
+    def write(self, columns):
+        self._blocks.append(columns)
+
+    def close(self):
+        if not self._blocks:
+            return
+        names = list(self._blocks[0])
+        merged = {name: np.concatenate([b[name] for b in self._blocks]) for name in names}
+        with open(self.path, 'wb') as f:
+            np.savez(f, **merged)
+        self._blocks = []
+
+
+class ArrowWriter(ColumnWriter):
+    def __init__(self, path):
+        super().__init__(path)
+        self.pa = _import_pyarrow()
+        self._writer = None
+
+    def _open(self, schema):
+        import pyarrow.ipc
+        return pyarrow.ipc.new_file(str(self.path), schema)
+
+    def write(self, columns):
+        table = self.pa.Table.from_pydict(columns)
+        if self._writer is None:
+            self._writer = self._open(table.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class ParquetWriter(ArrowWriter):
+    def _open(self, schema):
+        import pyarrow.parquet
+        return pyarrow.parquet.ParquetWriter(str(self.path), schema)
+
+
+COLUMN_WRITERS = {
+    'parquet': ParquetWriter,
+    'arrow': ArrowWriter,
+    'npz': NpzWriter,
+}
+
+
+def open_column_writer(path, output_format: str) -> ColumnWriter:
+    if output_format not in COLUMN_WRITERS:
+        raise ValueError(f"No columnar writer for format: {output_format}")
+    return COLUMN_WRITERS[output_format](path)
@@ -1,95 +1,62 @@
 import argparse
-from typing import List
+import logging
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator, List, Union
 
-from .magRow import  MagRow, MagRowB, MagRowAcc, MagRowType, MagRowGps
-from .combinedRow import CombinedRow, SensorData
+import numpy as np
+
+from .combinedRow import CombinedRow
+from .combiner import iter_combined_tables
+from .decoder import RECORD_DTYPE, DecodedRecords
+from .magRow import MagRow
+from .stream import iter_mdd_blocks
+from .validation import validate_framing
+
+# MagRows handed to the StreamingCombiner at a time by create_combined_rows
+ROWS_PER_BLOCK = 100_000
 
 
 def create_rows(data: bytes) -> List[MagRow]:
-    width = 36
-    output = []
-    for i in range(0, len(data), width):
-        row_data = data[i:i+width]
-        if len(row_data) < width:
-            continue
-        type_ = row_data[1]
-        try:
-            if type_ == MagRowType.MAG:
-                row = MagRowB(i // width, row_data)
-
-            elif type_ == MagRowType.ACC:
-                row = MagRowAcc(i // width, row_data)
-            elif type_ == MagRowType.GPS:
-                row = MagRowGps(i // width, row_data)
-            else:
-                row = MagRow(i // width, row_data)
-            output.append(row)
-        except Exception as e:
-            print(f"Error parsing row {i // width}: {e}")
-    return output
-
-
-def create_combined_rows(rows: List[MagRow]) -> List[CombinedRow]:
-    combined_rows: List[CombinedRow] = []
-
-    for i, row in enumerate(rows):
-        if isinstance(row, MagRowB) and row.channel == 1:
-            start_idx = max(0, i - 3)
-            range_slice = rows[start_idx:start_idx + 6]
-
-            mag2 = next(
-                (r for r in range_slice if isinstance(r, MagRowB) and r.timestamp == row.timestamp and r.channel == 2),
-                None
-            )
-            if mag2 is None:
-                raise Exception("Sensor 2 data not found")
-
-            acc = next(
-                (r for r in range_slice if isinstance(r, MagRowAcc) and abs(r.timestamp - row.timestamp) < 3),
-                None
-            )
-
-            combined = CombinedRow(
-                timestamp=row.timestamp,
-                sensor1=SensorData(row),
-                sensor2=SensorData(mag2),
-                acc_x=acc.acc_x if acc else None,
-                acc_y=acc.acc_y if acc else None,
-                acc_z=acc.acc_z if acc else None,
-                temp=row.temp
-            )
-
-            combined_rows.append(combined)
-
-    i_gps = 0
-    for gps_row in filter(lambda r: r.data_type == MagRowType.GPS, rows):
-        gps = gps_row if isinstance(gps_row, MagRowGps) else None
-        if gps is None:
-            raise Exception("Incorrect gps row")
-
-        while i_gps < len(combined_rows) and abs(gps.timestamp - combined_rows[i_gps].timestamp) > 3:
-            i_gps += 1
-
-        if i_gps == len(combined_rows):
-            i_gps = 0
-            continue
-
-        cr = combined_rows[i_gps]
-        cr.latitude = gps.latitude
-        cr.longitude = gps.longitude
-        cr.altitude = gps.altitude
-        cr.gps_time = gps.gps_time
-
-    if combined_rows:
-        first_ts = combined_rows[0].timestamp
-        for row in combined_rows:
-            row.timestamp -= first_ts
-
-    return combined_rows
+    records, report, _ = validate_framing(data)
+    if not report.ok:
+        logging.getLogger(__name__).warning(f"Broken framing: {report}")
+    return list(records.rows())
+
+
+def create_combined_rows(source: Union[str, Path, Iterable[MagRow]]) -> Iterator[CombinedRow]:
+    """
+    Combined rows of an MDD file, read block by block with iter_mdd_blocks, or of a stream of rows
+    (e.g. create_rows), batched into blocks. Both go through the StreamingCombiner, so only a block
+    and the rows it holds back are in memory.
+    """
+    blocks = iter_mdd_blocks(source) if isinstance(source, (str, Path)) else _row_blocks(source)
+    for table in iter_combined_tables(blocks):
+        yield from table.rows()
+
+
+def _row_blocks(rows: Iterable[MagRow]) -> Iterator[DecodedRecords]:
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, ROWS_PER_BLOCK))
+        if not batch:
+            return
+        records = np.frombuffer(b"".join(row.data for row in batch), dtype=RECORD_DTYPE)
+        yield DecodedRecords(records, np.array([row.id for row in batch], dtype=np.int64))
+
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description="Binary Data Parser")
     parser.add_argument("--input", required=True, help="Input binary file path")
+    parser.add_argument("--save_OF", action="store_true", help="Also save the records in the original format (_OF)")
+    parser.add_argument("--format", default="csv", choices=["csv", "parquet", "arrow", "npz"], help="Output format")
+    parser.add_argument("--window", type=float, nargs=2, metavar=("START_MS", "END_MS"),
+                        help="Convert only this time window (ms from the start of the flight), using the sidecar index")
+    parser.add_argument("--follow", action="store_true",
+                        help="Keep converting a file that is still being written, until Ctrl+C or --idle_timeout")
+    parser.add_argument("--poll_interval", type=float, default=1.0, help="Seconds between checks for new data (--follow)")
+    parser.add_argument("--idle_timeout", type=float, default=None,
+                        help="Stop following after this many seconds without new data")
     return parser.parse_args()
 
 
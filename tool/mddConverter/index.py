@@ -0,0 +1,136 @@
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .decoder import RECORD_WIDTH
+from .magRow import MagRowType
+from .stream import iter_mdd_blocks
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".idx"
+INDEX_BLOCK_RECORDS = 64 * 1024
+
+# columns of MddIndex.counts, the last one counts unknown record types
+COUNTED_TYPES = [MagRowType.MAG, MagRowType.ACC, MagRowType.GPS, MagRowType.DATA]
+
+
+@dataclass
+class MddIndex:
+    """
+    Sidecar index of an MDD file: one entry per block of `block_records` records
+    with its byte offset, timestamp range and the number of records of each type.
+    """
+    file_size: int
+    mtime_ns: int
+    block_records: int
+    offsets: np.ndarray
+    ts_min: np.ndarray
+    ts_max: np.ndarray
+    counts: np.ndarray
+    first_timestamp: Optional[int] = None  # of the first channel 1 MAG record, i.e. time 0 of the RF product
+
+    def is_valid_for(self, input_path) -> bool:
+        stat = Path(input_path).stat()
+        return stat.st_size == self.file_size and stat.st_mtime_ns == self.mtime_ns
+
+    def type_counts(self) -> dict:
+        totals = self.counts.sum(axis=0)
+        counts = {t: int(n) for t, n in zip(COUNTED_TYPES, totals)}
+        counts['other'] = int(totals[-1])
+        return counts
+
+    def byte_range(self, start_ts: Optional[int], end_ts: Optional[int]) -> Tuple[int, int]:
+        """Byte range [start, stop) covering every block that overlaps the raw timestamp range."""
+        overlap = np.ones(len(self.offsets), dtype=bool)
+        if start_ts is not None:
+            overlap &= self.ts_max >= start_ts
+        if end_ts is not None:
+            overlap &= self.ts_min <= end_ts
+
+        blocks = np.flatnonzero(overlap)
+        if len(blocks) == 0:
+            return 0, 0
+        stop = self.offsets[blocks[-1] + 1] if blocks[-1] + 1 < len(self.offsets) else self.file_size
+        return int(self.offsets[blocks[0]]), int(stop)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            np.savez(
+                f,
+                version=INDEX_VERSION,
+                header=np.array([self.file_size, self.mtime_ns, self.block_records,
+                                 -1 if self.first_timestamp is None else self.first_timestamp], dtype=np.int64),
+                offsets=self.offsets, ts_min=self.ts_min, ts_max=self.ts_max, counts=self.counts,
+            )
+
+    @classmethod
+    def load(cls, path) -> Optional['MddIndex']:
+        with np.load(path) as f:
+            if int(f['version']) != INDEX_VERSION:
+                return None
+            file_size, mtime_ns, block_records, first_timestamp = (int(v) for v in f['header'])
+            return cls(file_size, mtime_ns, block_records, f['offsets'], f['ts_min'], f['ts_max'], f['counts'],
+                       None if first_timestamp < 0 else first_timestamp)
+
+
+def index_path(input_path) -> Path:
+    input_path = Path(input_path)
+    return input_path.with_name(input_path.name + INDEX_SUFFIX)
+
+
+def build_index(input_path, block_records: int = INDEX_BLOCK_RECORDS) -> MddIndex:
+    """Builds the index in one pass over the file."""
+    stat = Path(input_path).stat()
+    offsets, ts_min, ts_max, counts = [], [], [], []
+    first_timestamp = None
+
+    for block in iter_mdd_blocks(input_path, block_records * RECORD_WIDTH):
+        ts = block.records['timestamp']
+        data_type = block.records['data_type']
+        offsets.append(block.byte_offset)
+        ts_min.append(ts.min())
+        ts_max.append(ts.max())
+
+        known = [np.count_nonzero(data_type == t) for t in COUNTED_TYPES]
+        counts.append(known + [len(block) - sum(known)])
+
+        if first_timestamp is None:
+            first_mag1 = np.flatnonzero(block.mask(MagRowType.MAG) & (block.records['channel'] == 1))
+            if len(first_mag1):
+                first_timestamp = int(ts[first_mag1[0]])
+
+    return MddIndex(
+        file_size=stat.st_size,
+        mtime_ns=stat.st_mtime_ns,
+        block_records=block_records,
+        offsets=np.array(offsets, dtype=np.int64),
+        ts_min=np.array(ts_min, dtype=np.int64),
+        ts_max=np.array(ts_max, dtype=np.int64),
+        counts=np.array(counts, dtype=np.int64).reshape(-1, len(COUNTED_TYPES) + 1),
+        first_timestamp=first_timestamp,
+    )
+
+
+def load_or_build_index(input_path, block_records: int = INDEX_BLOCK_RECORDS, save: bool = True) -> MddIndex:
+    """Reuses the sidecar index if it still matches the file, otherwise builds (and saves) a new one."""
+    logger = logging.getLogger(__name__)
+    path = index_path(input_path)
+
+    if path.exists():
+        try:
+            index = MddIndex.load(path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Can't read index {path}: {e}")
+            index = None
+        if index is not None and index.block_records == block_records and index.is_valid_for(input_path):
+            return index
+        logger.info(f"Index {path} is outdated, rebuilding")
+
+    index = build_index(input_path, block_records)
+    if save:
+        index.save(path)
+        logger.info(f"Index saved to {path}")
+    return index
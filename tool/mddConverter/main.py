@@ -1,9 +1,109 @@
 import logging
+import time
+from contextlib import ExitStack
 from pathlib import Path
-from .functions import create_rows, create_combined_rows, parse_arguments
+from typing import Optional, Tuple
 
+import numpy as np
 
-def convert_mdd_to_csv(input, save_OF=False):
+from .combinedTable import CombinedTable
+from .combiner import GPS_MATCH_HORIZON_MS, StreamingCombiner, iter_combined_tables
+from .csvWriter import open_csv, write_of_csv, write_rf_csv, write_rf_header
+from .decoder import DecodedRecords
+from .export import open_column_writer, output_path
+from .functions import parse_arguments
+from .index import load_or_build_index
+from .stream import DEFAULT_BLOCK_SIZE, RecordStream, iter_mdd_blocks
+from .validation import FramingReport
+
+# records from which a followed file's marker byte is detected, about a second of logging
+FOLLOW_MARKER_SAMPLE_RECORDS = 512
+
+
+def open_rf_writer(stack: ExitStack, path: Path, output_format: str, flush=False):
+    if output_format == 'csv':
+        f = stack.enter_context(open_csv(path))
+        write_rf_header(f)
+
+        def write(table):
+            write_rf_csv(f, table)
+            if flush:
+                f.flush()
+        return write
+
+    writer = stack.enter_context(open_column_writer(path, output_format))
+    # fixes the schema even if the input has no records
+    writer.write(CombinedTable.empty().labelled_columns())
+    return lambda table: writer.write(table.labelled_columns())
+
+
+def open_of_writer(stack: ExitStack, path: Path, output_format: str, flush=False):
+    if output_format == 'csv':
+        f = stack.enter_context(open_csv(path))
+
+        def write(records):
+            write_of_csv(f, records)
+            if flush:
+                f.flush()
+        return write
+
+    writer = stack.enter_context(open_column_writer(path, output_format))
+    writer.write(DecodedRecords.concat([]).raw_columns())
+    return lambda records: writer.write(records.raw_columns())
+
+
+def iter_converted_tables(input_path: Path, save_RF=True, save_OF=False, block_size=DEFAULT_BLOCK_SIZE,
+                          output_format='csv', time_window: Optional[Tuple[float, float]] = None):
+    """
+    Decodes the file block by block, optionally writing the _RF/_OF products on the way.
+    `time_window` = (start, end) in ms of the RF timestamps limits the output to that
+    interval; only the byte ranges the sidecar index points to are read.
+    """
+    start = 0
+    stop = None
+    first_ts = None
+    raw_window = None
+    if time_window is not None:
+        index = load_or_build_index(input_path)
+        first_ts = index.first_timestamp or 0
+        raw_window = (first_ts + time_window[0], first_ts + time_window[1])
+        # margin for the records the window edges are paired with
+        start, stop = index.byte_range(raw_window[0] - GPS_MATCH_HORIZON_MS, raw_window[1] + GPS_MATCH_HORIZON_MS)
+
+    report = FramingReport()
+
+    with ExitStack() as stack:
+        write_of = open_of_writer(stack, output_path(input_path, "_OF", output_format), output_format) if save_OF else None
+        write_rf = open_rf_writer(stack, output_path(input_path, "_RF", output_format), output_format) if save_RF else None
+
+        def stream_blocks():
+            if stop == 0:
+                return
+            for block in iter_mdd_blocks(input_path, block_size, start, stop, report=report):
+                if write_of is not None:
+                    if raw_window is None:
+                        write_of(block)
+                    else:
+                        ts = block.records['timestamp']
+                        write_of(block.take((ts >= raw_window[0]) & (ts <= raw_window[1])))
+                yield block
+
+        until = None if raw_window is None else int(np.floor(raw_window[1]))
+        for table in iter_combined_tables(stream_blocks(), first_ts=first_ts, until=until):
+            if time_window is not None:
+                ts = table['timestamp']
+                table = table.take((ts >= time_window[0]) & (ts <= time_window[1]))
+                if not len(table):
+                    continue
+            if write_rf is not None:
+                write_rf(table)
+            yield table
+
+    if not report.ok:
+        logging.getLogger(__name__).warning(f"Broken framing in {input_path}: {report}")
+
+
+def convert_mdd_to_csv(input, save_OF=False, block_size=DEFAULT_BLOCK_SIZE, output_format='csv', time_window=None):
     logger = logging.getLogger(__name__)
 
     input_path = Path(input)
@@ -11,31 +111,105 @@ def convert_mdd_to_csv(input, save_OF=False):
         logger.error(f"Incorrect input path: {input_path}")
         return
 
-    original_format_path = input_path.with_name(input_path.stem + "_OF.csv")
-    combined_format_path = input_path.with_name(input_path.stem + "_RF.csv")
-
-    data = input_path.read_bytes()
-    rows = create_rows(data)
+    for _ in iter_converted_tables(input_path, True, save_OF, block_size, output_format, time_window):
+        pass
 
     if save_OF:
-        with open(original_format_path, 'w', encoding='utf-8') as f:
-            for r in rows:
-                f.write(str(r) + "\n")
-        logger.info(f"Output original: {original_format_path}")
+        logger.info(f"Output original: {output_path(input_path, '_OF', output_format)}")
 
+    return output_path(input_path, "_RF", output_format)
 
-    combined = create_combined_rows(rows)
-    header = "Timestamp [ms]; B1x [nT]; B1y [nT]; B1z [nT]; B2x [nT]; B2y [nT]; B2z [nT]; AccX [g]; AccY [g]; AccZ [g]; Temp [Deg]; Latitude [Decimal Degrees]; Longitude [Decimal Degrees]; Altitude [m]; Satellites; Quality; GPSTime; GPSDate; GPSTime [hh:mm:ss.sss]"
 
-    with open(combined_format_path, 'w', encoding='utf-8') as f:
-        f.write(header + "\n")
-        for row in combined:
-            f.write(row.export_to_csv(";") + "\n")
+def decode_mdd(input, save_RF=False, save_OF=False, block_size=DEFAULT_BLOCK_SIZE, output_format='csv',
+               time_window=None) -> Optional[CombinedTable]:
+    """Same as convert_mdd_to_csv, but returns the combined table; writing the products is optional."""
+    logger = logging.getLogger(__name__)
+
+    input_path = Path(input)
+    if not input_path.exists():
+        logger.error(f"Incorrect input path: {input_path}")
+        return None
+
+    tables = list(iter_converted_tables(input_path, save_RF, save_OF, block_size, output_format, time_window))
+    return CombinedTable.concat(tables)
+
+def follow_mdd(input, save_OF=False, output_format='csv', poll_interval=1.0, idle_timeout=None,
+               block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Converts a file that is still being written. Polls it for appended bytes, decodes only the
+    new complete records and appends the rows that can't change anymore to the products, so
+    every update costs as much as the new data. Stops after `idle_timeout` seconds without new
+    data (never by default) or on Ctrl+C, then writes the rows that were held back.
+    Binary formats are complete only after that, CSV files are flushed on every update.
+    """
+    logger = logging.getLogger(__name__)
+
+    input_path = Path(input)
+    if not input_path.exists():
+        logger.error(f"Incorrect input path: {input_path}")
+        return
+
+    # a live file is expected to be well framed, so the marker is taken from a short sample
+    stream = RecordStream(marker_sample_records=FOLLOW_MARKER_SAMPLE_RECORDS)
+    combiner = StreamingCombiner()
+    rows = 0
+
+    with ExitStack() as stack:
+        write_of = open_of_writer(stack, output_path(input_path, "_OF", output_format), output_format, True) if save_OF else None
+        write_rf = open_rf_writer(stack, output_path(input_path, "_RF", output_format), output_format, True)
+        f = stack.enter_context(open(input_path, 'rb'))
+
+        def write(records, table):
+            nonlocal rows
+            if write_of is not None and len(records):
+                write_of(records)
+            if len(table):
+                write_rf(table)
+                rows += len(table)
+
+        logger.info(f"Following {input_path}")
+        position = 0
+        last_growth = time.monotonic()
+        try:
+            while True:
+                chunk = f.read(block_size)
+                if chunk:
+                    position += len(chunk)
+                    last_growth = time.monotonic()
+                    records = stream.feed(chunk)
+                    write(records, combiner.push(records))
+                    continue
+
+                if input_path.stat().st_size < position:
+                    logger.error(f"{input_path} was truncated, stopping")
+                    break
+                if idle_timeout is not None and time.monotonic() - last_growth >= idle_timeout:
+                    logger.info(f"No new data for {idle_timeout} s, stopping")
+                    break
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            logger.info("Interrupted, writing the remaining rows")
+
+        records = stream.finish()
+        write(records, CombinedTable.concat([combiner.push(records), combiner.finish()]))
+
+    if not stream.report.ok:
+        logger.warning(f"Broken framing in {input_path}: {stream.report}")
+    logger.info(f"{rows} rows written to {output_path(input_path, '_RF', output_format)}")
+    return output_path(input_path, "_RF", output_format)
 
-    return combined_format_path
 
 def main():
     args = parse_arguments()
     input = Path(args.input)
+    if args.follow:
+        follow_mdd(input, save_OF=args.save_OF, output_format=args.format,
+                   poll_interval=args.poll_interval, idle_timeout=args.idle_timeout)
+    else:
+        convert_mdd_to_csv(input, save_OF=args.save_OF, output_format=args.format, time_window=args.window)
     # inp = Path("../files_for_test/112_cor/30/20250530_100711_MD-R3_#0112.mdd")
     # convert_mdd_to_csv(inp, save_OF=False)
+
+
+if __name__ == "__main__":
+    main()
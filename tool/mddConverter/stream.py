@@ -0,0 +1,104 @@
+import mmap
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+
+from .decoder import DecodedRecords, RECORD_WIDTH, decode_records
+from .validation import MARKER_SAMPLE_RECORDS, FramingReport, detect_marker, validate_framing
+
+DEFAULT_BLOCK_SIZE = 8 * 1024 * 1024  # bytes
+
+
+class RecordStream:
+    """
+    Decodes a byte stream that arrives in arbitrary chunks.
+    An incomplete record at the end of a chunk is carried over to the next one.
+    With `validate`, broken framing is resynchronised and summarised in `report`.
+    """
+
+    def __init__(self, first_id: int = 0, validate: bool = True, position: int = 0,
+                 marker_sample_records: int = MARKER_SAMPLE_RECORDS):
+        self.next_id = first_id
+        self.validate = validate
+        self.report = FramingReport()
+        self._carry = b""
+        self._position = position  # file offset of the first carried byte
+        self._prev_ts = None
+        self._marker_checked = not validate
+        self._marker_sample = (marker_sample_records + 1) * RECORD_WIDTH
+
+    @property
+    def pending_bytes(self) -> int:
+        return len(self._carry)
+
+    def feed(self, chunk: bytes) -> DecodedRecords:
+        return self._decode(self._carry + chunk if self._carry else chunk, final=False)
+
+    def finish(self) -> DecodedRecords:
+        """Decodes what is still carried over, at the end of the input."""
+        return self._decode(self._carry, final=True)
+
+    def _decode(self, buf: bytes, final: bool) -> DecodedRecords:
+        if not self._marker_checked:
+            # waits for a full sample, whatever the chunk size
+            if not final and len(buf) < self._marker_sample:
+                self._carry = buf
+                return DecodedRecords.concat([])
+            self.report.marker = detect_marker(np.frombuffer(buf, dtype=np.uint8))
+            self._marker_checked = True
+
+        if self.validate:
+            records, report, consumed = validate_framing(buf, self.next_id, self.report.marker, self._position,
+                                                         self._prev_ts, final)
+            keep_from = consumed
+            if not final:
+                report.total_bytes = keep_from
+                report.trailing_bytes = 0
+            self.report.merge(report)
+            first_offset = report.first_offset
+            if len(records):
+                self._prev_ts = int(records.records['timestamp'][-1])
+        else:
+            keep_from = len(buf) // RECORD_WIDTH * RECORD_WIDTH
+            records = decode_records(buf[:keep_from], first_id=self.next_id)
+            first_offset = 0
+
+        records.byte_offset = self._position + first_offset
+        self._carry = bytes(buf[keep_from:])
+        self._position += keep_from
+        self.next_id += len(records)
+        return records
+
+
+def iter_mdd_blocks(input_path, block_size: int = DEFAULT_BLOCK_SIZE,
+                    start: int = 0, stop: Optional[int] = None, validate: bool = True,
+                    report: Optional[FramingReport] = None) -> Iterator[DecodedRecords]:
+    """
+    Memory-maps an MDD file and yields its records in blocks of about `block_size` bytes.
+    Only one block is held in memory at a time. `start`/`stop` limit the byte range,
+    `start` has to be at a record boundary. Framing errors are added to `report`, if given.
+    """
+    if block_size <= 0:
+        raise ValueError(f"block_size must be positive, got: {block_size}")
+
+    path = Path(input_path)
+    if path.stat().st_size == 0:
+        return
+
+    if start % RECORD_WIDTH and not validate:
+        raise ValueError(f"start must be a multiple of {RECORD_WIDTH}, got: {start}")
+
+    stream = RecordStream(first_id=start // RECORD_WIDTH, validate=validate, position=start)
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        stop = len(mm) if stop is None else min(stop, len(mm))
+        for offset in range(start, stop, block_size):
+            # slicing copies, so no buffer keeps the map alive after close
+            records = stream.feed(mm[offset:min(offset + block_size, stop)])
+            if len(records):
+                yield records
+        records = stream.finish()
+        if len(records):
+            yield records
+    if report is not None:
+        report.merge(stream.report)
@@ -0,0 +1,200 @@
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .decoder import DecodedRecords, RECORD_DTYPE, RECORD_WIDTH
+from .magRow import MagRowType
+
+# a record whose timestamp jumps away from both neighbours by more than this is treated as garbage
+TIMESTAMP_JUMP_MS = 1000
+# the marker check is skipped if the most common `first` byte is rarer than this
+MIN_MARKER_SHARE = 0.5
+# records looked at to find the marker
+MARKER_SAMPLE_RECORDS = 8192
+
+_KNOWN_TYPES = np.zeros(256, dtype=bool)
+_KNOWN_TYPES[[int(t) for t in MagRowType]] = True
+
+
+@dataclass
+class FramingReport:
+    """Summary of what validate_framing had to skip or drop."""
+    marker: Optional[int] = None
+    total_bytes: int = 0
+    records: int = 0
+    resyncs: int = 0
+    skipped_bytes: int = 0
+    skipped_regions: List[Tuple[int, int]] = field(default_factory=list)  # byte ranges [start, stop)
+    dropped_timestamps: int = 0  # records dropped for a timestamp far off both neighbours
+    backward_steps: int = 0  # kept, but the timestamp went back by more than TIMESTAMP_JUMP_MS
+    trailing_bytes: int = 0
+    first_offset: int = 0  # offset of the first record in the validated buffer
+
+    MAX_REGIONS = 100
+
+    @property
+    def ok(self) -> bool:
+        return self.resyncs == 0 and self.dropped_timestamps == 0 and self.backward_steps == 0
+
+    def add_region(self, start, stop):
+        self.resyncs += 1
+        self.skipped_bytes += stop - start
+        if len(self.skipped_regions) < self.MAX_REGIONS:
+            self.skipped_regions.append((start, stop))
+
+    def merge(self, other: 'FramingReport'):
+        self.marker = self.marker if self.marker is not None else other.marker
+        self.total_bytes += other.total_bytes
+        self.records += other.records
+        self.resyncs += other.resyncs
+        self.skipped_bytes += other.skipped_bytes
+        self.skipped_regions.extend(other.skipped_regions[:self.MAX_REGIONS - len(self.skipped_regions)])
+        self.dropped_timestamps += other.dropped_timestamps
+        self.backward_steps += other.backward_steps
+        self.trailing_bytes = other.trailing_bytes
+
+    def __str__(self):
+        text = (f"{self.records} records in {self.total_bytes} bytes: "
+                f"{self.resyncs} resyncs skipping {self.skipped_bytes} bytes, "
+                f"{self.dropped_timestamps} records dropped for bad timestamps, "
+                f"{self.backward_steps} backward timestamp steps, "
+                f"{self.trailing_bytes} trailing bytes")
+        if self.skipped_regions:
+            regions = ", ".join(f"{a}-{b}" for a, b in self.skipped_regions[:5])
+            text += f". First skipped regions: {regions}"
+        return text
+
+
+def detect_marker(buf: np.ndarray) -> Optional[int]:
+    """
+    Most common `first` byte of the records at the start of the buffer, None if it's not dominant.
+    The records are located by their type byte, so the buffer doesn't have to start at a record boundary.
+    """
+    sample = buf[:MARKER_SAMPLE_RECORDS * RECORD_WIDTH + RECORD_WIDTH]
+    n = (len(sample) - 1) // RECORD_WIDTH
+    if n == 0:
+        return None
+    known = _KNOWN_TYPES[sample[1:n * RECORD_WIDTH + 1]].reshape(n, RECORD_WIDTH)
+    phase = int(known.sum(axis=0).argmax())
+    counts = np.bincount(sample[phase:n * RECORD_WIDTH:RECORD_WIDTH], minlength=256)
+    marker = int(counts.argmax())
+    return marker if counts[marker] >= MIN_MARKER_SHARE * n else None
+
+
+def find_record_offsets(buf: np.ndarray, marker: Optional[int], report: FramingReport, base_offset: int = 0) -> np.ndarray:
+    """
+    Byte offsets of the records in `buf`. Where the framing breaks, skips to the next
+    position that starts a valid record followed by another valid one (or the end).
+    """
+    last = len(buf) - RECORD_WIDTH
+    if last < 0:
+        return np.empty(0, dtype=np.int64)
+
+    valid = _KNOWN_TYPES[buf[1:last + 2]]
+    if marker is not None:
+        valid &= buf[:last + 1] == marker
+
+    # fast path: a cleanly framed buffer
+    if valid[::RECORD_WIDTH].all():
+        return np.arange(0, last + 1, RECORD_WIDTH, dtype=np.int64)
+
+    anchored = valid.copy()
+    anchored[:-RECORD_WIDTH] &= valid[RECORD_WIDTH:]
+    anchors = np.flatnonzero(anchored)
+    # positions that break a run, separately for every phase (offset % RECORD_WIDTH)
+    breaks = [np.flatnonzero(~valid[phase::RECORD_WIDTH]) for phase in range(RECORD_WIDTH)]
+
+    runs = []
+    pos = 0
+    while pos <= last:
+        if not valid[pos]:
+            i = np.searchsorted(anchors, pos)
+            if i == len(anchors):
+                break
+            report.add_region(base_offset + pos, base_offset + int(anchors[i]))
+            pos = int(anchors[i])
+
+        phase, k = pos % RECORD_WIDTH, pos // RECORD_WIDTH
+        phase_breaks = breaks[phase]
+        j = np.searchsorted(phase_breaks, k)
+        end_k = int(phase_breaks[j]) if j < len(phase_breaks) else (last - phase) // RECORD_WIDTH + 1
+        end = phase + end_k * RECORD_WIDTH
+        resync = None
+        if end <= last:
+            # a truncated record before the break overlaps the next valid one, drop it
+            i = np.searchsorted(anchors, end - RECORD_WIDTH + 1)
+            if i < len(anchors) and anchors[i] < end:
+                end -= RECORD_WIDTH
+                resync = int(anchors[i])
+        runs.append(np.arange(pos, end, RECORD_WIDTH, dtype=np.int64))
+        pos = end
+        if resync is not None:
+            report.add_region(base_offset + pos, base_offset + resync)
+            pos = resync
+
+    return np.concatenate(runs) if runs else np.empty(0, dtype=np.int64)
+
+
+def timestamp_outliers(ts: np.ndarray, prev_ts: Optional[int] = None) -> np.ndarray:
+    """
+    Mask of records whose timestamp jumps away from both neighbours, which agree with each other.
+    `prev_ts` is the timestamp of the record before the first one, if known.
+    """
+    ts = ts.astype(np.int64)
+    if prev_ts is not None:
+        ts = np.concatenate([[prev_ts], ts])
+    bad = np.zeros(len(ts), dtype=bool)
+    if len(ts) >= 3:
+        prev, cur, nxt = ts[:-2], ts[1:-1], ts[2:]
+        neighbours_agree = np.abs(nxt - prev) <= TIMESTAMP_JUMP_MS
+        spike = cur - np.maximum(prev, nxt) > TIMESTAMP_JUMP_MS
+        dip = np.minimum(prev, nxt) - cur > TIMESTAMP_JUMP_MS
+        bad[1:-1] = neighbours_agree & (spike | dip)
+    return bad[1:] if prev_ts is not None else bad
+
+
+def validate_framing(data, first_id: int = 0, marker: Optional[int] = None, base_offset: int = 0,
+                     prev_ts: Optional[int] = None, final: bool = True) -> Tuple[DecodedRecords, FramingReport, int]:
+    """
+    Decodes `data`, resynchronising at the next valid record wherever the 36-byte framing
+    is broken. Returns the records, the report and the number of bytes consumed
+    (everything up to the end of the last record). If more data follows (`final` is False)
+    the last record is not returned or consumed, as it can only be checked against the next one,
+    and the bytes after it are left for the next call.
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    report = FramingReport(marker=marker if marker is not None else detect_marker(buf), total_bytes=len(buf))
+
+    offsets = find_record_offsets(buf, report.marker, report, base_offset)
+    if len(offsets) and offsets[-1] == (len(offsets) - 1) * RECORD_WIDTH:
+        records = np.frombuffer(data, dtype=RECORD_DTYPE, count=len(offsets))
+    else:
+        records = buf[offsets[:, None] + np.arange(RECORD_WIDTH)].view(RECORD_DTYPE).ravel()
+
+    bad = timestamp_outliers(records['timestamp'], prev_ts)
+    if final:
+        consumed = int(offsets[-1]) + RECORD_WIDTH if len(offsets) else 0
+    elif len(offsets):
+        consumed = int(offsets[-1])
+        records, bad = records[:-1], bad[:-1]
+    else:
+        # a record starting in the last RECORD_WIDTH - 1 bytes may still be completed by the next chunk
+        consumed = max(0, len(buf) - (RECORD_WIDTH - 1))
+        if consumed:
+            report.add_region(base_offset, base_offset + consumed)
+
+    report.trailing_bytes = len(buf) - consumed
+    report.first_offset = int(offsets[0]) if len(offsets) else 0
+    report.dropped_timestamps = int(bad.sum())
+    if bad.any():
+        records = records[~bad]
+
+    kept = records['timestamp'].astype(np.int64)
+    if prev_ts is not None:
+        kept = np.concatenate([[prev_ts], kept])
+    report.backward_steps = int(np.count_nonzero(np.diff(kept) < -TIMESTAMP_JUMP_MS))
+
+    report.records = len(records)
+    ids = np.arange(first_id, first_id + len(records), dtype=np.int64)
+    return DecodedRecords(records, ids), report, consumed
@@ -1,8 +1,22 @@
+import hashlib
 from dataclasses import dataclass
 from datetime import datetime
+from pathlib import Path
 import pandas as pd
 import numpy as np
-from typing import Optional, Tuple
+from typing import Iterable, List, Optional, Tuple
+
+def read_table(filepath: str, delimiter: str) -> pd.DataFrame:
+    """Picks the reader by extension: .parquet, .arrow/.feather, .npz, anything else is CSV."""
+    suffix = Path(filepath).suffix.lower()
+    if suffix == '.parquet':
+        return pd.read_parquet(filepath)
+    if suffix in ('.arrow', '.feather'):
+        return pd.read_feather(filepath)
+    if suffix == '.npz':
+        with np.load(filepath) as f:
+            return pd.DataFrame({name: f[name] for name in f.files})
+    return pd.read_csv(filepath, delimiter=delimiter)
 
 @dataclass
 class DataConfig:
@@ -26,12 +40,48 @@ class DataConfig:
     gps_time_col: Optional[str] = None
     gps_date_col: Optional[str] = None
     utc_timestamp_col: Optional[str] = "UTC Timestamp [ms]" #in ms!!!
+    # positions in the plane of a LocalFrame, only while the geometry is solved there
+    east_col: Optional[str] = 'East [m]'
+    north_col: Optional[str] = 'North [m]'
+
+class GroupIndex:
+    """
+    Rows of a frame grouped by the values of a column, built with one stable sort: `order` has the
+    row positions group after group, in the order of the values and of the rows within a group,
+    group i is order[starts[i]:stops[i]]. Rows with a missing value belong to no group.
+    """
+
+    def __init__(self, keys):
+        codes, values = pd.factorize(np.asarray(keys), sort=True)
+        order = np.argsort(codes, kind='stable')
+        self.order = order[codes[order] >= 0]
+        counts = np.bincount(codes[codes >= 0], minlength=len(values))
+        self.stops = np.cumsum(counts)
+        self.starts = self.stops - counts
+        self.values = pd.Index(values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def positions(self, value) -> np.ndarray:
+        """Row positions of the group, empty if there is none; a view of `order`."""
+        i = self.values.get_indexer([value])[0]
+        if i < 0:
+            return self.order[:0]
+        return self.order[self.starts[i]:self.stops[i]]
+
+    def split(self, array) -> List[np.ndarray]:
+        """Values of `array` (one per row) of every group, views of a single reordered copy."""
+        ordered = np.asarray(array)[self.order]
+        return [ordered[start:stop] for start, stop in zip(self.starts, self.stops)]
+
 
 class Data:
     DEFAULT_CONFIG = DataConfig()
     DEFAULT_DELIMITER = ','
 
     def __init__(self, df: pd.DataFrame, filepath: Optional[str] = None, delimiter: Optional[str] = None, config: Optional[DataConfig] = None):
+        self._group_indexes = {}
         self.df = df
         self.filepath = filepath
         self.delimiter = delimiter or self.DEFAULT_DELIMITER
@@ -43,7 +93,7 @@ class Data:
     def from_file(cls, filepath: str, delimiter: Optional[str] = None, config: Optional[DataConfig] = None):
         delimiter = delimiter or cls.DEFAULT_DELIMITER
         config = config or cls.DEFAULT_CONFIG
-        df = pd.read_csv(filepath, delimiter=delimiter)
+        df = read_table(filepath, delimiter)
         return cls(df, filepath=filepath, delimiter=delimiter, config=config)
 
     @classmethod
@@ -100,6 +150,49 @@ class Data:
         delim = new_delimiter or self.delimiter
         self.df.to_csv(path, sep=delim, index=False)
 
+    @property
+    def df(self) -> pd.DataFrame:
+        return self._df
+
+    @df.setter
+    def df(self, df: pd.DataFrame):
+        self._df = df
+        self._group_indexes = {}
+
+    def __getstate__(self):
+        # the group indexes are cheap to rebuild, they aren't pickled with checkpoints
+        state = self.__dict__.copy()
+        state['_group_indexes'] = {}
+        return state
+
+    def group_index(self, column: str) -> GroupIndex:
+        """
+        GroupIndex of the frame by `column`, built on first use and kept while the values of the column
+        stay the same. They are compared by a digest, so changes in place are noticed too; that reads
+        the column once per call, loops over the groups should use `groups`.
+        """
+        values = self._df[column].to_numpy()
+        key = _content_key(values)
+        cached = self._group_indexes.get(column)
+        if cached is None or cached[0] != key:
+            cached = (key, GroupIndex(values))
+            self._group_indexes[column] = cached
+        return cached[1]
+
+    def group(self, column: str, value) -> pd.DataFrame:
+        """Rows where `column` equals `value`, like df[df[column] == value]; a slice, not a copy, if they are contiguous."""
+        return self._rows(self.group_index(column).positions(value))
+
+    def groups(self, column: str, values: Iterable) -> List[pd.DataFrame]:
+        """`group` for each of `values`, looking the index up once."""
+        index = self.group_index(column)
+        return [self._rows(index.positions(value)) for value in values]
+
+    def _rows(self, positions) -> pd.DataFrame:
+        if len(positions) and positions[-1] - positions[0] == len(positions) - 1:
+            return self._df.iloc[positions[0]:positions[-1] + 1]
+        return self._df.iloc[positions]
+
     def num_tracks(self):
         if self.config.track_id_col in self.df.columns:
             return int(self.df[self.config.track_id_col].nunique())
@@ -195,6 +288,12 @@ class DataExternalGNSS(Data):
     )
     DEFAULT_DELIMITER = ','
 
+def _content_key(values: np.ndarray):
+    """Length, dtype and digest of the values of a column."""
+    if values.dtype.kind == 'O':
+        values = pd.util.hash_array(values)
+    return len(values), values.dtype.str, hashlib.sha1(np.ascontiguousarray(values).view(np.uint8)).digest()
+
 def build_column_rename_map(src_config, dest_config):
     rename_map = {}
     for attr in dir(src_config):
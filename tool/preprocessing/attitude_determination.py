@@ -4,24 +4,23 @@ import numpy as np
 import math
 
 import pandas as pd
-from ahrs.utils import WMM
-from numpy.ma.core import arctan2
 from pandas import Series
 
-# in a global frame
-def calculate_yaws(data):
-    yaws = []
+from . import geomagnetic
 
-    for i, row in data.df.iterrows():
-        Bx1, By1 = row[data.config.mag_cols1[0]], row[data.config.mag_cols1[1]]
-        if not pd.isna(data.date):
-            d = data.date
-        else:
-            d = datetime.now()
-        yaw = calculate_yaw(Bx1, By1, d, row[data.config.lat_col], row[data.config.lon_col])
-        yaws.append(yaw)
+# in a global frame
+def calculate_yaws(data, reference=geomagnetic):
+    """`reference` answers declination(lat, lon, height, date): the geomagnetic module or a GridReference."""
+    if not pd.isna(data.date):
+        d = data.date
+    else:
+        d = datetime.now()
 
-    return yaws
+    Bx1 = data.df[data.config.mag_cols1[0]].to_numpy(dtype=float)
+    By1 = data.df[data.config.mag_cols1[1]].to_numpy(dtype=float)
+    B_body_angle = np.degrees(np.arctan2(By1, Bx1)) % 360
+    B_ref_angle = reference.declination(data.df[data.config.lat_col], data.df[data.config.lon_col], 0.0, d)
+    return list((B_ref_angle - B_body_angle) % 360)
 
 def calculate_yaw(Bx, By, date, lat, lon):
     B_body_angle = math.degrees(math.atan2(By, Bx)) % 360
@@ -30,10 +29,7 @@ def calculate_yaw(Bx, By, date, lat, lon):
 
 
 def get_B_reference(date, lat, lon, h=0.0):
-    wmm = WMM(date=date, latitude=lat, longitude=lon, height=h)
-    B_r_x = wmm.X
-    B_r_y = wmm.Y
-    return np.degrees(arctan2(B_r_y, B_r_x)) % 360
+    return float(geomagnetic.declination(lat, lon, h, date))
 
 def get_facing_points(headings, yaws, max_deviation=30):
     res = []
@@ -72,10 +68,13 @@ def get_facing_point(heading_angle, yaw_angle, max_deviation):
 
 def get_facing_tracks(data):
     fts = []
+    tracks = data.group_index(data.config.track_id_col)
+    headings = data.df[data.config.heading_col].to_numpy()
+    yaws = data.df[data.config.yaw_col].to_numpy()
     for t_n in range(data.num_tracks()):
-        df_by_t = data.df[data.df[data.config.track_id_col] == t_n].reset_index(drop=True)
-        track_facings = get_facing_points(df_by_t[data.config.heading_col], df_by_t[data.config.yaw_col])
-        fts.extend([get_facing_track(track_facings)]*len(df_by_t))
+        rows = tracks.positions(t_n)
+        track_facings = get_facing_points(headings[rows], yaws[rows])
+        fts.extend([get_facing_track(track_facings)]*len(rows))
     return fts
 
 def get_facing_track(facings):
@@ -0,0 +1,103 @@
+import hashlib
+import inspect
+import json
+import logging
+import os
+import pickle
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Optional
+
+import pandas as pd
+
+from .Data import Data, DataFinal
+from .local_frame import LocalFrame
+
+CHECKPOINT_VERSION = 3
+# after the steps that are expensive to redo: segmentation, yaws, interpolation, total field
+DEFAULT_CHECKPOINT_STEPS = (4, 5, 9, 10)
+# input files are hashed this many bytes at a time
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+@dataclass
+class PipelineState:
+    """Everything a step of preprocess_data hands over to the next ones."""
+    data: Data
+    df_original: Optional[pd.DataFrame] = None  # set if the frequency was reduced in step 3
+    data_final: Optional[DataFinal] = None
+    frame: Optional[LocalFrame] = None  # set in step 4 if the geometry is solved in a local frame
+
+
+def file_digest(path) -> Optional[str]:
+    """sha256 of a file read in chunks, of several joined with ","; None for no file."""
+    if path is None:
+        return None
+    if isinstance(path, (list, tuple)):
+        return ",".join(file_digest(p) for p in path)
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def data_digest(data: Data) -> str:
+    """Key of the raw input: its content, columns and the file name the date and time may come from."""
+    h = hashlib.sha256()
+    h.update(pd.util.hash_pandas_object(data.df, index=True).values.tobytes())
+    h.update(json.dumps([list(map(str, data.df.columns)), type(data).__name__,
+                         Path(str(data.filepath)).name, CHECKPOINT_VERSION]).encode())
+    h.update(inspect.getsource(inspect.getmodule(Data)).encode())
+    return h.hexdigest()
+
+
+def step_key(previous_key: str, step, code: Iterable, params: dict) -> str:
+    """
+    Key of the state after `step`: the key before it, the source of the functions
+    and modules that implement it and its parameters. Changing any of them
+    invalidates this checkpoint and all later ones.
+    """
+    h = hashlib.sha256(previous_key.encode())
+    h.update(f"{step:g}".encode())
+    for obj in code:
+        h.update(inspect.getsource(obj).encode())
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+class CheckpointStore:
+    """Pickled PipelineStates of one input, saved after each of `steps`."""
+
+    def __init__(self, directory, steps: Iterable = DEFAULT_CHECKPOINT_STEPS):
+        self.directory = Path(directory)
+        self.steps = sorted(steps)
+
+    def path(self, step) -> Path:
+        return self.directory / f"step_{step:g}.pkl"
+
+    def save(self, step, key: str, state: PipelineState):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.path(step)
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, 'wb') as f:
+            pickle.dump({'version': CHECKPOINT_VERSION, 'key': key, 'state': state}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        logging.getLogger(__name__).info(f"Checkpoint after step {step:g} saved to {path}")
+
+    def load(self, step, key: str) -> Optional[PipelineState]:
+        """The state saved after `step`, None if there is none or it was made from other inputs or parameters."""
+        logger = logging.getLogger(__name__)
+        path = self.path(step)
+        if not path.exists():
+            return None
+        try:
+            with open(path, 'rb') as f:
+                checkpoint = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+            logger.warning(f"Can't read checkpoint {path}: {e}")
+            return None
+        if checkpoint.get('version') != CHECKPOINT_VERSION or checkpoint.get('key') != key:
+            logger.info(f"Checkpoint {path} is outdated")
+            return None
+        return checkpoint['state']
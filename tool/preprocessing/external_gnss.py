@@ -1,6 +1,20 @@
+import csv
+import logging
+import os
+from pathlib import Path
+
 import numpy as np
 import pandas as pd
 
+from .Data import DataExternalGNSS, read_table
+
+# rows of a CSV log parsed at a time
+CHUNK_ROWS = 50_000
+# the bisection for the start of the flight stops at this many bytes, the rest is parsed in chunks
+BISECT_BYTES = 1 << 16
+# lines looked at from a byte offset for one with a timestamp
+PROBE_LINES = 100
+
 def find_nearest(external_ts: float, main_ts_series: pd.Series, max_diff_ms= None):
     if pd.isna(external_ts):
         return None
@@ -14,59 +28,178 @@ def find_nearest(external_ts: float, main_ts_series: pd.Series, max_diff_ms= Non
     return main_ts_series.index[min_idx]
 
 
-def merge_gnss_into_data(main_data, external_data, max_diff_ms = None):
-    main_df = main_data.df
-    external_df = external_data.df
-
-    main_ts_col = main_data.config.utc_timestamp_col
-    external_ts_col = external_data.config.utc_timestamp_col
-
-    main_lat_col = main_data.config.lat_col
-    main_lon_col = main_data.config.lon_col
-    main_alt_col = main_data.config.alt_col
-    main_gps_time_col = main_data.config.gps_time_col
-
-
-    main_df[main_lat_col] = np.nan
-    main_df[main_lon_col] = np.nan
-    main_df[main_alt_col] = np.nan
-    main_df[main_gps_time_col] = np.nan
+def nearest_rows(main_ts, external_ts, max_diff_ms=None, sources=None) -> np.ndarray:
+    """
+    Row of the sorted main timestamps nearest to every external timestamp, -1 for missing ones and
+    ones with no row within max_diff_ms. The rows of each source (non-decreasing ids in `sources`)
+    are matched like a scan over them in order: it never goes back to an earlier main row, and of
+    two equally near rows the earlier one is taken.
+    """
+    main_ts = np.asarray(main_ts, dtype=float)
+    external_ts = np.asarray(external_ts, dtype=float)
+    n = len(main_ts)
+    rows = np.full(len(external_ts), -1)
+    if n == 0:
+        return rows
+
+    valid = ~np.isnan(external_ts)
+    # the last main row before every timestamp, the furthest one seen so far within a source
+    before = np.where(valid, np.searchsorted(main_ts, external_ts, side='left') - 1, -1)
+    shift = (n + 1) * (np.zeros(len(external_ts), dtype=int) if sources is None else np.asarray(sources))
+    lo = np.maximum(np.maximum.accumulate(before + shift) - shift, 0)
+    hi = np.minimum(lo + 1, n - 1)
+
+    lo_diff = np.abs(main_ts[lo] - external_ts)
+    hi_diff = np.abs(main_ts[hi] - external_ts)
+    later = hi_diff < lo_diff
+    best, diff = np.where(later, hi, lo), np.where(later, hi_diff, lo_diff)
+
+    matched = valid if max_diff_ms is None else valid & ~(diff > max_diff_ms)
+    rows[matched] = best[matched]
+    return rows
 
-    ext_lat_col = external_data.config.lat_col
-    ext_lon_col = external_data.config.lon_col
-    ext_alt_col = external_data.config.alt_col
 
-    main_ts = main_df[main_ts_col].values
-    last_main_idx = 0
-
-    for ext_idx, row in external_df.iterrows():
-        ts = row[external_ts_col]
-        if pd.isna(ts):
-            continue
-
-
-        while last_main_idx + 1 < len(main_ts) and main_ts[last_main_idx + 1] < ts:
-            last_main_idx += 1
+def merge_gnss_into_data(main_data, external_data, max_diff_ms = None):
+    """
+    Replaces the positions of the main data with the fixes of an external GNSS log, or of several
+    (e.g. base and rover) given as a list, each at its nearest main sample; samples without a fix
+    are left without position. A value missing in a fix keeps the one before it, and where several
+    fixes fall on a sample the later one wins, of the sources the later one in the list.
+    """
+    sources = list(external_data) if isinstance(external_data, (list, tuple)) else [external_data]
+    main_df = main_data.df
+    config = main_data.config
+
+    for col in (config.lat_col, config.lon_col, config.alt_col, config.gps_time_col):
+        main_df[col] = np.nan
+
+    external_ts = [source.df[source.config.utc_timestamp_col].to_numpy(dtype=float) for source in sources]
+    source_ids = np.repeat(np.arange(len(sources)), [len(ts) for ts in external_ts])
+    rows = nearest_rows(main_df[config.utc_timestamp_col].to_numpy(dtype=float),
+                        np.concatenate(external_ts) if sources else [], max_diff_ms, source_ids)
+
+    for main_col, attr in ((config.lat_col, 'lat_col'), (config.lon_col, 'lon_col'), (config.alt_col, 'alt_col')):
+        values = np.concatenate([_column(source, getattr(source.config, attr)) for source in sources]) if sources else []
+        use = (rows >= 0) & pd.notna(values)
+        target, value = rows[use], np.asarray(values)[use]
+        # the last of the fixes on a sample
+        last = len(target) - 1 - np.unique(target[::-1], return_index=True)[1]
+        column = main_df[main_col].to_numpy(copy=True)
+        column[target[last]] = value[last]
+        main_df[main_col] = column
 
-        candidates = [last_main_idx]
-        if last_main_idx + 1 < len(main_ts):
-            candidates.append(last_main_idx + 1)
+    main_data.df = main_df
 
-        best_idx = min(candidates, key=lambda i: abs(main_ts[i] - ts))
-        time_diff = abs(main_ts[best_idx] - ts)
 
-        if max_diff_ms is not None and time_diff > max_diff_ms:
+def read_gnss_window(filepath, start_ms, end_ms, margin_ms=0, delimiter=None, config=None) -> DataExternalGNSS:
+    """
+    External GNSS log with only its timestamp, lat, lon and alt columns and only the fixes from
+    start_ms - margin_ms to end_ms + margin_ms (UTC ms), e.g. the ones a flight can be merged with.
+    A CSV log is taken as ordered by time: the start of the window is found by bisecting the file
+    and it's parsed in chunks from there until the end of the window, so the cost follows the window
+    and not the log. If the rows read turn out not to be ordered, the whole log is loaded instead.
+    """
+    delimiter = delimiter or DataExternalGNSS.DEFAULT_DELIMITER
+    config = config or DataExternalGNSS.DEFAULT_CONFIG
+    ts_col = config.utc_timestamp_col
+    wanted = [ts_col, config.lat_col, config.lon_col, config.alt_col]
+    low, high = start_ms - margin_ms, end_ms + margin_ms
+
+    suffix = Path(filepath).suffix.lower()
+    if suffix in ('.parquet', '.arrow', '.feather', '.npz'):
+        df = _read_columns(filepath, suffix, wanted, ts_col, low, high, delimiter)
+    else:
+        df = _read_csv_window(filepath, wanted, ts_col, low, high, delimiter)
+        if df is None:
+            logging.getLogger(__name__).warning(f"{filepath} isn't ordered by time, it's loaded whole")
+            return DataExternalGNSS.from_file(filepath, delimiter=delimiter, config=config)
+    return DataExternalGNSS(df.reset_index(drop=True), filepath=filepath, delimiter=delimiter, config=config)
+
+
+def _read_columns(filepath, suffix, wanted, ts_col, low, high, delimiter) -> pd.DataFrame:
+    if suffix == '.parquet':
+        import pyarrow.parquet as pq
+        columns = [c for c in wanted if c in pq.read_schema(filepath).names]
+        # row groups whose statistics are outside the window aren't read
+        df = pd.read_parquet(filepath, columns=columns, filters=[(ts_col, '>=', low), (ts_col, '<=', high)])
+    elif suffix == '.npz':
+        with np.load(filepath) as f:
+            df = pd.DataFrame({name: f[name] for name in wanted if name in f.files})
+    else:
+        df = read_table(filepath, delimiter)
+        df = df[[c for c in wanted if c in df.columns]]
+    ts = df[ts_col]
+    return df[(ts >= low) & (ts <= high)]
+
+
+def _read_csv_window(filepath, wanted, ts_col, low, high, delimiter):
+    """The rows of an ordered CSV log in the window, None if the rows read aren't ordered."""
+    with open(filepath, 'rb') as f:
+        header_line = f.readline()
+        names = next(csv.reader([header_line.decode('utf-8-sig').rstrip('\r\n')], delimiter=delimiter))
+        ts_index = names.index(ts_col)
+        columns = [c for c in wanted if c in names]
+        begin = _bisect_start(f, len(header_line), os.fstat(f.fileno()).st_size, ts_index, low, delimiter)
+
+        f.seek(begin)
+        parts = []
+        previous = -np.inf
+        for chunk in pd.read_csv(f, delimiter=delimiter, header=None, names=names, usecols=columns,
+                                 chunksize=CHUNK_ROWS):
+            ts = chunk[ts_col].to_numpy(dtype=float)
+            valid = ts[~np.isnan(ts)]
+            if len(valid) and (valid[0] < previous or (np.diff(valid) < 0).any()):
+                return None
+            parts.append(chunk[(ts >= low) & (ts <= high)])
+            if len(valid):
+                previous = valid[-1]
+                if previous > high:
+                    break
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(parts)
+
+
+def _bisect_start(f, data_start, size, ts_index, low, delimiter) -> int:
+    """Offset of a line at or before the first one with a timestamp of at least `low`."""
+    lo, hi = data_start, size
+    while hi - lo > BISECT_BYTES:
+        mid = (lo + hi) // 2
+        ts = _timestamp_after(f, mid, ts_index, delimiter)
+        if ts is None or ts >= low:
+            hi = mid
+        else:
+            lo = mid
+    if lo == data_start:
+        return lo
+    # the line lo falls into is before the probed one, so it's earlier than `low` too
+    f.seek(lo)
+    f.readline()
+    return f.tell()
+
+
+def _timestamp_after(f, offset, ts_index, delimiter):
+    """Timestamp of the first line starting after `offset` that has one, None if there is none."""
+    f.seek(offset)
+    f.readline()
+    for _ in range(PROBE_LINES):
+        line = f.readline()
+        if not line:
+            return None
+        fields = next(csv.reader([line.decode('utf-8', 'replace').rstrip('\r\n')], delimiter=delimiter), [])
+        try:
+            ts = float(fields[ts_index])
+        except (IndexError, ValueError):
             continue
+        if not np.isnan(ts):
+            return ts
+    return None
 
 
-        if not pd.isna(row.get(ext_lat_col, np.nan)):
-            main_df.at[best_idx, main_lat_col] = row[ext_lat_col]
-        if not pd.isna(row.get(ext_lon_col, np.nan)):
-            main_df.at[best_idx, main_lon_col] = row[ext_lon_col]
-        if not pd.isna(row.get(ext_alt_col, np.nan)):
-            main_df.at[best_idx, main_alt_col] = row[ext_alt_col]
-
-    main_data.df = main_df
+def _column(data, col) -> np.ndarray:
+    if col is None or col not in data.df.columns:
+        return np.full(len(data.df), np.nan)
+    return data.df[col].to_numpy(dtype=float)
 
 # main_data = DataOwn.from_file("../utc.csv")
 # external_data = DataExternalGNSS.from_file("../rtk.csv")
@@ -20,10 +20,13 @@ def fill_data_with_original(data_final, original_df):
     line_col = data_final.config.line_id_col
     timestamp_col = data_final.config.timestamp_col
 
-    # print(data_final.num_tracks())
+    # the original rows of a line are a slice if the timestamps are sorted, as they are when logged
+    original_ts = original_df[timestamp_col]
+    sorted_ts = original_ts.is_monotonic_increasing
+
     new_rows = []
-    for i in range(data_final.num_tracks() * 2):
-        df_part = data_final.df[data_final.df[line_col] == i]
+    lines = range(data_final.num_tracks() * 2)
+    for i, df_part in zip(lines, data_final.groups(line_col, lines)):
 
         if df_part.empty:
             # print(f"Skipping Line ID = {i}, because no data is available for it")
@@ -33,10 +36,14 @@ def fill_data_with_original(data_final, original_df):
         first_ts = df_part[timestamp_col].iloc[0]
         last_ts = df_part[timestamp_col].iloc[-1]
 
-        original_part = original_df[
-            (original_df[timestamp_col] >= first_ts) &
-            (original_df[timestamp_col] <= last_ts)
-            ]
+        if sorted_ts:
+            original_part = original_df.iloc[original_ts.searchsorted(first_ts, side='left'):
+                                             original_ts.searchsorted(last_ts, side='right')]
+        else:
+            original_part = original_df[
+                (original_df[timestamp_col] >= first_ts) &
+                (original_df[timestamp_col] <= last_ts)
+                ]
 
         existing_ts = set(df_part[timestamp_col])
         original_part_missing = original_part[~original_part[timestamp_col].isin(existing_ts)]
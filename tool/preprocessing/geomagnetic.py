@@ -0,0 +1,139 @@
+from datetime import date as Date, datetime
+from functools import lru_cache
+from typing import Tuple
+
+import numpy as np
+from ahrs.common.constants import DEG2RAD, EARTH_EQUATOR_RADIUS, EARTH_MEAN_RADIUS, EARTH_POLAR_RADIUS
+from ahrs.utils import WMM
+
+# points evaluated at once, bounds the memory of the Legendre functions
+CHUNK_SIZE = 65536
+
+
+@lru_cache(maxsize=32)
+def _load_wmm(date) -> WMM:
+    return WMM(date=date)
+
+
+def model_epoch(date=None) -> Tuple[str, float]:
+    """Model name and the decimal year its coefficients are extrapolated to; dates with the same epoch give the same field."""
+    wmm = _load_wmm(_to_date(date))
+    return wmm.model, round(wmm.date_dec, 1)
+
+
+def wmm_coefficients(date) -> Tuple[np.ndarray, int]:
+    """
+    Schmidt-denormalised Gauss coefficients g, h of the WMM extrapolated to `date`,
+    packed like ahrs does it (g_n^m at [m, n], h_n^m at [n, m - 1]), and the model degree.
+    The model is loaded by ahrs once per date.
+    """
+    wmm = _load_wmm(date)
+    dt = round(wmm.date_dec, 1) - wmm.epoch
+    return wmm.c + dt * wmm.cd, wmm.degree
+
+
+def reference_field(lat, lon, height=0.0, date=None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    WMM north, east and down components (nT) for arrays of geodetic latitudes and longitudes
+    (degrees) and heights (km, as in ahrs.utils.WMM). Evaluates the same expressions
+    in the same order as WMM.magnetic_field, so the results are the same up to rounding
+    of the vectorized sin/cos; the special case of the geographic poles is not handled.
+    `date` is a date or datetime for all points, today if None.
+    """
+    lat, lon, height = np.broadcast_arrays(np.asarray(lat, dtype=np.float64),
+                                           np.asarray(lon, dtype=np.float64),
+                                           np.asarray(height, dtype=np.float64))
+    shape = lat.shape
+    lat, lon, height = lat.ravel(), lon.ravel(), height.ravel()
+    gh, degree = wmm_coefficients(_to_date(date))
+
+    out = np.empty((3, len(lat)))
+    for start in range(0, len(lat), CHUNK_SIZE):
+        stop = start + CHUNK_SIZE
+        out[:, start:stop] = _field(gh, degree, lat[start:stop], lon[start:stop], height[start:stop])
+    return out[0].reshape(shape), out[1].reshape(shape), out[2].reshape(shape)
+
+
+def declination(lat, lon, height=0.0, date=None) -> np.ndarray:
+    """Direction of the horizontal reference field, degrees clockwise from north in [0, 360)."""
+    x, y, _ = reference_field(lat, lon, height, date)
+    return np.degrees(np.arctan2(y, x)) % 360
+
+
+def total_intensity(lat, lon, height=0.0, date=None) -> np.ndarray:
+    x, y, z = reference_field(lat, lon, height, date)
+    return np.sqrt(x**2 + y**2 + z**2)
+
+
+def _to_date(date) -> Date:
+    if date is None:
+        return Date.today()
+    if isinstance(date, datetime):
+        return date.date()
+    return date
+
+
+def _field(gh: np.ndarray, degree: int, lat_deg, lon_deg, height):
+    latitude = lat_deg * DEG2RAD
+    longitude = lon_deg * DEG2RAD
+
+    # geodetic to geocentric spherical coordinates, as ahrs.utils.wmm.geodetic2spherical
+    a, b = EARTH_EQUATOR_RADIUS / 1000.0, EARTH_POLAR_RADIUS / 1000.0
+    f = (a - b) / a
+    e2 = f * (2.0 - f)
+    Rc = a / np.sqrt(1.0 - e2 * np.sin(latitude)**2)
+    rho = (Rc + height) * np.cos(latitude)
+    z = (Rc * (1 - e2) + height) * np.sin(latitude)
+    r = np.sqrt(rho**2 + z**2)
+    lat_prime = np.arcsin(z / r)
+
+    # sin(m * lon), cos(m * lon)
+    sp = np.zeros((degree + 1, len(lat_deg)))
+    cp = np.ones((degree + 1, len(lat_deg)))
+    sp[1], cp[1] = np.sin(longitude), np.cos(longitude)
+    for m in range(2, degree + 1):
+        sp[m] = sp[1] * cp[m - 1] + cp[1] * sp[m - 1]
+        cp[m] = cp[1] * cp[m - 1] - sp[1] * sp[m - 1]
+
+    cos_lat, sin_lat = np.cos(lat_prime), np.sin(lat_prime)
+    ar = EARTH_MEAN_RADIUS / 1000.0 / r
+
+    # Legendre functions of the degrees n - 1 and n - 2, rows are orders
+    P1, dP1 = np.ones((1, len(lat_deg))), np.zeros((1, len(lat_deg)))
+    P2, dP2 = np.zeros((0, len(lat_deg))), np.zeros((0, len(lat_deg)))
+    Xp = np.zeros(len(lat_deg))
+    Yp = np.zeros(len(lat_deg))
+    Zp = np.zeros(len(lat_deg))
+    for n in range(1, degree + 1):
+        P, dP = np.empty((n + 1, len(lat_deg))), np.empty((n + 1, len(lat_deg)))
+        arn2 = ar**(n + 2)
+        x_p = y_p = z_p = 0.0
+        for m in range(n + 1):
+            k = ((n - 1)**2 - m**2) / ((2 * n - 1) * (2 * n - 3))
+            if n == m:
+                P[m] = cos_lat * P1[m - 1]
+                dP[m] = cos_lat * dP1[m - 1] + sin_lat * P1[m - 1]
+            else:
+                p2 = P2[m] if m < len(P2) else 0.0
+                dp2 = dP2[m] if m < len(dP2) else 0.0
+                P[m] = sin_lat * P1[m] - k * p2
+                dP[m] = sin_lat * dP1[m] - cos_lat * P1[m] - k * dp2
+
+            gchs = gh[m, n] * cp[m]
+            gshc = gh[m, n] * sp[m]
+            if m > 0:
+                gchs = gchs + gh[n, m - 1] * sp[m]
+                gshc = gshc - gh[n, m - 1] * cp[m]
+            x_p = x_p + gchs * dP[m]
+            y_p = y_p + m * gshc * P[m]
+            z_p = z_p + gchs * P[m]
+        Xp += arn2 * x_p
+        Yp += arn2 * y_p
+        Zp -= (n + 1) * arn2 * z_p
+        P2, dP2, P1, dP1 = P1, dP1, P, dP
+    Yp = Yp / cos_lat
+
+    # back to the ellipsoidal frame
+    X = Xp * np.cos(lat_prime - latitude) - Zp * np.sin(lat_prime - latitude)
+    Z = Xp * np.sin(lat_prime - latitude) + Zp * np.cos(lat_prime - latitude)
+    return X, Yp, Z
@@ -1,7 +1,12 @@
+import logging
 from datetime import datetime, time, timezone
 from pathlib import Path
 from zoneinfo import ZoneInfo
 
+import numpy as np
+import pandas as pd
+
+from . import time_base
 from .Data import DataAsc
 
 
@@ -36,7 +41,13 @@ def get_timestamp_utc(date, t=None):
 def round_to_step(value, step=200):
     return round(value / step) * step
 
-def add_utc_timestamps(data, datetime=None):
+def add_utc_timestamps(data, datetime=None, drift_fit=False):
+    """
+    UTC timestamps of the device clock, anchored at the first valid GPS time and following the device
+    clock from there. With `drift_fit` the offset of the device clock is fitted piecewise-linearly to all
+    valid GPS times instead, so its drift over long flights doesn't add up from a single anchor.
+    Without GPS times the first sample is taken at the date and time of the file name or `datetime`.
+    """
     if datetime:
         date, time = get_date_and_time_by_str(datetime)
     else:
@@ -46,35 +57,34 @@ def add_utc_timestamps(data, datetime=None):
         data.set_date(date)
 
     # check for gps_time because it has better time values
-    first_valid_index = 0
     gps_time_col = data.config.gps_time_col
     timestamp_col = data.config.timestamp_col
-    if gps_time_col in data.df.columns and data.df[gps_time_col].notna().any():
-        valid_mask = data.df[gps_time_col].notna() & (data.df[gps_time_col] != 0)
-        valid_values = data.df[gps_time_col][valid_mask]
-        first_valid_index = valid_values.index[0]
-        first_valid_time = valid_values.iloc[0]
-        first_tmst = get_timestamp_utc(date, get_time_by_str(first_valid_time))
-
-    elif isinstance(data, DataAsc):
+    timestamps = data.df[timestamp_col].to_numpy()
+    anchor_rows = np.array([], dtype=int)
+    if gps_time_col in data.df.columns:
+        gps_times = data.df[gps_time_col].to_numpy()
+        anchor_rows = np.flatnonzero(pd.notna(gps_times) & (gps_times != 0))
+
+    if len(anchor_rows) == 0 and isinstance(data, DataAsc):
         day_timestamps = data.df[timestamp_col]
         timestamps = get_timestamp_utc(date) + day_timestamps
         data.add_column(data.config.utc_timestamp_col, timestamps)
         return
 
-    timestamps = [None] * len(data.df)
-    timestamps[first_valid_index] = first_tmst
-
-    # Розрахунок вперед
-    for i in range(first_valid_index, len(data.df) - 1):
-        delta = data.df[timestamp_col].iloc[i + 1] - data.df[timestamp_col].iloc[i]
-        timestamps[i + 1] = timestamps[i] + delta
-
-    # Розрахунок назад
-    for i in range(first_valid_index, 0, -1):
-        delta = data.df[timestamp_col].iloc[i] - data.df[timestamp_col].iloc[i - 1]
-        timestamps[i - 1] = timestamps[i] - delta
-    data.add_column(data.config.utc_timestamp_col, timestamps)
+    if len(anchor_rows) == 0:
+        logging.getLogger(__name__).warning("No GPS time, the first sample is taken at the time of the file")
+        utc = time_base.anchor_timestamps(timestamps, 0, get_timestamp_utc(date, time))
+    elif drift_fit:
+        anchor_utc = time_base.utc_timestamps(date, time_base.parse_gps_times(gps_times[anchor_rows]), step=None)
+        knots, offsets = time_base.fit_clock_drift(timestamps[anchor_rows], anchor_utc)
+        utc = time_base.drift_corrected_timestamps(timestamps, knots, offsets)
+    else:
+        first = anchor_rows[0]
+        anchor_utc = time_base.utc_timestamps(date, time_base.parse_gps_times(gps_times[[first]]))[0]
+        if np.isnan(anchor_utc):
+            raise ValueError(f"GPS time {gps_times[first]!r} is not a time of the day")
+        utc = time_base.anchor_timestamps(timestamps, first, int(anchor_utc))
+    data.add_column(data.config.utc_timestamp_col, utc)
 
 # date = get_date("part.csv")
 # print(date)
\ No newline at end of file
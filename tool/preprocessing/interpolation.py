@@ -1,26 +1,78 @@
 import numpy as np
 import pandas as pd
-from geographiclib.geodesic import Geodesic
-from geopy import Point
 
+from . import geodesy
+from .local_frame import position_columns
 
-def interpolate_for_lines(data):
+
+def interpolate_for_lines(data, geometry=geodesy):
+    """Interpolates every line on its own; interpolate_all_lines gives the same result at once."""
     line_col = data.config.line_id_col
-    lat_col = data.config.lat_col
-    lon_col = data.config.lon_col
+    lat_col, lon_col = position_columns(data.config, geometry)
     alt_col = data.config.alt_col
     timestamp_col = data.config.timestamp_col
 
     interpolated_parts = []
-    for line_id in range(data.num_tracks()*2):
-        df_part = data.df[data.df[line_col] == line_id].copy()
-        df_part = interpolate_by_time(df_part, lat_col, lon_col, alt_col, timestamp_col)
+    for df_part in data.groups(line_col, range(data.num_tracks()*2)):
+        df_part = df_part.copy()
+        df_part = interpolate_by_time(df_part, lat_col, lon_col, alt_col, timestamp_col, geometry)
 
         interpolated_parts.append(df_part)
 
     return pd.concat(interpolated_parts, ignore_index=True)
 
-def interpolate_by_time(df, lat_col, lon_col, alt_col, t_col):
+def interpolate_all_lines(data, geometry=geodesy):
+    """
+    Same result as interpolate_for_lines, for all lines at once: the rows are ordered by line
+    (stably), every row is paired with the fixes before and after it in its line, and the positions
+    between fixes are solved in one batch. Rows before the first or after the last fix of a line are dropped.
+    The positions are the columns `geometry` works on (local_frame.position_columns).
+    """
+    config = data.config
+    lat_col, lon_col = position_columns(config, geometry)
+    df = data.df
+    lines = df[config.line_id_col].to_numpy()
+    rows = np.flatnonzero(np.isin(lines, np.arange(data.num_tracks() * 2)))
+    rows = rows[np.argsort(lines[rows], kind='stable')]
+    lines = lines[rows]
+
+    lats = df[lat_col].to_numpy(dtype=float)[rows]
+    lons = df[lon_col].to_numpy(dtype=float)[rows]
+    alts = df[config.alt_col].to_numpy(dtype=float)[rows]
+    times = df[config.timestamp_col].to_numpy(dtype=float)[rows]
+
+    # the fixes at or before and at or after every row
+    positions = np.arange(len(rows))
+    valid = ~np.isnan(lats)
+    before = np.maximum.accumulate(np.where(valid, positions, -1)) if len(rows) else positions
+    after = np.minimum.accumulate(np.where(valid, positions, len(rows))[::-1])[::-1] if len(rows) else positions
+    inside = (before >= 0) & (after < len(rows))
+    inside[inside] = (lines[before[inside]] == lines[inside]) & (lines[after[inside]] == lines[inside])
+
+    result = df.iloc[rows[inside]].reset_index(drop=True)
+    p1, p2 = before[inside], after[inside]
+    lat_interpolated = np.round(lats[inside], 9)
+    lon_interpolated = np.round(lons[inside], 9)
+    alt_interpolated = alts[inside]
+
+    gap = ~valid[inside]
+    if gap.any():
+        p1, p2 = p1[gap], p2[gap]
+        k = calculate_interpolation_coefficients(times[inside][gap], times[p1], times[p2])
+
+        total_distance, azimuth, _ = geometry.inverse(lats[p1], lons[p1], lats[p2], lons[p2])
+        interpolated_lat, interpolated_lon, _ = geometry.direct(lats[p1], lons[p1], azimuth, k * total_distance)
+
+        lat_interpolated[gap] = np.round(interpolated_lat, 9)
+        lon_interpolated[gap] = np.round(interpolated_lon, 9)
+        alt_interpolated[gap] = np.round((1 - k) * alts[p1] + k * alts[p2], 2)
+
+    result[lat_col] = lat_interpolated
+    result[lon_col] = lon_interpolated
+    result[config.alt_col] = alt_interpolated
+    return result
+
+def interpolate_by_time(df, lat_col, lon_col, alt_col, t_col, geometry=geodesy):
     df = df.copy()
     lat_interpolated = []
     lon_interpolated = []
@@ -45,14 +97,11 @@ def interpolate_by_time(df, lat_col, lon_col, alt_col, t_col):
     add_lat_lon(lat_interpolated, lon_interpolated, lat, lon)
     alt_interpolated.append(alt)
 
-    p1 = Point(lat, lon)
-
     for i in range(1, len(df)):
         if p1_ind_ind + 1 >= len(valid_indices):
             break
 
         if i == valid_indices[p1_ind_ind+1]:
-            # print(p1_ind_ind, i)
             p1_ind_ind = p1_ind_ind+1
             lat = df[lat_col].loc[i]
             lon = df[lon_col].loc[i]
@@ -60,44 +109,37 @@ def interpolate_by_time(df, lat_col, lon_col, alt_col, t_col):
 
             add_lat_lon(lat_interpolated, lon_interpolated, lat, lon)
             alt_interpolated.append(alt)
-
-            p1 = Point(lat, lon)
             continue
 
         # find p2
         p1_ind = valid_indices[p1_ind_ind]
         p2_ind = valid_indices[p1_ind_ind+1]
-        # print(p1_ind, p2_ind)
 
+        lat1 = df[lat_col].loc[p1_ind]
+        lon1 = df[lon_col].loc[p1_ind]
         lat2 = df[lat_col].loc[p2_ind]
         lon2 = df[lon_col].loc[p2_ind]
         alt1 = df[alt_col].loc[p1_ind]
         alt2 = df[alt_col].loc[p2_ind]
-        p2 = Point(lat2, lon2)
 
         # 2.3. Обчислення коефіцієнта часової інтерполяції:
         k = calculate_interpolation_coefficient(df[t_col].loc[i], df[t_col].loc[p1_ind], df[t_col].loc[p2_ind])
 
-        # 2.4. Розрахунок повної відстані між точками P1 та P2
-        geo = Geodesic.WGS84.Inverse(p1.latitude, p1.longitude, p2.latitude, p2.longitude)
-        total_distance = geo['s12']  # в метрах
+        # 2.4, 2.6. Повна відстань між точками P1 та P2 і азимут від P1 до P2
+        total_distance, azimuth, _ = geometry.inverse(lat1, lon1, lat2, lon2)  # в метрах
 
         # 2.5. Розрахунок часткової відстані від P1 до шуканої точки P_rtk_interpolated
         partial_distance = k * total_distance
 
-        # 2.6. Визначення азимута від P1 до P2
-        azimuth = geo['azi1']
-
         # 2.7. Обчислення інтерпольованих координат
-        interpolated = Geodesic.WGS84.Direct(p1.latitude, p1.longitude, azimuth, partial_distance)
+        interpolated_lat, interpolated_lon, _ = geometry.direct(lat1, lon1, azimuth, partial_distance)
 
         # Append the interpolated point along with the timestamp
-        add_lat_lon(lat_interpolated, lon_interpolated, interpolated['lat2'], interpolated['lon2'])
+        add_lat_lon(lat_interpolated, lon_interpolated, float(interpolated_lat), float(interpolated_lon))
 
         interpolated_alt = np.round((1 - k) * alt1 + k * alt2, 2)
         alt_interpolated.append(interpolated_alt)
 
-    # print(lat_col, lon_col)
     df[lat_col] = lat_interpolated
     df[lon_col] = lon_interpolated
     df[alt_col] = alt_interpolated
@@ -116,6 +158,14 @@ def calculate_interpolation_coefficient(t_cur, t1, t2):
 
     return (t_cur - t1) / (t2 - t1)
 
+def calculate_interpolation_coefficients(t_cur, t1, t2):
+    """calculate_interpolation_coefficient for arrays, raises the same error for the first row that fails."""
+    failed = np.flatnonzero((t2 == t1) | ~((t1 <= t_cur) & (t_cur <= t2)))
+    if len(failed):
+        i = failed[0]
+        calculate_interpolation_coefficient(t_cur[i], t1[i], t2[i])
+    return (t_cur - t1) / (t2 - t1)
+
 # file_path='../mddConverter_MagDrone_Comparison/dataForTest/25/20250325_121959_MD-R3_#0055_RF.csv'
 # pd.set_option('display.max_columns', None)
 # pd.set_option('display.width', None)
@@ -0,0 +1,187 @@
+from typing import Tuple
+
+import numpy as np
+
+from . import geodesy
+from .trajectory_segmentation import planar_heading
+
+# the origin is rounded, so the frame of a flight doesn't depend on the last digits of its positions
+ORIGIN_DECIMALS = 3
+# corrections of the height of a plane point over the ellipsoid in from_plane, each one gains orders of magnitude
+SURFACE_ITERATIONS = 2
+# lines of every comparison with the geodesics, evenly spread; None compares all
+CHECK_SAMPLES = 1000
+
+
+class LocalFrame:
+    """
+    East-North-Up frame tangent to the WGS84 ellipsoid at the origin of a flight. Positions are projected
+    once by the exact geodetic -> ECEF -> ENU transform (to_plane), the geometry is then solved on their
+    east/north coordinates with PlaneGeometry and the results are projected back once (from_plane).
+    This is accurate for flights of a few kilometres. Azimuths are measured from the north of the
+    origin, which turns by about 0.01 deg per km east or west of it at mid latitudes.
+
+    compare_inverse/compare_direct solve a sample of lines both in the plane and on the ellipsoid,
+    the largest differences are kept in `max_deviation`: distances (m), azimuths (degrees) and
+    end points of direct (m).
+    """
+
+    def __init__(self, lat0: float, lon0: float, check_samples=CHECK_SAMPLES):
+        self.lat0 = lat0
+        self.lon0 = lon0
+        self.check_samples = check_samples
+        self.max_distance = 0.0  # from the origin, of the positions projected so far (m)
+        self.max_deviation = {'distance': 0.0, 'azimuth': 0.0, 'position': 0.0}
+        # geodesy.inverse gives coincident points this azimuth
+        self.plane = PlaneGeometry(0.0 if lat0 < 0 else 180.0)
+
+        lat, lon = np.radians(lat0), np.radians(lon0)
+        self._origin = np.array(_to_ecef(np.array(lat0), np.array(lon0), np.array(0.0)))
+        # rows are the east, north and up unit vectors in ECEF
+        self._rotation = np.array([
+            [-np.sin(lon), np.cos(lon), 0.0],
+            [-np.sin(lat) * np.cos(lon), -np.sin(lat) * np.sin(lon), np.cos(lat)],
+            [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)],
+        ])
+
+    @classmethod
+    def for_flight(cls, lat, lon, check_samples=CHECK_SAMPLES) -> "LocalFrame":
+        """Frame at the median of the flight's positions."""
+        lat0 = round(float(np.nanmedian(lat)), ORIGIN_DECIMALS)
+        lon0 = round(float(np.nanmedian(lon)), ORIGIN_DECIMALS)
+        return cls(lat0, lon0, check_samples)
+
+    def __repr__(self):
+        return f"LocalFrame({self.lat0!r}, {self.lon0!r})"
+
+    def report(self) -> str:
+        d = self.max_deviation
+        return (f"local frame at ({self.lat0}, {self.lon0}), positions up to {self.max_distance:.0f} m from the origin, "
+                f"largest deviation from the geodesics: distance {d['distance']:.3g} m, azimuth {d['azimuth']:.3g} deg, "
+                f"position {d['position']:.3g} m")
+
+    def to_enu(self, lat, lon, height=0.0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        xyz = np.stack(np.broadcast_arrays(*_to_ecef(*_as_float(lat, lon, height))))
+        e, n, u = np.tensordot(self._rotation, xyz - self._origin.reshape((3,) + (1,) * (xyz.ndim - 1)), axes=1)
+        return e, n, u
+
+    def to_geodetic(self, e, n, u=0.0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        enu = np.stack(np.broadcast_arrays(*_as_float(e, n, u)))
+        x, y, z = np.tensordot(self._rotation.T, enu, axes=1) + self._origin.reshape((3,) + (1,) * (enu.ndim - 1))
+        return _from_ecef(x, y, z)
+
+    def to_plane(self, lat, lon) -> Tuple[np.ndarray, np.ndarray]:
+        """East and north (m) of points on the ellipsoid."""
+        e, n, _ = self.to_enu(lat, lon)
+        distances = np.hypot(e, n)
+        distances = distances[np.isfinite(distances)]
+        if len(distances):
+            self.max_distance = max(self.max_distance, float(distances.max()))
+        return e, n
+
+    def from_plane(self, e, n) -> Tuple[np.ndarray, np.ndarray]:
+        """Latitude and longitude of the points of the ellipsoid below (or above) east/north points of the plane."""
+        e, n = _as_float(e, n)
+        # the ellipsoid falls away from the plane by about d^2 / 2R
+        u = -(e**2 + n**2) / (2 * geodesy.WGS84_A)
+        for _ in range(SURFACE_ITERATIONS):
+            lat, lon, height = self.to_geodetic(e, n, u)
+            u = u - height
+        lat, lon, _ = self.to_geodetic(e, n, u)
+        return lat, lon
+
+    def compare_inverse(self, lat1, lon1, lat2, lon2, n1, e1, n2, e2):
+        """Distances and azimuths of lines given both ways, in the plane and by geodesy.inverse."""
+        sample = self._sample(np.size(lat1))
+        lat1, lon1, lat2, lon2, n1, e1, n2, e2 = [np.ravel(a)[sample] for a in
+                                                  np.broadcast_arrays(lat1, lon1, lat2, lon2, n1, e1, n2, e2)]
+        s12, azi, _ = self.plane.inverse(n1, e1, n2, e2)
+        g_s12, g_azi, _ = geodesy.inverse(lat1, lon1, lat2, lon2)
+        self._update('distance', s12 - g_s12)
+        self._update('azimuth', (azi - g_azi + 180) % 360 - 180)
+
+    def compare_direct(self, lat1, lon1, n1, e1, azi1, s12):
+        """End points of lines from points given both ways, in the plane and by geodesy.direct."""
+        sample = self._sample(np.size(lat1))
+        lat1, lon1, n1, e1, azi1, s12 = [np.ravel(a)[sample] for a in np.broadcast_arrays(lat1, lon1, n1, e1, azi1, s12)]
+        n2, e2, _ = self.plane.direct(n1, e1, azi1, s12)
+        lat2, lon2 = self.from_plane(e2, n2)
+        g_lat, g_lon, _ = geodesy.direct(lat1, lon1, azi1, s12)
+        self._update('position', geodesy.distance(lat2, lon2, g_lat, g_lon))
+
+    def _sample(self, size):
+        if self.check_samples is None or size <= self.check_samples:
+            return np.arange(size)
+        return np.unique(np.linspace(0, size - 1, self.check_samples).astype(int))
+
+    def _update(self, name, differences):
+        differences = np.abs(differences)
+        differences = differences[np.isfinite(differences)]
+        if len(differences):
+            self.max_deviation[name] = max(self.max_deviation[name], float(differences.max()))
+
+
+class PlaneGeometry:
+    """
+    The inverse/direct/distance interface of the geodesy module for positions in the plane of a
+    LocalFrame: (north, east) in metres are passed in place of (lat, lon). Azimuths are in [0, 360)
+    and the same at both ends of a line, coincident points get `coincident_azimuth`.
+    """
+
+    def __init__(self, coincident_azimuth=180.0):
+        self.coincident_azimuth = coincident_azimuth
+
+    def inverse(self, n1, e1, n2, e2) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        n1, e1, n2, e2 = _as_float(n1, e1, n2, e2)
+        s12 = np.hypot(e2 - e1, n2 - n1)
+        azi = planar_heading(e1, n1, e2, n2)
+        azi = np.where(s12 == 0, self.coincident_azimuth, azi)
+        return s12, azi, azi
+
+    def direct(self, n1, e1, azi1, s12) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        n1, e1, azi1, s12 = _as_float(n1, e1, azi1, s12)
+        alpha = np.radians(azi1)
+        n2 = n1 + s12 * np.cos(alpha)
+        e2 = e1 + s12 * np.sin(alpha)
+        return n2, e2, np.broadcast_to(azi1, np.shape(n2))
+
+    def distance(self, n1, e1, n2, e2) -> np.ndarray:
+        n1, e1, n2, e2 = _as_float(n1, e1, n2, e2)
+        return np.hypot(e2 - e1, n2 - n1)
+
+
+def position_columns(config, geometry) -> Tuple[str, str]:
+    """Columns of the positions `geometry` works on: north/east for a PlaneGeometry, latitude/longitude otherwise."""
+    if isinstance(geometry, PlaneGeometry):
+        return config.north_col, config.east_col
+    return config.lat_col, config.lon_col
+
+
+def _as_float(*args):
+    return [np.asarray(a, dtype=np.float64) for a in args]
+
+
+def _to_ecef(lat, lon, height):
+    lat, lon = np.radians(lat), np.radians(lon)
+    e2 = geodesy.WGS84_F * (2 - geodesy.WGS84_F)
+    N = geodesy.WGS84_A / np.sqrt(1 - e2 * np.sin(lat)**2)
+    x = (N + height) * np.cos(lat) * np.cos(lon)
+    y = (N + height) * np.cos(lat) * np.sin(lon)
+    z = (N * (1 - e2) + height) * np.sin(lat)
+    return x, y, z
+
+
+def _from_ecef(x, y, z, iterations=4):
+    """Geodetic latitude, longitude (degrees) and height (m); the fixed point iteration converges to
+    well below a micrometre within a few steps near the surface."""
+    e2 = geodesy.WGS84_F * (2 - geodesy.WGS84_F)
+    p = np.hypot(x, y)
+    lon = np.arctan2(y, x)
+    lat = np.arctan2(z, p * (1 - e2))
+    for _ in range(iterations):
+        N = geodesy.WGS84_A / np.sqrt(1 - e2 * np.sin(lat)**2)
+        height = p / np.cos(lat) - N
+        lat = np.arctan2(z, p * (1 - e2 * N / (N + height)))
+    N = geodesy.WGS84_A / np.sqrt(1 - e2 * np.sin(lat)**2)
+    height = p / np.cos(lat) - N
+    return np.degrees(lat), np.degrees(lon), height
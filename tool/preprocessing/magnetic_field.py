@@ -1,70 +1,53 @@
 import numpy as np
 import pandas as pd
-from ahrs.utils import WMM
-from geographiclib.geodesic import Geodesic
-from geopy import Point
+
+from . import geodesy, geomagnetic
+from .local_frame import position_columns
+from .trend import FILTER_KINDS, lowpass, median_trend
+
+# trends are removed over features of this length (m): the window of the running median, the cutoff
+# wavelength of the filters
+RESIDUAL_SCALE_M = 15
+RESIDUAL_METHODS = ('median',) + FILTER_KINDS
 
 
 def total_field(B1, B2, B3):
     return np.round(np.sqrt(B1**2+B2**2+B3**2), 2)
 
-def total_field_anomaly(tf, date, lat_series, lon_series, alt_series):
-    trend = []
-    for lat, lon, alt in zip(lat_series, lon_series, alt_series):
-        alt = 0 if pd.isna(alt) else alt
-        wmm = WMM(date=date, latitude=lat, longitude=lon, height=alt)
-        trend.append(total_field(wmm.X, wmm.Y, wmm.Z))
+def total_field_anomaly(tf, date, lat_series, lon_series, alt_series, reference=geomagnetic):
+    alt = np.nan_to_num(np.asarray(alt_series, dtype=float), nan=0.0)
+    x, y, z = reference.reference_field(lat_series, lon_series, alt, date)
+    trend = total_field(x, y, z)
 
-    return np.array(tf) - np.array(trend)
+    return np.array(tf) - trend
 
 def calculate_residual(tf_series: pd.Series, window_size: int):
-    N = len(tf_series)
-    trend = []
-
-    half = window_size // 2
-
-    start_window_mean = tf_series.iloc[0:window_size].mean()
-    trend.extend([start_window_mean] * half)
-
-    for i in range(half, N - half):
-        window = tf_series.iloc[i - half: i + half + 1]
-        trend.append(window.median())
+    # running median over window_size // 2 samples on either side, the mean of the first window
+    # and the median of the last one at the edges
+    trend = pd.Series(median_trend(tf_series.to_numpy(), window_size), index=tf_series.index)
 
-    end_window_mean = tf_series.iloc[-window_size:].median()
-    trend.extend([end_window_mean] * (N - len(trend)))
+    residual = tf_series - trend
+    return residual.round(2), trend.round(2)
 
-    residual = tf_series - pd.Series(trend, index=tf_series.index)
-    return residual.round(2), pd.Series(trend, index=tf_series.index).round(2)
 
+def velocity(time_series, lat_series, lon_series, geometry=geodesy):
+    t = np.asarray(time_series, dtype=float)
+    lat = np.asarray(lat_series, dtype=float)
+    lon = np.asarray(lon_series, dtype=float)
 
-def velocity(time_series, lat_series, lon_series):
-    vels = []
-    for i in range(len(time_series)-1):
-        t1 = time_series[i]
-        lat1 = lat_series[i]
-        lon1 = lon_series[i]
-        p1 = Point(lat1, lon1)
-
-        t2 = time_series[i+1]
-        lat2 = lat_series[i+1]
-        lon2 = lon_series[i+1]
-        p2 = Point(lat2, lon2)
-
-        dist = Geodesic.WGS84.Inverse(p1.latitude, p1.longitude, p2.latitude, p2.longitude)['s12']
-        vel = dist / (t2-t1)
-        vels.append(vel)
+    dist = geometry.distance(lat[:-1], lon[:-1], lat[1:], lon[1:])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vels = dist / np.diff(t)
 
     return pd.Series(vels).mean()  # meter / ms
 
-def velocity_data(data, n_elements):
+def velocity_data(data, n_elements, geometry=geodesy):
     time_col = data.config.utc_timestamp_col
-    lat_col = data.config.lat_col
-    lon_col = data.config.lon_col
+    lat_col, lon_col = position_columns(data.config, geometry)
     line_id_col = data.config.line_id_col
 
     v = []
-    for i in range(data.num_tracks()):
-        df = data.df[data.df[line_id_col] == i]
+    for df in data.groups(line_id_col, range(data.num_tracks())):
         # decided to calculate velocity by the beginning of the track
         if n_elements < len(df):
             n_elements = len(df)
@@ -72,15 +55,15 @@ def velocity_data(data, n_elements):
         # n = len(df)
         # df = df[int(n/2-n_elements/2):int(n/2+n_elements/2)].reset_index(drop=True)
         # df = df.reset_index(drop=True)
-        v.append(velocity(df[time_col], df[lat_col], df[lon_col]))  # meter / ms
+        v.append(velocity(df[time_col], df[lat_col], df[lon_col], geometry))  # meter / ms
 
     if len(v) == 0:
         raise ValueError("No valid tracks with enough data points to compute velocity.")
 
     return pd.Series(v).mean()
     
-def calculate_window_size(data, s = 15, n_elements=12000):
-    v = velocity_data(data, n_elements)  # m / ms
+def calculate_window_size(data, s = RESIDUAL_SCALE_M, n_elements=12000, geometry=geodesy):
+    v = velocity_data(data, n_elements, geometry)  # m / ms
     t_delta = s / v  # ms
     time_period = (1/data.column_freq(data.config.timestamp_col))*1000
     return int(np.ceil(t_delta/time_period))
@@ -94,12 +77,18 @@ def add_total_field(data):
         data.df[bz_col],
     )
 
-def add_residual_field(data):
+def add_residual_field(data, geometry=geodesy, method='median'):
+    if method in FILTER_KINDS:
+        add_filtered_residual_field(data, method, geometry)
+        return
+    if method != 'median':
+        raise ValueError(f"Unknown residual method {method!r}, expected one of {RESIDUAL_METHODS}")
+
     s_id = data.config.sensor_id_col
     tf_col = data.config.total_field_col
     resid_col = data.config.residual_field_col
 
-    window_size = calculate_window_size(data)
+    window_size = calculate_window_size(data, geometry=geometry)
     df1 = data.df[data.df[s_id] == 1][tf_col]
     df2 = data.df[data.df[s_id] == 2][tf_col]
 
@@ -112,6 +101,30 @@ def add_residual_field(data):
     data.df.loc[mask1, resid_col] = residual1
     data.df.loc[mask2, resid_col] = residual2
 
+def add_filtered_residual_field(data, kind, geometry=geodesy, wavelength=RESIDUAL_SCALE_M, n_elements=12000):
+    """
+    Residual field line by line, the total field minus its low-pass (trend.lowpass) with the cutoff at
+    `wavelength` m: the cutoff frequency is the speed of the line over the wavelength.
+    """
+    c = data.config
+    lines = data.group_index(c.line_id_col)
+    tf = data.df[c.total_field_col].to_numpy(dtype=float)
+    sample_rate = data.column_freq(c.timestamp_col)
+    t, lat, lon = (lines.split(data.df[col].to_numpy(dtype=float))
+                   for col in (c.utc_timestamp_col,) + position_columns(c, geometry))
+
+    residual = np.full(len(tf), np.nan)
+    mean_speed = None
+    for i, rows in enumerate(lines.positions(v) for v in lines.values):
+        speed = velocity(t[i], lat[i], lon[i], geometry) * 1000  # m / s
+        if not speed > 0:
+            if mean_speed is None:
+                mean_speed = velocity_data(data, n_elements, geometry) * 1000
+            speed = mean_speed
+        residual[rows] = tf[rows] - lowpass(tf[rows], speed / wavelength, sample_rate, kind)
+
+    data.df[c.residual_field_col] = np.round(residual, 2)
+
 
 # file_path = 'final.csv'
 # data = DataFinal.from_file(file_path)
@@ -1,103 +1,283 @@
 import logging
+from typing import Optional
+
+import numpy as np
 import pandas as pd
 
-from .external_gnss import merge_gnss_into_data
+from . import (attitude_determination, external_gnss, frequency, geodesy, geomagnetic, handle_date_time, interpolation,
+               local_frame, magnetic_calibration, magnetic_field, reference_grid, sensors_offset,
+               time_base, trajectory_segmentation, trend)
+from .checkpoint import CheckpointStore, PipelineState, data_digest, file_digest, step_key
+from .external_gnss import merge_gnss_into_data, read_gnss_window
 from .frequency import reduce_frequency, increase_frequency
 from .handle_date_time import add_utc_timestamps
-from .interpolation import interpolate_for_lines
+from .interpolation import interpolate_all_lines
+from .local_frame import LocalFrame, position_columns
 from .magnetic_calibration import apply_magnetometer_calibration
 from .magnetic_field import add_total_field, add_residual_field
-from .sensors_offset import add_sensor_positions_by_heading
-from .trajectory_segmentation import segment_by_heading_incremental
-from .Data import DataOwn, DataFinal, DataExternalGNSS
+from .sensors_offset import DIST_CENTER_SENSOR, add_sensor_positions_by_heading, compute_sensor_angles
+from .trajectory_segmentation import segment_by_heading
+from .Data import DataOwn, DataFinal
 from .attitude_determination import calculate_yaws, get_facing_points, get_facing_tracks
 
-def preprocess(data_filepath, delim, systeminfo_filepath, result_filepath, datetime, external_gnss_filepath=None):
-    pd.set_option('display.max_columns', None)
-    pd.set_option('display.width', None)
-
+def preprocess(data_filepath, delim, systeminfo_filepath, result_filepath, datetime, external_gnss_filepath=None,
+               checkpoints=None, resume_from=None, reference=None, use_local_frame=False, residual_method='median', clock_drift_fit=False):
     logger = logging.getLogger(__name__)
 
     logger.info(f"Step 0: Downloading data from {data_filepath}")
     data = DataOwn.from_file(data_filepath, delimiter=delim)
     logger.debug(f"\n{data.df}\n")
 
+    data_final = preprocess_data(data, systeminfo_filepath, datetime, external_gnss_filepath, checkpoints, resume_from,
+                                 reference, use_local_frame, residual_method, clock_drift_fit)
+
+    result_filepath = get_result_filepath(data_filepath, result_filepath, external_gnss_filepath)
+    logger.info(f"Step 12: Saving the results to {result_filepath}")
+    data_final.save(new_filepath=result_filepath, new_delimiter=';')
+    return data_final
+
+
+def get_result_filepath(data_filepath, result_filepath=None, external_gnss_filepath=None):
+    if result_filepath is None:
+        result_filepath = str(data_filepath).split(".")[0] + "_prep" + ".csv"
+
+    if external_gnss_filepath is not None:
+        result_filepath = str(result_filepath).split(".")[0] + "_eg" + ".csv" #ex = external_gnss
+
+    return result_filepath
+
+
+# step parameters, part of the checkpoint keys
+SEGMENT_MAX_ANGLE_DIFF = 30
+SEGMENT_MIN_LEN = 10
+GNSS_MAX_DIFF_MS = 8
+
+
+def preprocess_data(data, systeminfo_filepath, datetime, external_gnss_filepath=None,
+                    checkpoints: Optional[CheckpointStore] = None, resume_from=None, reference=None,
+                    use_local_frame=False, residual_method='median', clock_drift_fit=False) -> DataFinal:
+    """
+    Runs steps 1-11 on already loaded raw data and returns the result without saving it.
+    With `checkpoints` the state is saved after the store's steps. With `resume_from`
+    the latest valid checkpoint before that step is loaded and the run continues from there.
+    `external_gnss_filepath` may also be a list of logs (e.g. base and rover), merged in one pass.
+    `reference` gives the WMM declination the yaws of step 5 are corrected with, e.g. a GridReference;
+    the model is evaluated directly if None. No other step uses it.
+    With `use_local_frame` the positions are projected once to an East-North-Up frame of the flight,
+    headings, sensor offsets, segment lengths, interpolation and speeds are computed on them and the
+    results are projected back to latitude/longitude at the end.
+    `residual_method` removes the trend of the total field with the running median ('median') or
+    line by line with a zero-phase 'butterworth' or 'gaussian' low-pass.
+    With `clock_drift_fit` the UTC time base follows the drift of the device clock between all GPS times.
+    """
+    pd.set_option('display.max_columns', None)
+    pd.set_option('display.width', None)
+
+    logger = logging.getLogger(__name__)
+
+    steps = [
+        (1, _calibrate, [magnetic_calibration]),
+        (2, _add_timestamps, [handle_date_time, time_base]),
+        (2.5, _merge_external_gnss, [external_gnss]),
+        (3, _reduce_frequency, [frequency]),
+        (4, _segment, [trajectory_segmentation, geodesy, local_frame]),
+        (5, _add_yaws, [attitude_determination, geomagnetic, reference_grid]),
+        (6, _add_facings, [attitude_determination]),
+        (7, _add_sensor_positions, [sensors_offset, geodesy, local_frame]),
+        (8, _increase_frequency, [frequency]),
+        (9, _interpolate, [interpolation, geodesy, local_frame]),
+        (10, _add_total_field, [magnetic_field]),
+        (11, _add_residual_field, [magnetic_field, trend, geodesy, local_frame]),
+    ]
+    settings = {'systeminfo_filepath': systeminfo_filepath, 'datetime': datetime,
+                'external_gnss_filepath': external_gnss_filepath, 'reference': reference or geomagnetic,
+                'use_local_frame': use_local_frame, 'residual_method': residual_method,
+                'clock_drift_fit': clock_drift_fit}
+
+    state = PipelineState(data)
+    keys = []
+    if checkpoints is not None:
+        params = {
+            1: {'systeminfo': file_digest(systeminfo_filepath)},
+            2: {'datetime': datetime, 'clock_drift_fit': clock_drift_fit},
+            2.5: {'gnss': file_digest(external_gnss_filepath), 'max_diff_ms': GNSS_MAX_DIFF_MS},
+            4: {'max_angle_diff': SEGMENT_MAX_ANGLE_DIFF, 'min_segment_len': SEGMENT_MIN_LEN,
+                'local_frame': use_local_frame},
+            5: {'reference': repr(reference)},
+            11: {'method': residual_method},
+        }
+        key = data_digest(data)
+        for step, function, modules in steps:
+            key = step_key(key, step, [function] + modules, params.get(step, {}))
+            keys.append(key)
+
+    first = 0
+    if checkpoints is not None and resume_from is not None:
+        for i in reversed(range(len(steps))):
+            step = steps[i][0]
+            if step >= resume_from or step not in checkpoints.steps:
+                continue
+            loaded = checkpoints.load(step, keys[i])
+            if loaded is not None:
+                logger.info(f"Resuming after step {step:g} from {checkpoints.path(step)}")
+                state, first = loaded, i + 1
+                break
+        else:
+            logger.warning(f"No valid checkpoint before step {resume_from:g}, starting from the beginning")
+
+    for i in range(first, len(steps)):
+        step, function = steps[i][:2]
+        function(state, **settings)
+        if checkpoints is not None and step in checkpoints.steps:
+            checkpoints.save(step, keys[i], state)
+
+    if state.frame is not None:
+        _check_local_frame(state)
+        _leave_local_frame(state)
+        logger.info(f"Geometry solved in a {state.frame.report()}")
+    return state.data_final
+
+
+def _calibrate(state, systeminfo_filepath, **_):
     if systeminfo_filepath is not None:
-        logger.info(f"Step 1: Calibrating magnetometer sensors with {systeminfo_filepath}")
-        apply_magnetometer_calibration(systeminfo_filepath, data)
-        logger.debug(f"\n{data.df}\n")
+        logging.getLogger(__name__).info(f"Step 1: Calibrating magnetometer sensors with {systeminfo_filepath}")
+        apply_magnetometer_calibration(systeminfo_filepath, state.data)
+        logging.getLogger(__name__).debug(f"\n{state.data.df}\n")
 
-    logger.info(f"Step 2: Adding date and UTC timestamps")
-    add_utc_timestamps(data, datetime)
-    logger.debug(f"\n{data.df}\n")
 
+def _add_timestamps(state, datetime, clock_drift_fit, **_):
+    logging.getLogger(__name__).info(f"Step 2: Adding date and UTC timestamps")
+    add_utc_timestamps(state.data, datetime, clock_drift_fit)
+    logging.getLogger(__name__).debug(f"\n{state.data.df}\n")
+
+
+def _merge_external_gnss(state, external_gnss_filepath, **_):
     if external_gnss_filepath is not None:
-        logger.info(f"Step 2.5: Overriding with external gnss: {external_gnss_filepath}")
-        external_data = DataExternalGNSS.from_file(external_gnss_filepath)
-        merge_gnss_into_data(data, external_data, max_diff_ms=8)
-        logger.debug(f"\n{data.df}\n")
+        logging.getLogger(__name__).info(f"Step 2.5: Overriding with external gnss: {external_gnss_filepath}")
+        paths = external_gnss_filepath if isinstance(external_gnss_filepath, (list, tuple)) else [external_gnss_filepath]
+        # only the fixes of the flight's time range are read, the ones further out can't be merged
+        utc = state.data.df[state.data.config.utc_timestamp_col]
+        external_data = [read_gnss_window(path, utc.min(), utc.max(), GNSS_MAX_DIFF_MS) for path in paths]
+        merge_gnss_into_data(state.data, external_data, max_diff_ms=GNSS_MAX_DIFF_MS)
+        logging.getLogger(__name__).debug(f"\n{state.data.df}\n")
+
 
-    logger.info(f"Step 3: Reducing frequency if frequency of gnss data and timestamps are different")
+def _reduce_frequency(state, **_):
+    logging.getLogger(__name__).info(f"Step 3: Reducing frequency if frequency of gnss data and timestamps are different")
+    data = state.data
     timestamp_freq = data.column_freq(data.config.timestamp_col)
     gnss_freq = data.column_freq(data.config.lat_col)
-    df_original = None
     if gnss_freq < timestamp_freq:
-        df_original = data.df.copy()
+        state.df_original = data.df.copy()
         data.df = reduce_frequency(data)
-        logger.debug(f"\n{data.df}\n")
-
-    logger.info(f"Step 4: Extracting tracks. Calculating headings")
-    track_ids, headings = segment_by_heading_incremental(data.df,
-                                          data.config.lat_col,
-                                          data.config.lon_col,
-                                          max_angle_diff=30,
-                                          min_segment_len=10)
+        logging.getLogger(__name__).debug(f"\n{data.df}\n")
+
+
+def _geometry(state):
+    return state.frame.plane if state.frame is not None else geodesy
+
+
+def _check_local_frame(state):
+    """
+    Solves a sample of the flight's plane geometry on the ellipsoid too, for the deviations in frame.report():
+    headings and distances between consecutive points, lengths of the tracks, sensor offsets and the
+    positions half way between consecutive points, where a straight line is furthest from the geodesic.
+    """
+    frame = state.frame
+    data = state.data
+    c = data.config
+    lat, lon, north, east = (data.df[col].to_numpy(dtype=float) for col in (c.lat_col, c.lon_col, c.north_col, c.east_col))
+
+    frame.compare_inverse(lat[:-1], lon[:-1], lat[1:], lon[1:], north[:-1], east[:-1], north[1:], east[1:])
+    tracks = data.group_index(c.track_id_col)
+    first, last = tracks.order[tracks.starts], tracks.order[tracks.stops - 1]
+    frame.compare_inverse(lat[first], lon[first], lat[last], lon[last], north[first], east[first], north[last], east[last])
+
+    for angles in compute_sensor_angles(data.df[c.heading_col].to_numpy(dtype=float)):
+        frame.compare_direct(lat, lon, north, east, angles, DIST_CENTER_SENSOR)
+    s12, azi, _ = frame.plane.inverse(north[:-1], east[:-1], north[1:], east[1:])
+    frame.compare_direct(lat[:-1], lon[:-1], north[:-1], east[:-1], azi, s12 / 2)
+
+
+def _leave_local_frame(state):
+    """Latitude/longitude of the final positions from their east/north in the local frame, which are dropped."""
+    data_final = state.data_final
+    c = data_final.config
+    lats, lons = state.frame.from_plane(data_final.df[c.east_col], data_final.df[c.north_col])
+    data_final.df[c.lat_col] = np.round(lats, 9)
+    data_final.df[c.lon_col] = np.round(lons, 9)
+    data_final.df = data_final.df.drop(columns=[c.east_col, c.north_col])
+
+
+def _segment(state, use_local_frame, **_):
+    logging.getLogger(__name__).info(f"Step 4: Extracting tracks. Calculating headings")
+    data = state.data
+    if use_local_frame:
+        state.frame = LocalFrame.for_flight(data.df[data.config.lat_col], data.df[data.config.lon_col])
+        east, north = state.frame.to_plane(data.df[data.config.lat_col], data.df[data.config.lon_col])
+        data.add_column(data.config.east_col, east)
+        data.add_column(data.config.north_col, north)
+    geometry = _geometry(state)
+    lat_col, lon_col = position_columns(data.config, geometry)
+    track_ids, headings = segment_by_heading(data.df[lat_col],
+                                             data.df[lon_col],
+                                             max_angle_diff=SEGMENT_MAX_ANGLE_DIFF,
+                                             min_segment_len=SEGMENT_MIN_LEN,
+                                             geometry=geometry)
     data.add_column(data.config.track_id_col, track_ids)
     data.add_column(data.config.heading_col, headings)
     data.df = data.df.dropna(subset=[data.config.track_id_col]).reset_index(drop=True)
-    logger.debug(f"\n{data.df}\n")
+    logging.getLogger(__name__).debug(f"\n{data.df}\n")
 
-    logger.info(f"Step 5: Calculating orientations (yaws)")
-    yaws = calculate_yaws(data)
-    data.add_column(data.config.yaw_col, yaws)
-    logger.debug(f"\n{data.df}\n")
 
-    logger.info(f"Step 6: Adding facing direction based on heading and yaw")
+def _add_yaws(state, reference, **_):
+    logging.getLogger(__name__).info(f"Step 5: Calculating orientations (yaws)")
+    yaws = calculate_yaws(state.data, reference)
+    state.data.add_column(state.data.config.yaw_col, yaws)
+    logging.getLogger(__name__).debug(f"\n{state.data.df}\n")
+
+
+def _add_facings(state, **_):
+    logging.getLogger(__name__).info(f"Step 6: Adding facing direction based on heading and yaw")
+    data = state.data
     facings = get_facing_points(data.df[data.config.heading_col], data.df[data.config.yaw_col])
     data.add_column(data.config.facing_col, facings)
     ft = get_facing_tracks(data)
     data.add_column(data.config.track_facing_col, ft)
-    logger.debug(f"\n{data.df}\n")
+    logging.getLogger(__name__).debug(f"\n{data.df}\n")
 
-    logger.info(f"Step 7: Calculating the coordinates of the magnetometer sensors side tracks. Adding line_id")
-    data_final = DataFinal.from_empty()
-    add_sensor_positions_by_heading(data, data_final)
-    data_final.gen_line_id()
-    logger.debug(f"\n{data_final.df}\n")
 
-    logger.info(f"Step 8: Increasing frequency, if it was reduced in step 3")
-    if df_original is not None:
-        increase_frequency(data_final, df_original, data.config)
-        logger.debug(f"\n{data_final.df}\n")
+def _add_sensor_positions(state, **_):
+    logging.getLogger(__name__).info(f"Step 7: Calculating the coordinates of the magnetometer sensors side tracks. Adding line_id")
+    state.data_final = DataFinal.from_empty()
+    if state.frame is not None:
+        state.data_final.add_column(state.data_final.config.east_col)
+        state.data_final.add_column(state.data_final.config.north_col)
+    add_sensor_positions_by_heading(state.data, state.data_final, _geometry(state))
+    state.data_final.gen_line_id()
+    logging.getLogger(__name__).debug(f"\n{state.data_final.df}\n")
 
-    logger.info(f"Step 9: Interpolating GNSS data (latitude, longitude, altitude)")
-    data_final.df = interpolate_for_lines(data_final)
-    logger.debug(f"\n{data_final.df}\n")
 
-    logger.info(f"Step 10: Calculating total field")
-    add_total_field(data_final)
-    logger.debug(f"\n{data_final.df}\n")
+def _increase_frequency(state, **_):
+    logging.getLogger(__name__).info(f"Step 8: Increasing frequency, if it was reduced in step 3")
+    if state.df_original is not None:
+        increase_frequency(state.data_final, state.df_original, state.data.config)
+        logging.getLogger(__name__).debug(f"\n{state.data_final.df}\n")
 
-    logger.info(f"Step 11: Calculating residual field")
-    add_residual_field(data_final)
-    logger.debug(f"\n{data_final.df}\n")
 
-    if result_filepath is None:
-        result_filepath = str(data_filepath).split(".")[0] + "_prep" + ".csv"
+def _interpolate(state, **_):
+    logging.getLogger(__name__).info(f"Step 9: Interpolating GNSS data (latitude, longitude, altitude)")
+    state.data_final.df = interpolate_all_lines(state.data_final, _geometry(state))
+    logging.getLogger(__name__).debug(f"\n{state.data_final.df}\n")
 
-    if external_gnss_filepath is not None:
-        result_filepath = str(result_filepath).split(".")[0] + "_eg" + ".csv" #ex = external_gnss
 
-    logger.info(f"Step 12: Saving the results to {result_filepath}")
-    data_final.save(new_filepath=result_filepath, new_delimiter=';')
+def _add_total_field(state, **_):
+    logging.getLogger(__name__).info(f"Step 10: Calculating total field")
+    add_total_field(state.data_final)
+    logging.getLogger(__name__).debug(f"\n{state.data_final.df}\n")
+
 
+def _add_residual_field(state, residual_method, **_):
+    logging.getLogger(__name__).info(f"Step 11: Calculating residual field ({residual_method})")
+    add_residual_field(state.data_final, _geometry(state), residual_method)
+    logging.getLogger(__name__).debug(f"\n{state.data_final.df}\n")
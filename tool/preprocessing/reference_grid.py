@@ -0,0 +1,271 @@
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from . import geomagnetic
+
+GRID_VERSION = 1
+DEFAULT_SPACING_DEG = 0.01  # about 1.1 km in latitude
+DEFAULT_HEIGHT_SPACING_KM = 0.1
+# the survey bounding box is padded and snapped to this, so flights over the same area share a grid
+TILE_DEG = 0.1
+# degrees or km a point may be outside the grid by rounding and still count as inside
+EDGE_TOLERANCE = 1e-9
+
+
+@dataclass
+class ReferenceGrid:
+    """
+    WMM north/east/down components on a regular latitude x longitude x height grid
+    for one model epoch, answered for any point inside by (tri)linear interpolation.
+
+    Error bound: over a cell the field is practically quadratic, so the error of linear
+    interpolation is at most the sum over the axes of h^2/8 times the second derivative
+    along that axis, which is the error half way between two nodes. When a grid is built
+    these errors are measured along every edge, and their sum over the axes is kept as
+    `max_error` (nT, per component) and `max_declination_error` (degrees). With the default
+    0.01 deg spacing it's below 0.001 nT, far below the WMM's own uncertainty (about 100 nT).
+    """
+    model: str
+    epoch: float
+    lat: np.ndarray
+    lon: np.ndarray
+    height: np.ndarray
+    X: np.ndarray  # shape (height, lat, lon)
+    Y: np.ndarray
+    Z: np.ndarray
+    max_error: float = np.nan
+    max_declination_error: float = np.nan
+
+    @property
+    def bounds(self) -> Tuple[float, float, float, float, float, float]:
+        return (self.lat[0], self.lat[-1], self.lon[0], self.lon[-1], self.height[0], self.height[-1])
+
+    @property
+    def spacing(self) -> float:
+        return float(self.lat[1] - self.lat[0]) if len(self.lat) > 1 else np.nan
+
+    def covers(self, bounds) -> bool:
+        # the last node of an axis can be off the snapped bound by rounding
+        lat0, lat1, lon0, lon1, h0, h1 = self.bounds
+        q_lat0, q_lat1, q_lon0, q_lon1, q_h0, q_h1 = bounds
+        return (lat0 - EDGE_TOLERANCE <= q_lat0 and q_lat1 <= lat1 + EDGE_TOLERANCE
+                and lon0 - EDGE_TOLERANCE <= q_lon0 and q_lon1 <= lon1 + EDGE_TOLERANCE
+                and h0 - EDGE_TOLERANCE <= q_h0 and q_h1 <= h1 + EDGE_TOLERANCE)
+
+    @classmethod
+    def build(cls, date, bounds, spacing=DEFAULT_SPACING_DEG, height_spacing=DEFAULT_HEIGHT_SPACING_KM) -> 'ReferenceGrid':
+        lat0, lat1, lon0, lon1, h0, h1 = bounds
+        lat = _axis(lat0, lat1, spacing)
+        lon = _axis(lon0, lon1, spacing)
+        height = _axis(h0, h1, height_spacing)
+        model, epoch = geomagnetic.model_epoch(date)
+
+        H, LAT, LON = np.meshgrid(height, lat, lon, indexing='ij')
+        X, Y, Z = geomagnetic.reference_field(LAT, LON, H, date)
+        grid = cls(model, epoch, lat, lon, height, X, Y, Z)
+        grid.max_error, grid.max_declination_error = grid._measure_error(date)
+        return grid
+
+    def _measure_error(self, date) -> Tuple[float, float]:
+        """Sum over the axes of the largest error half way between two nodes along that axis."""
+        error = d_error = 0.0
+        axes = [self.height, self.lat, self.lon]
+        for i, axis in enumerate(axes):
+            if len(axis) < 2:
+                continue
+            points = axes[:i] + [(axis[:-1] + axis[1:]) / 2] + axes[i + 1:]
+            H, LAT, LON = np.meshgrid(*points, indexing='ij')
+            exact = [a.ravel() for a in geomagnetic.reference_field(LAT, LON, H, date)]
+            approx = self.interpolate(LAT.ravel(), LON.ravel(), H.ravel())
+            error += max(np.abs(a - e).max() for a, e in zip(approx, exact))
+            d_exact = np.degrees(np.arctan2(exact[1], exact[0]))
+            d_approx = np.degrees(np.arctan2(approx[1], approx[0]))
+            d_error += np.abs((d_approx - d_exact + 180) % 360 - 180).max()
+        return float(error), float(d_error)
+
+    def interpolate(self, lat, lon, height) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """X, Y, Z at the points, NaN outside the grid."""
+        lat, lon, height = (np.asarray(a, dtype=np.float64).ravel() for a in np.broadcast_arrays(lat, lon, height))
+        weights = [_cell(axis, values) for axis, values in ((self.height, height), (self.lat, lat), (self.lon, lon))]
+        (ih, wh), (ila, wla), (ilo, wlo) = weights
+        inside = ~(np.isnan(wh) | np.isnan(wla) | np.isnan(wlo))
+        ih, ila, ilo = (np.where(inside, i, 0) for i in (ih, ila, ilo))
+        wh, wla, wlo = (np.where(inside, w, 0.0) for w in (wh, wla, wlo))
+
+        out = []
+        for values in (self.X, self.Y, self.Z):
+            result = np.zeros(len(lat))
+            for dh, fh in ((0, 1 - wh), (1, wh)):
+                for dla, fla in ((0, 1 - wla), (1, wla)):
+                    for dlo, flo in ((0, 1 - wlo), (1, wlo)):
+                        idx = (np.minimum(ih + dh, len(self.height) - 1),
+                               np.minimum(ila + dla, len(self.lat) - 1),
+                               np.minimum(ilo + dlo, len(self.lon) - 1))
+                        result += fh * fla * flo * values[idx]
+            result[~inside] = np.nan
+            out.append(result)
+        return out[0], out[1], out[2]
+
+    def save(self, path):
+        path = Path(path)
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+        with open(tmp, 'wb') as f:
+            np.savez(f, version=GRID_VERSION, model=self.model, epoch=self.epoch,
+                     lat=self.lat, lon=self.lon, height=self.height, X=self.X, Y=self.Y, Z=self.Z,
+                     error=np.array([self.max_error, self.max_declination_error]))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path) -> Optional['ReferenceGrid']:
+        with np.load(path) as f:
+            if int(f['version']) != GRID_VERSION:
+                return None
+            max_error, max_declination_error = f['error']
+            return cls(str(f['model']), float(f['epoch']), f['lat'], f['lon'], f['height'], f['X'], f['Y'], f['Z'],
+                       float(max_error), float(max_declination_error))
+
+
+class GridReference:
+    """
+    Reference field answered from survey-area grids stored in `cache_dir`.
+    A grid covers the padded bounding box of the queried points for one model epoch
+    and is reused by every later query inside it. Grids of epochs more than
+    `max_epoch_age` years older than the current query's and grids covered by a newer,
+    larger one are deleted, and at most `max_grids` are kept (least recently used go first).
+    Has the same declination/reference_field functions as the geomagnetic module.
+    """
+
+    def __init__(self, cache_dir, spacing=DEFAULT_SPACING_DEG, height_spacing=DEFAULT_HEIGHT_SPACING_KM,
+                 max_grids=20, max_epoch_age=1.0):
+        self.cache_dir = Path(cache_dir)
+        self.spacing = spacing
+        self.height_spacing = height_spacing
+        self.max_grids = max_grids
+        self.max_epoch_age = max_epoch_age
+
+    def __repr__(self):
+        # what the results depend on, part of the checkpoint keys
+        return f"GridReference(spacing={self.spacing}, height_spacing={self.height_spacing})"
+
+    def reference_field(self, lat, lon, height=0.0, date=None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        lat, lon, height = (np.asarray(a, dtype=np.float64) for a in np.broadcast_arrays(lat, lon, height))
+        shape = lat.shape
+        valid = ~(np.isnan(lat) | np.isnan(lon) | np.isnan(height))
+        out = np.full((3, lat.size), np.nan)
+        if valid.any():
+            grid = self.grid_for(lat[valid], lon[valid], height[valid], date)
+            out[:, valid.ravel()] = grid.interpolate(lat[valid], lon[valid], height[valid])
+        return out[0].reshape(shape), out[1].reshape(shape), out[2].reshape(shape)
+
+    def declination(self, lat, lon, height=0.0, date=None) -> np.ndarray:
+        x, y, _ = self.reference_field(lat, lon, height, date)
+        return np.degrees(np.arctan2(y, x)) % 360
+
+    def grid_for(self, lat, lon, height, date) -> ReferenceGrid:
+        logger = logging.getLogger(__name__)
+        model, epoch = geomagnetic.model_epoch(date)
+        bounds = self._snapped_bounds(lat, lon, height)
+
+        same_epoch = []
+        for path, grid in self._grids():
+            if grid.model == model and grid.epoch == epoch and np.isclose(grid.spacing, self.spacing):
+                if grid.covers(bounds):
+                    path.touch()
+                    return grid
+                same_epoch.append((path, grid))
+
+        # a new grid also covers the grids of the same epoch it overlaps, which are then replaced
+        replaced = [(path, grid) for path, grid in same_epoch if _overlap(grid.bounds, bounds)]
+        for _, grid in replaced:
+            bounds = _union(bounds, grid.bounds)
+
+        start = time.perf_counter()
+        grid = ReferenceGrid.build(date, bounds, self.spacing, self.height_spacing)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        grid_path = self.cache_dir / _grid_name(grid)
+        grid.save(grid_path)
+        logger.info(f"Reference grid {_grid_name(grid)} built in {time.perf_counter() - start:.1f} s, "
+                    f"max error {grid.max_error:.2e} nT, {grid.max_declination_error:.2e} deg")
+        for path, _ in replaced:
+            # a grid of the same bounds was just overwritten
+            if path != grid_path:
+                path.unlink(missing_ok=True)
+
+        self.evict(epoch)
+        return grid
+
+    def evict(self, current_epoch: float):
+        grids = self._grids()
+        for path, grid in grids:
+            if current_epoch - grid.epoch > self.max_epoch_age:
+                logging.getLogger(__name__).info(f"Evicting reference grid {path.name}")
+                path.unlink(missing_ok=True)
+        kept = sorted((p for p, g in grids if p.exists()), key=lambda p: p.stat().st_mtime)
+        for path in kept[:max(0, len(kept) - self.max_grids)]:
+            logging.getLogger(__name__).info(f"Evicting reference grid {path.name}")
+            path.unlink(missing_ok=True)
+
+    def _grids(self) -> List[Tuple[Path, ReferenceGrid]]:
+        grids = []
+        if not self.cache_dir.exists():
+            return grids
+        for path in self.cache_dir.glob("wmm_*.npz"):
+            try:
+                grid = ReferenceGrid.load(path)
+            except (OSError, ValueError, KeyError) as e:
+                logging.getLogger(__name__).warning(f"Can't read reference grid {path}: {e}")
+                continue
+            if grid is not None:
+                grids.append((path, grid))
+        return grids
+
+    def _snapped_bounds(self, lat, lon, height):
+        lat0 = np.floor(np.min(lat) / TILE_DEG) * TILE_DEG
+        lat1 = max(np.ceil(np.max(lat) / TILE_DEG) * TILE_DEG, lat0 + TILE_DEG)
+        lon0 = np.floor(np.min(lon) / TILE_DEG) * TILE_DEG
+        lon1 = max(np.ceil(np.max(lon) / TILE_DEG) * TILE_DEG, lon0 + TILE_DEG)
+        h0 = np.floor(np.min(height) / self.height_spacing) * self.height_spacing
+        h1 = np.ceil(np.max(height) / self.height_spacing) * self.height_spacing
+        return (round(lat0, 6), round(lat1, 6), round(lon0, 6), round(lon1, 6), round(h0, 6), round(h1, 6))
+
+
+def _axis(start, stop, step) -> np.ndarray:
+    n = int(round((stop - start) / step)) + 1
+    return start + step * np.arange(max(n, 1))
+
+
+def _cell(axis: np.ndarray, values: np.ndarray):
+    """Index of the cell of every value and the position inside it (0..1), NaN outside the axis."""
+    if len(axis) == 1:
+        weight = np.where(np.isclose(values, axis[0]), 0.0, np.nan)
+        return np.zeros(len(values), dtype=np.int64), weight
+    step = axis[1] - axis[0]
+    pos = (values - axis[0]) / step
+    # tolerate rounding just outside the edges
+    pos = np.where((pos < 0) & (pos > -1e-9), 0.0, pos)
+    pos = np.where((pos > len(axis) - 1) & (pos < len(axis) - 1 + 1e-9), len(axis) - 1, pos)
+    outside = (pos < 0) | (pos > len(axis) - 1) | np.isnan(pos)
+    index = np.clip(np.floor(np.nan_to_num(pos)), 0, len(axis) - 2).astype(np.int64)
+    weight = np.where(outside, np.nan, pos - index)
+    return index, weight
+
+
+def _overlap(a, b) -> bool:
+    return a[0] <= b[1] and b[0] <= a[1] and a[2] <= b[3] and b[2] <= a[3]
+
+
+def _union(a, b):
+    return (min(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3]), min(a[4], b[4]), max(a[5], b[5]))
+
+
+def _grid_name(grid: ReferenceGrid) -> str:
+    lat0, lat1, lon0, lon1, h0, h1 = grid.bounds
+    return (f"wmm_{grid.model}_{grid.epoch:.1f}_{lat0:+.2f}_{lat1:+.2f}_{lon0:+.2f}_{lon1:+.2f}"
+            f"_{h0:g}_{h1:g}_{grid.spacing:g}.npz")
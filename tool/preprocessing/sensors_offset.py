@@ -1,6 +1,9 @@
+import numpy as np
 import pandas as pd
-from geographiclib.geodesic import Geodesic
+
+from . import geodesy
 from .Data import build_column_rename_map
+from .local_frame import position_columns
 
 DIST_CENTER_SENSOR = 0.5
 
@@ -10,39 +13,38 @@ def compute_sensor_angles(heading):
     return left, right
 
 def compute_sensor_angles_with_facing(heading, facing):
+    """Same for scalars or arrays of headings and facings."""
     left, right = compute_sensor_angles(heading)
-    if facing == 1:
-        return left, right
-    elif facing == -1:
-        return right, left
+    facing = np.asarray(facing)
+    if not np.isin(facing, (1, -1)).all():
+        raise ValueError(f"Facing must be 1 or -1, got: {facing[~np.isin(facing, (1, -1))].ravel()[0]}")
+    return np.where(facing == 1, left, right), np.where(facing == 1, right, left)
+
+def compute_sensor_positions(angles, facings, lats, lons, use_facing=False, geometry=geodesy):
+    """Coordinates of the two sensors, arrays of (lat, lon) rows."""
+    angles = np.asarray(angles, dtype=float)
+    if use_facing:
+        s1_angles, s2_angles = compute_sensor_angles_with_facing(angles, facings)
     else:
-        raise ValueError(f"Facing must be 1 or -1, got: {facing}")
-
-def compute_sensor_positions(angles, facings, lats, lons, use_facing=False):
-    s1_coords, s2_coords = [], []
-    for i in range(len(angles)):
-        if use_facing:
-            s1_angle, s2_angle = compute_sensor_angles_with_facing(angles[i], facings[i])
-        else:
-            s1_angle, s2_angle = compute_sensor_angles(angles[i])
+        s1_angles, s2_angles = compute_sensor_angles(angles)
 
-        s1_pos = Geodesic.WGS84.Direct(lats[i], lons[i], s1_angle, DIST_CENTER_SENSOR)
-        s2_pos = Geodesic.WGS84.Direct(lats[i], lons[i], s2_angle, DIST_CENTER_SENSOR)
+    s1_lats, s1_lons, _ = geometry.direct(lats, lons, s1_angles, DIST_CENTER_SENSOR)
+    s2_lats, s2_lons, _ = geometry.direct(lats, lons, s2_angles, DIST_CENTER_SENSOR)
 
-        s1_coords.append([s1_pos["lat2"], s1_pos["lon2"]])
-        s2_coords.append([s2_pos["lat2"], s2_pos["lon2"]])
+    return np.column_stack([s1_lats, s1_lons]), np.column_stack([s2_lats, s2_lons])
 
-    return s1_coords, s2_coords
-
-def add_sensor_positions(data, data_final, angle_col_name, use_facing):
-    for track_id in range(data.num_tracks()):
+def add_sensor_positions(data, data_final, angle_col_name, use_facing, geometry=geodesy):
+    """Rows of both sensors of every track; positions are in the columns `geometry` works on (local_frame.position_columns)."""
+    lat_col, lon_col = position_columns(data.config, geometry)
+    columns = position_columns(data_final.config, geometry)
+    new_rows = []
+    for chunk in data.groups(data.config.track_id_col, range(data.num_tracks())):
         config = data.config
-        chunk = data.df[data.df[data.config.track_id_col] == track_id]
         if chunk.empty:
             continue
 
-        lats = chunk[data.config.lat_col].to_numpy()
-        lons = chunk[data.config.lon_col].to_numpy()
+        lats = chunk[lat_col].to_numpy()
+        lons = chunk[lon_col].to_numpy()
         angles = chunk[angle_col_name].to_numpy()
 
         facings = None
@@ -53,32 +55,40 @@ def add_sensor_positions(data, data_final, angle_col_name, use_facing):
         if use_facing and (len(facings) == 0 or facings[0] == 0):
             continue
 
-        s1_coords, s2_coords = compute_sensor_positions(angles, facings, lats, lons, use_facing)
-        if s1_coords and s2_coords:
-            append_sensor_coords_to_data(data_final, s1_coords, s2_coords, chunk, config)
+        s1_coords, s2_coords = compute_sensor_positions(angles, facings, lats, lons, use_facing, geometry)
+        if len(s1_coords) and len(s2_coords):
+            new_rows.append(sensor_rows(data_final, s1_coords, s2_coords, chunk, config, columns))
+
+    # appended at once, same as appending track after track
+    if new_rows:
+        data_final.df = pd.concat([data_final.df if not data_final.df.empty else None] + new_rows, ignore_index=True)
 
 def append_sensor_coords_to_data(d, sc1, sc2, chunk, config):
+    d.df = pd.concat([d.df if not d.df.empty else None,
+                      sensor_rows(d, sc1, sc2, chunk, config)], ignore_index=True)
+
+def sensor_rows(d, sc1, sc2, chunk, config, columns=None):
+    """Rows of both sensors for a track, with the columns of d; `columns` take the coordinates, latitude/longitude by default."""
+    lat_col, lon_col = columns or (d.config.lat_col, d.config.lon_col)
     rename_map = build_column_rename_map(config, d.config)
     renamed_chunk = chunk.rename(columns=rename_map)
 
     # Перший сенсор
     df1 = renamed_chunk.copy()
-    df1[d.config.lat_col] = [lat for lat, _ in sc1]
-    df1[d.config.lon_col] = [lon for _, lon in sc1]
+    df1[lat_col] = sc1[:, 0]
+    df1[lon_col] = sc1[:, 1]
     df1[d.config.sensor_id_col] = 1
 
     # Другий сенсор
     df2 = renamed_chunk.copy()
-    df2[d.config.lat_col] = [lat for lat, _ in sc2]
-    df2[d.config.lon_col] = [lon for _, lon in sc2]
+    df2[lat_col] = sc2[:, 0]
+    df2[lon_col] = sc2[:, 1]
     df2[d.config.sensor_id_col] = 2
 
     # Об'єднуємо
     rows_df = pd.concat([df1, df2], ignore_index=True)
     common_cols = d.df.columns.intersection(rows_df.columns)
-
-    d.df = pd.concat([d.df if not d.df.empty else None,
-                      rows_df[common_cols]], ignore_index=True)
+    return rows_df[common_cols]
 
 
 def translate_360_to_signed(angle):
@@ -87,17 +97,19 @@ def translate_360_to_signed(angle):
 def translate_signed_to_360(angle):
     return angle if angle >= 0 else angle + 360
 
-def add_sensor_positions_by_yaw(source_data, target_data):
+def add_sensor_positions_by_yaw(source_data, target_data, geometry=geodesy):
     add_sensor_positions(
     source_data, target_data,
     angle_col_name=source_data.config.yaw_col,
-    use_facing=False)
+    use_facing=False,
+    geometry=geometry)
 
-def add_sensor_positions_by_heading(source_data, target_data):
+def add_sensor_positions_by_heading(source_data, target_data, geometry=geodesy):
     add_sensor_positions(
         source_data, target_data,
         angle_col_name=source_data.config.heading_col,
-        use_facing=True)
+        use_facing=True,
+        geometry=geometry)
 
 # pd.set_option('display.max_columns', None)
 # pd.set_option('display.width', None)
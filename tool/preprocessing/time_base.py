@@ -0,0 +1,106 @@
+from datetime import date as Date, datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+# anchors are rounded to the sampling period of the GNSS receiver, see handle_date_time.round_to_step
+ANCHOR_STEP_MS = 200
+# knots of the piecewise-linear clock drift are this far apart on the device clock
+DRIFT_KNOT_INTERVAL_MS = 60_000
+# anchors whose clock offset is further than this from the median offset are taken as wrong fixes
+DRIFT_OUTLIER_MS = 1000
+# weight of the second differences of the knot offsets; it only decides knots without anchors around them
+DRIFT_SMOOTHING = 1e-6
+
+
+def parse_gps_times(values) -> np.ndarray:
+    """
+    Microseconds since midnight of GPS times written as hhmmss.ffffff numbers or strings, like
+    handle_date_time.get_time_by_str does for one value; missing values and ones that aren't a time
+    of the day give NaN.
+    """
+    v = pd.to_numeric(pd.Series(np.asarray(values)), errors='coerce').to_numpy(dtype=float)
+    whole = np.floor(v)
+    hours, rest = np.divmod(whole, 10000)
+    minutes, seconds = np.divmod(rest, 100)
+    # the fraction is read with the microseconds of its shortest decimal form
+    microseconds = np.round((v - whole) * 1e6)
+    valid = (v >= 0) & (hours < 24) & (minutes < 60) & (seconds < 60)
+    return np.where(valid, ((hours * 60 + minutes) * 60 + seconds) * 1e6 + microseconds, np.nan)
+
+
+def utc_timestamps(date: Date, time_of_day_us, step=ANCHOR_STEP_MS) -> np.ndarray:
+    """
+    UTC timestamps (ms) of times of the day on `date`, rounded to `step` ms like get_timestamp_utc;
+    float64, with NaN for missing times. step=None leaves them unrounded.
+    """
+    midnight = datetime(date.year, date.month, date.day, tzinfo=timezone.utc)
+    midnight_us = (midnight - datetime(1970, 1, 1, tzinfo=timezone.utc)) // timedelta(microseconds=1)
+    # in the order of datetime.timestamp() * 1000, so the rounding of the halves is the same
+    ms = np.trunc((midnight_us + np.asarray(time_of_day_us, dtype=float)) / 1e6 * 1000)
+    if step is None:
+        return ms
+    return np.round(ms / step) * step
+
+
+def anchor_timestamps(timestamps, anchor_row: int, anchor_utc):
+    """
+    Device timestamps moved onto UTC through a single anchor: the anchor row gets `anchor_utc` and the
+    others the cumulative deltas of the device clock from it, accumulated in the order a loop over the
+    rows would, so a missing timestamp also leaves the rows past it (seen from the anchor) missing.
+    """
+    t = np.asarray(timestamps)
+    deltas = np.diff(t)
+    dtype = np.result_type(t, np.asarray(anchor_utc))
+    result = np.empty(len(t), dtype=dtype)
+    result[anchor_row:] = np.cumsum(np.concatenate([np.array([anchor_utc], dtype=dtype), deltas[anchor_row:]]))
+    result[:anchor_row + 1] = np.cumsum(np.concatenate([np.array([anchor_utc], dtype=dtype),
+                                                        -deltas[:anchor_row][::-1]]))[::-1]
+    return result
+
+
+def fit_clock_drift(device_ms, utc_ms, knot_interval=DRIFT_KNOT_INTERVAL_MS):
+    """
+    Least-squares piecewise-linear fit of the offset of UTC from the device clock at GPS anchors, with
+    knots every `knot_interval` ms of the device clock. Returns the knots and their offsets (ms).
+    """
+    device_ms = np.asarray(device_ms, dtype=float)
+    offsets = np.asarray(utc_ms, dtype=float) - device_ms
+    valid = np.isfinite(offsets)
+    valid[valid] = np.abs(offsets[valid] - np.median(offsets[valid])) <= DRIFT_OUTLIER_MS
+    if not valid.any():
+        raise ValueError("No valid GPS anchors to fit the clock drift to")
+    device_ms, offsets = device_ms[valid], offsets[valid]
+
+    start, span = device_ms.min(), np.ptp(device_ms)
+    if span < knot_interval:
+        # the slope of anchors this close together is mostly their jitter
+        return np.array([start, start + knot_interval]), np.full(2, offsets.mean())
+    k = max(int(np.ceil(span / knot_interval)) + 1, 2)
+    knots = start + knot_interval * np.arange(k)
+    position = (device_ms - start) / knot_interval
+    j = np.minimum(np.floor(position).astype(int), k - 2)
+    w = position - j
+
+    # normal equations of the hat basis, plus the smoothing of the second differences
+    normal = np.zeros((k, k))
+    np.add.at(normal, (j, j), (1 - w)**2)
+    np.add.at(normal, (j + 1, j + 1), w**2)
+    np.add.at(normal, (j, j + 1), w * (1 - w))
+    np.add.at(normal, (j + 1, j), w * (1 - w))
+    rhs = np.bincount(j, (1 - w) * offsets, minlength=k) + np.bincount(j + 1, w * offsets, minlength=k)
+    second = np.diff(np.eye(k), n=2, axis=0)
+    normal += DRIFT_SMOOTHING * len(offsets) * second.T @ second
+    return knots, np.linalg.solve(normal, rhs)
+
+
+def drift_corrected_timestamps(timestamps, knots, knot_offsets) -> np.ndarray:
+    """Device timestamps plus the fitted offset, extrapolated linearly past the end knots; rounded to ms."""
+    t = np.asarray(timestamps, dtype=float)
+    offset = np.interp(t, knots, knot_offsets)
+    before, after = t < knots[0], t > knots[-1]
+    offset[before] = knot_offsets[0] + (t[before] - knots[0]) * (knot_offsets[1] - knot_offsets[0]) / (knots[1] - knots[0])
+    offset[after] = knot_offsets[-1] + (t[after] - knots[-1]) * (knot_offsets[-1] - knot_offsets[-2]) / (knots[-1] - knots[-2])
+    utc = np.round(t + offset)
+    return utc if np.isnan(utc).any() else utc.astype(np.int64)
+
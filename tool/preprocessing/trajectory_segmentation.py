@@ -1,10 +1,17 @@
+from dataclasses import dataclass
+from typing import List, Optional
+
 import numpy as np
-from geographiclib.geodesic import Geodesic
 
-def compute_geodesic_heading(lat1, lon1, lat2, lon2):
-    """Computes the geodesic azimuth (more accurate, WGS84 ellipsoid)."""
-    g = Geodesic.WGS84.Inverse(lat1, lon1, lat2, lon2)
-    return g['azi1'] % 360
+from . import geodesy
+
+# headings compared at once when searching for the end of a segment, doubled until it's found
+SEARCH_WINDOW = 64
+
+def compute_geodesic_heading(lat1, lon1, lat2, lon2, geometry=geodesy):
+    """Computes the geodesic azimuth (more accurate, WGS84 ellipsoid), for scalars or arrays."""
+    _, azi1, _ = geometry.inverse(lat1, lon1, lat2, lon2)
+    return azi1 % 360
 
 def planar_heading(x1, y1, x2, y2):
     """Computes azimuth in degrees using projected (planar) coordinates."""
@@ -15,19 +22,21 @@ def heading_diff(h1, h2):
     return min(abs(h1 - h2), 360 - abs(h1 - h2))
 
 
-def calculate_heading(df, start, end, lat_col='lat', lon_col='lon'):
+def calculate_heading(df, start, end, lat_col='lat', lon_col='lon', geometry=geodesy):
     if end - start < 1:
         raise ValueError("End index must be greater than start index by at least 1.")
     h_ref = compute_geodesic_heading(df.iloc[start][lat_col], df.iloc[start][lon_col],
-                            df.iloc[start+1][lat_col], df.iloc[start+1][lon_col])
+                            df.iloc[start+1][lat_col], df.iloc[start+1][lon_col], geometry)
     h_curr = compute_geodesic_heading(df.iloc[end][lat_col], df.iloc[end][lon_col],
-                             df.iloc[end+1][lat_col], df.iloc[end+1][lon_col])
+                             df.iloc[end+1][lat_col], df.iloc[end+1][lon_col], geometry)
     return h_ref, h_curr
 
-def segment_by_heading_incremental(df, lat_col, lon_col, max_angle_diff=50, min_segment_len=10):
+def segment_by_heading_incremental(df, lat_col, lon_col, max_angle_diff=50, min_segment_len=10, geometry=geodesy):
     """
     Performs trajectory segmentation using an incremental greedy approach.
     Extends the segment one point at a time until the heading constraint is violated.
+    `geometry` solves the headings and lengths, the geodesy module or the plane of a LocalFrame.
+    segment_by_heading gives the same result in linear time, this loop is kept as its reference.
     """
     n = len(df)
 
@@ -39,7 +48,7 @@ def segment_by_heading_incremental(df, lat_col, lon_col, max_angle_diff=50, min_
     while i < n-1:
         j = i + 1
         while j < n-1:
-            h_ref, h_curr = calculate_heading(df, i, j, lat_col, lon_col)
+            h_ref, h_curr = calculate_heading(df, i, j, lat_col, lon_col, geometry)
             if i == j - 1:
                 headings[i] = h_ref
             headings[j] = h_curr
@@ -51,15 +60,174 @@ def segment_by_heading_incremental(df, lat_col, lon_col, max_angle_diff=50, min_
             j += 1
         if check_len_segment(df[lat_col].iloc[i], df[lon_col].iloc[i],
                              df[lat_col].iloc[j], df[lon_col].iloc[j],
-                             min_segment_len):
+                             min_segment_len, geometry):
             track_ids[i:j] = track
             track += 1
         i = j
     return track_ids, headings
 
-def check_len_segment(lat1, lon1, lat2, lon2, min_len):
-    geo = Geodesic.WGS84.Inverse(lat1, lon1, lat2, lon2)
-    dist = geo['s12'] # in meters
+def segment_by_heading(lats, lons, max_angle_diff=50, min_segment_len=10, geometry=geodesy):
+    """
+    Same segmentation as segment_by_heading_incremental, over arrays of positions and in linear time.
+    The headings between consecutive points are computed once, the end of every segment is
+    searched in growing windows of them and the lengths of all segments are checked at once.
+    """
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    n = len(lats)
+
+    track_ids = np.full(n, np.nan)
+    headings = np.full(n, np.nan)
+    if n < 2:
+        return track_ids, headings
+
+    point_headings = compute_geodesic_heading(lats[:-1], lons[:-1], lats[1:], lons[1:], geometry)
+    # the incremental loop sets the headings of the points it compares, that's all but the last one
+    if n > 2:
+        headings[:-1] = point_headings
+
+    starts = []
+    i = 0
+    while i < n - 1:
+        starts.append(i)
+        i = _segment_end(point_headings, i, max_angle_diff)
+    starts = np.array(starts)
+    ends = np.append(starts[1:], n - 1)
+
+    long_enough = geometry.distance(lats[starts], lons[starts], lats[ends], lons[ends]) >= min_segment_len
+    segment_tracks = np.where(long_enough, np.cumsum(long_enough) - 1, np.nan)
+    track_ids[:-1] = np.repeat(segment_tracks, ends - starts)
+    return track_ids, headings
+
+def _segment_end(point_headings, start, max_angle_diff):
+    """First point after `start` whose heading differs from the start's by more than max_angle_diff, the last point if none."""
+    return _first_turn(point_headings, start + 1, point_headings[start], max_angle_diff)
+
+def _first_turn(point_headings, lo, h_ref, max_angle_diff):
+    """Index of the first heading from `lo` on that differs from h_ref by more than max_angle_diff, their count if none."""
+    last = len(point_headings)
+    window = SEARCH_WINDOW
+    while lo < last:
+        hi = min(lo + window, last)
+        d = np.abs(point_headings[lo:hi] - h_ref)
+        exceeded = np.flatnonzero(np.minimum(d, 360 - d) > max_angle_diff)
+        if len(exceeded):
+            return lo + exceeded[0]
+        lo = hi
+        window *= 2
+    return last
+
+
+@dataclass
+class Segment:
+    """Points start..end - 1 of a flight; track_id is None if it's shorter than the minimum length."""
+    track_id: Optional[int]
+    start: int
+    end: int
+    headings: np.ndarray
+
+
+class OnlineSegmenter:
+    """
+    segment_by_heading for positions that are still arriving. push/push_batch return the segments
+    that a new heading closed, finish the last one. Only the open segment is kept, every position
+    costs O(1) amortised, and the segments give the same track ids and headings as the batch
+    function (see segments_to_arrays). The headings are solved per call, so batches of positions
+    are much cheaper per position than single pushes.
+    """
+
+    def __init__(self, max_angle_diff=50, min_segment_len=10, geometry=geodesy):
+        self.max_angle_diff = max_angle_diff
+        self.min_segment_len = min_segment_len
+        self.geometry = geometry
+        self.count = 0
+        self._last = None  # last position
+        self._start = 0
+        self._start_position = None
+        self._h_ref = np.nan
+        self._headings = []  # headings of the open segment, chunks of arrays
+        self._next_track = 0
+
+    def push(self, lat, lon) -> List[Segment]:
+        return self.push_batch([lat], [lon])
+
+    def push_batch(self, lats, lons) -> List[Segment]:
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        if not len(lats):
+            return []
+        first = self.count
+        if first == 0:
+            self._start_position = (lats[0], lons[0])
+        else:
+            # the heading from the last position of the previous batch comes first
+            lats = np.insert(lats, 0, self._last[0])
+            lons = np.insert(lons, 0, self._last[1])
+            first -= 1
+        self.count = first + len(lats)
+        self._last = (lats[-1], lons[-1])
+
+        # point_headings[k] is the heading of the point first + k
+        point_headings = compute_geodesic_heading(lats[:-1], lons[:-1], lats[1:], lons[1:], self.geometry)
+        closed = []
+        k = 0
+        if len(point_headings) and first == self._start:
+            self._h_ref = point_headings[0]
+            self._headings.append(point_headings[:1])
+            k = 1
+        while k < len(point_headings):
+            turn = _first_turn(point_headings, k, self._h_ref, self.max_angle_diff)
+            self._headings.append(point_headings[k:turn])
+            if turn == len(point_headings):
+                break
+            closed.append((self._start, first + turn, self._start_position, (lats[turn], lons[turn]),
+                           np.concatenate(self._headings)))
+            self._start, self._start_position = first + turn, (lats[turn], lons[turn])
+            self._h_ref = point_headings[turn]
+            self._headings = [point_headings[turn:turn + 1]]
+            k = turn + 1
+        return self._make_segments(closed)
+
+    def finish(self) -> List[Segment]:
+        """Closes the open segment at the last position."""
+        if self.count < 2:
+            return []
+        headings = np.concatenate(self._headings)
+        if self.count == 2:
+            # the batch function sets no headings for two points
+            headings = np.full(1, np.nan)
+        segments = self._make_segments([(self._start, self.count - 1, self._start_position, self._last, headings)])
+        self._start, self._headings = self.count - 1, []
+        return segments
+
+    def _make_segments(self, closed) -> List[Segment]:
+        if not closed:
+            return []
+        start_lats, start_lons = np.array([c[2] for c in closed]).T
+        end_lats, end_lons = np.array([c[3] for c in closed]).T
+        lengths = self.geometry.distance(start_lats, start_lons, end_lats, end_lons)
+        segments = []
+        for (start, end, _, _, headings), length in zip(closed, lengths):
+            track_id = None
+            if length >= self.min_segment_len:
+                track_id = self._next_track
+                self._next_track += 1
+            segments.append(Segment(track_id, start, end, headings))
+        return segments
+
+
+def segments_to_arrays(segments, n):
+    """Track ids and headings of n points from their segments, as segment_by_heading returns them."""
+    track_ids = np.full(n, np.nan)
+    headings = np.full(n, np.nan)
+    for segment in segments:
+        if segment.track_id is not None:
+            track_ids[segment.start:segment.end] = segment.track_id
+        headings[segment.start:segment.end] = segment.headings
+    return track_ids, headings
+
+def check_len_segment(lat1, lon1, lat2, lon2, min_len, geometry=geodesy):
+    dist = geometry.distance(lat1, lon1, lat2, lon2) # in meters
     if dist >= min_len:
         return True
     return False
@@ -0,0 +1,82 @@
+from typing import Dict, Iterable
+
+import numpy as np
+import pandas as pd
+
+
+def rolling_median(values, window: int) -> np.ndarray:
+    """
+    Median of the 2 * (window // 2) + 1 samples centred on every sample, skipping NaN like
+    Series.median; windows are cut at the ends. pandas keeps the window in an indexable skiplist,
+    so it costs O(N log w), and an odd number of values gives exactly the middle one.
+    """
+    half = window // 2
+    return pd.Series(np.asarray(values, dtype=float)).rolling(2 * half + 1, center=True, min_periods=1).median().to_numpy()
+
+
+def median_trend(values, window: int) -> np.ndarray:
+    """
+    Trend of calculate_residual: the running median where the whole window fits, the mean of the first
+    `window` samples before that and the median of the last `window` samples after it.
+    """
+    return median_trends(values, [window])[window]
+
+
+def median_trends(values, windows: Iterable[int]) -> Dict[int, np.ndarray]:
+    """median_trend for several windows, sharing the conversion of the samples."""
+    series = pd.Series(np.asarray(values, dtype=float))
+    n = len(series)
+    trends = {}
+    for window in windows:
+        half = window // 2
+        if half > n:
+            raise ValueError(f"Window of {window} samples is too long for {n} samples")
+        trend = np.empty(n)
+        trend[:half] = series.iloc[0:window].mean()
+        middle = rolling_median(series, window)[half:n - half]
+        trend[half:half + len(middle)] = middle
+        trend[half + len(middle):] = series.iloc[-window:].median()
+        trends[window] = trend
+    return trends
+
+
+FILTER_KINDS = ('butterworth', 'gaussian')
+BUTTERWORTH_ORDER = 4
+# cutoff periods the ends are extended by against edge effects, as filtfilt pads them
+PAD_PERIODS = 3
+
+
+def lowpass(values, cutoff_hz: float, sample_rate_hz: float, kind='butterworth', order=BUTTERWORTH_ORDER) -> np.ndarray:
+    """
+    Zero-phase low-pass of evenly sampled values, filtered in the frequency domain in O(N log N).
+    'butterworth' has the gain of a Butterworth filter of `order` run forwards and backwards,
+    1 / (1 + (f / fc)^(2 order)), 'gaussian' has exp(-ln 2 (f / fc)^2); both pass half at the cutoff.
+    The ends are extended by odd reflection like filtfilt does; NaN are bridged linearly.
+    The line through the ends is taken out before the FFT and added back, the zero padding up to
+    the FFT size then joins the ends without a jump that would wrap around into the data.
+    """
+    if kind not in FILTER_KINDS:
+        raise ValueError(f"Unknown filter {kind!r}, expected one of {FILTER_KINDS}")
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    valid = ~np.isnan(values)
+    if not valid.any():
+        return np.full(n, np.nan)
+    x = values
+    if not valid.all():
+        positions = np.arange(n)
+        x = np.interp(positions, positions[valid], values[valid])
+
+    pad = min(n - 1, int(np.ceil(PAD_PERIODS * sample_rate_hz / cutoff_hz)))
+    if pad > 0:
+        x = np.concatenate([2 * x[0] - x[pad:0:-1], x, 2 * x[-1] - x[-2:-pad - 2:-1]])
+    line = np.linspace(x[0], x[-1], len(x))
+    x = x - line
+    size = 1 << (len(x) - 1).bit_length()
+
+    ratio = np.fft.rfftfreq(size, d=1 / sample_rate_hz) / cutoff_hz
+    if kind == 'butterworth':
+        gain = 1 / (1 + ratio ** (2 * order))
+    else:
+        gain = np.exp(-np.log(2) * ratio ** 2)
+    return (np.fft.irfft(np.fft.rfft(x, size) * gain, size)[:len(x)] + line)[pad:pad + n]
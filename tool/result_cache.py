@@ -0,0 +1,136 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from functools import lru_cache
+from pathlib import Path
+
+from preprocessing.checkpoint import file_digest
+
+CACHE_VERSION = 1
+DEFAULT_MAX_SIZE_MB = 10 * 1024
+META_FILE = "meta.json"
+
+# the results depend on the code that made them, so it's part of the key
+CODE_DIRS = [Path(__file__).parent / "preprocessing", Path(__file__).parent / "mddConverter"]
+
+
+@lru_cache(maxsize=None)
+def code_digest() -> str:
+    h = hashlib.sha256()
+    for code_dir in CODE_DIRS:
+        for path in sorted(code_dir.glob("*.py")):
+            h.update(path.name.encode())
+            h.update(path.read_bytes())
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Content-addressed store of preprocessing outputs.
+    Every entry is a directory named after its key with copies of the output files.
+    The modification time of its meta file marks the last use, the least recently
+    used entries are evicted once the cache is larger than `max_size_mb`.
+    Entries are written to a temporary directory and renamed, so several processes can share a cache.
+    """
+
+    def __init__(self, cache_dir, max_size_mb=DEFAULT_MAX_SIZE_MB):
+        self.cache_dir = Path(cache_dir)
+        self.max_size = int(max_size_mb * 1024 * 1024)
+
+    def make_key(self, input_filepath, systeminfo_filepath=None, gnss_filepath=None, **settings) -> str:
+        """Key of the inputs' content and the settings that affect the outputs."""
+        description = {
+            'version': CACHE_VERSION,
+            'code': code_digest(),
+            'input': file_digest(input_filepath),
+            'systeminfo': file_digest(systeminfo_filepath) if systeminfo_filepath else None,
+            'gnss': file_digest(gnss_filepath) if gnss_filepath else None,
+            'settings': settings,
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+    def restore(self, key: str, outputs: dict) -> bool:
+        """
+        Puts the cached files of the entry at the paths in `outputs` (role -> path).
+        Files that are still the ones the entry was made from are left alone.
+        Returns False if there is no complete entry.
+        """
+        entry = self.cache_dir / key
+        try:
+            meta = json.loads((entry / META_FILE).read_text())
+            files = meta['files']
+            if not set(outputs) <= set(files):
+                return False
+            for role, path in outputs.items():
+                if _stat_of(path) != files[role]['stat']:
+                    _copy_atomic(entry / role, path)
+            (entry / META_FILE).touch()
+        except (OSError, ValueError, KeyError) as e:
+            logging.getLogger(__name__).debug(f"Cache entry {key} not usable: {e}")
+            return False
+        return True
+
+    def store(self, key: str, outputs: dict):
+        logger = logging.getLogger(__name__)
+        tmp = self.cache_dir / f"tmp-{uuid.uuid4().hex}"
+        try:
+            tmp.mkdir(parents=True)
+            files = {}
+            for role, path in outputs.items():
+                shutil.copy2(path, tmp / role)
+                files[role] = {'size': os.path.getsize(path), 'stat': _stat_of(path)}
+            (tmp / META_FILE).write_text(json.dumps({'created': time.time(), 'files': files}))
+            os.rename(tmp, self.cache_dir / key)
+        except OSError as e:
+            # e.g. another process stored the same entry first
+            logger.debug(f"Result not cached: {e}")
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self.evict()
+
+    def entries(self):
+        """(last use, size, path) of every entry."""
+        entries = []
+        for entry in self.cache_dir.iterdir():
+            try:
+                meta_path = entry / META_FILE
+                files = json.loads(meta_path.read_text())['files']
+                entries.append((meta_path.stat().st_mtime, sum(f['size'] for f in files.values()), entry))
+            except (OSError, ValueError, KeyError):
+                continue
+        return entries
+
+    def evict(self):
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        # the most recent entry is kept, even if it's larger than the limit on its own
+        for _, size, entry in entries[:-1]:
+            if total <= self.max_size:
+                break
+            logging.getLogger(__name__).info(f"Evicting cached result {entry.name}")
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+
+def _stat_of(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _copy_atomic(src: Path, dst):
+    dst = Path(dst)
+    tmp = dst.with_name(f".{dst.name}.{uuid.uuid4().hex}")
+    try:
+        # keeps the modification time, so the restored file is recognised as unchanged later
+        shutil.copy2(src, tmp)
+        os.replace(tmp, dst)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
@@ -2,11 +2,64 @@ import argparse
 import glob
 import logging
 import os
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
 
 import yaml
 
-from preprocessing.main import preprocess
-from mddConverter.main import convert_mdd_to_csv
+from preprocessing.Data import DataOwn
+from preprocessing.checkpoint import CheckpointStore, DEFAULT_CHECKPOINT_STEPS
+from preprocessing.reference_grid import GridReference
+from preprocessing.magnetic_field import RESIDUAL_METHODS
+from preprocessing.main import preprocess, preprocess_data, get_result_filepath
+from mddConverter.main import decode_mdd
+from mddConverter.export import output_path
+from result_cache import DEFAULT_MAX_SIZE_MB, ResultCache
+
+logger = logging.getLogger(__name__)
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+WORKER_LOG_FORMAT = '%(asctime)s - %(processName)s - %(levelname)s - %(message)s'
+
+
+def preprocess_mdd(
+    mdd_filepath,
+    systeminfo_filepath=None,
+    datetime=None,
+    gnss=None,
+    save_intermediate=False,
+    mdd_format="csv",
+    result_filepath=None,
+    checkpoints=None,
+    resume_from=None,
+    reference=None,
+    use_local_frame=False,
+    residual_method="median",
+    clock_drift_fit=False
+):
+    """
+    Decodes an MDD file and runs the whole preprocessing in memory.
+    The _RF/_OF products are written only if save_intermediate is set,
+    the result only if result_filepath is given. Returns the DataFinal.
+    """
+    table = decode_mdd(mdd_filepath, save_RF=save_intermediate, save_OF=save_intermediate, output_format=mdd_format)
+    if table is None:
+        return None
+
+    # the RF path is kept as the data's origin: the date and time are read from its name
+    rf_filepath = output_path(Path(mdd_filepath), "_RF", mdd_format)
+    data = DataOwn(table.to_dataframe(), filepath=str(rf_filepath))
+    data_final = preprocess_data(data, systeminfo_filepath, datetime, gnss, checkpoints, resume_from, reference,
+                                 use_local_frame, residual_method, clock_drift_fit)
+
+    if result_filepath is not None:
+        logger.info(f"Step 12: Saving the results to {result_filepath}")
+        data_final.save(new_filepath=result_filepath, new_delimiter=';')
+
+    return data_final
 
 
 def process_single_file(
@@ -16,24 +69,194 @@ def process_single_file(
     delimiter=",",
     systeminfo_filepath=None,
     datetime=None,
-    gnss=None
+    gnss=None,
+    mdd_format="csv",
+    save_intermediate=True,
+    cache=None,
+    checkpoint_dir=None,
+    checkpoint_steps=DEFAULT_CHECKPOINT_STEPS,
+    resume_from=None,
+    reference_grid_dir=None,
+    use_local_frame=False,
+    residual_method="median",
+    clock_drift_fit=False
 ):
+    """
+    With a ResultCache, the outputs of inputs that were processed before with the same settings are reused.
+    With a checkpoint_dir, the preprocessing state is saved after checkpoint_steps in a subdirectory
+    named after the input, and resume_from continues from the latest valid one before that step.
+    With a reference_grid_dir, the WMM declination of the yaws is interpolated from the survey-area grids kept there.
+    With use_local_frame, the geometry is solved in an East-North-Up frame of the flight.
+    residual_method is the trend removal of the residual field: median, butterworth or gaussian.
+    With clock_drift_fit, the UTC time base follows the drift of the device clock between all GPS times.
+    """
+    input_filepath = mdd_filepath or src_filepath
+    checkpoints = None
+    if checkpoint_dir and input_filepath:
+        checkpoints = CheckpointStore(Path(checkpoint_dir) / Path(input_filepath).name, checkpoint_steps)
+    reference = GridReference(reference_grid_dir) if reference_grid_dir else None
+
     if mdd_filepath:
-        logger.info("Decoding MDD to CSV started")
+        logger.info("Decoding and preprocessing MDD in memory started")
         if src_filepath:
             logger.warning("MDD path provided. Ignoring SRC path.")
-        src_filepath = convert_mdd_to_csv(mdd_filepath, save_OF=True)
-        logger.info(f"Decoding MDD to CSV finished. CSV saved to {src_filepath}\n")
+        rf_filepath = output_path(Path(mdd_filepath), "_RF", mdd_format)
+        result_filepath = get_result_filepath(rf_filepath, result_filepath, gnss)
+        outputs = {"result": result_filepath}
+        if save_intermediate:
+            outputs["RF"] = rf_filepath
+            outputs["OF"] = output_path(Path(mdd_filepath), "_OF", mdd_format)
+
+        # the date and time are taken from the file name if not given
+        key = cache_key(cache, mdd_filepath, systeminfo_filepath, gnss, name=Path(mdd_filepath).name,
+                        datetime=datetime, mdd_format=mdd_format, save_intermediate=save_intermediate,
+                        reference=repr(reference), local_frame=use_local_frame,
+                        residual_method=residual_method, clock_drift_fit=clock_drift_fit)
+        if key is not None and cache.restore(key, outputs):
+            logger.info(f"{mdd_filepath} is unchanged, reused the cached results")
+            return
+
+        preprocess_mdd(mdd_filepath, systeminfo_filepath, datetime, gnss, save_intermediate, mdd_format, result_filepath,
+                       checkpoints, resume_from, reference, use_local_frame, residual_method,
+                       clock_drift_fit)
+        if key is not None:
+            cache.store(key, outputs)
+        logger.info("Preprocessing finished")
+        return
 
     if not src_filepath:
         logger.error("No source CSV file specified. Cannot proceed.")
         return
 
+    outputs = {"result": get_result_filepath(src_filepath, result_filepath, gnss)}
+    key = cache_key(cache, src_filepath, systeminfo_filepath, gnss, name=Path(src_filepath).name,
+                    datetime=datetime, delimiter=delimiter, reference=repr(reference),
+                    local_frame=use_local_frame, residual_method=residual_method, clock_drift_fit=clock_drift_fit)
+    if key is not None and cache.restore(key, outputs):
+        logger.info(f"{src_filepath} is unchanged, reused the cached result")
+        return
+
     logger.info("Preprocessing started")
-    preprocess(src_filepath, delimiter, systeminfo_filepath, result_filepath, datetime, gnss)
+    preprocess(src_filepath, delimiter, systeminfo_filepath, result_filepath, datetime, gnss, checkpoints, resume_from,
+               reference, use_local_frame, residual_method, clock_drift_fit)
+    if key is not None:
+        cache.store(key, outputs)
     logger.info("Preprocessing finished")
 
 
+def cache_key(cache, input_filepath, systeminfo_filepath, gnss, **settings):
+    if cache is None:
+        return None
+    return cache.make_key(input_filepath, systeminfo_filepath, gnss, **settings)
+
+
+def init_worker_logging(level=logging.INFO):
+    """Logging of a pool worker, its records are tagged with the process name."""
+    logging.basicConfig(level=level, format=WORKER_LOG_FORMAT, force=True)
+
+
+def process_file_task(mdd_filepath, kwargs):
+    """
+    Runs process_single_file for one MDD file and never raises, so a failure doesn't affect
+    the other files. Returns (mdd_filepath, error or None, seconds).
+    """
+    start = time.perf_counter()
+    logger.info(f"Processing file: {mdd_filepath}")
+    try:
+        process_single_file(mdd_filepath=mdd_filepath, **kwargs)
+        error = None
+    except Exception as e:
+        logger.error(f"Processing {mdd_filepath} failed:\n{traceback.format_exc()}")
+        error = f"{type(e).__name__}: {e}"
+    return mdd_filepath, error, time.perf_counter() - start
+
+
+def process_files_isolated(mdd_files, kwargs, log_level=logging.INFO, jobs=1):
+    """
+    process_file_task for every file in a process of its own, `jobs` at a time, so if a process dies
+    (e.g. killed for running out of memory) it's only its file that failed, with the time until the
+    process died. Yields the results as the files finish.
+    All the processes are forked from the calling thread: forked from several threads at once,
+    a child can inherit a lock another thread held and hang.
+    """
+    queue = list(mdd_files)
+    running = {}
+    try:
+        while queue or running:
+            while queue and len(running) < jobs:
+                mdd_filepath = queue.pop(0)
+                executor = ProcessPoolExecutor(max_workers=1, initializer=init_worker_logging, initargs=(log_level,))
+                running[executor.submit(process_file_task, mdd_filepath, kwargs)] = (mdd_filepath, executor, time.perf_counter())
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                mdd_filepath, executor, start = running.pop(future)
+                executor.shutdown()
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:
+                    logger.error(f"The worker process of {mdd_filepath} died")
+                    result = mdd_filepath, f"{type(e).__name__}: {e}", time.perf_counter() - start
+                yield result
+    finally:
+        for _, executor, _ in running.values():
+            executor.shutdown(cancel_futures=True)
+
+
+def process_files(mdd_files, jobs=1, **kwargs):
+    """
+    Processes the MDD files, with `jobs` > 1 in a pool of that many processes.
+    `kwargs` are passed to process_single_file. Returns a list of (mdd_filepath, error, seconds);
+    seconds is None if the time of the file isn't known.
+    If a worker process dies, the pool breaks and none of its unfinished files can be told apart
+    from the one that was running there, so they are all processed again, each in a process of its own.
+    """
+    if jobs <= 1 or len(mdd_files) <= 1:
+        return [process_file_task(mdd_filepath, kwargs) for mdd_filepath in mdd_files]
+
+    log_level = logging.getLogger().getEffectiveLevel()
+    results = []
+    unfinished = []
+
+    def done(result):
+        results.append(result)
+        mdd_filepath, error, seconds = result
+        took = "" if seconds is None else f" in {seconds:.1f} s"
+        logger.info(f"[{len(results)}/{len(mdd_files)}] {mdd_filepath} {'failed' if error else 'done'}{took}")
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(mdd_files)), initializer=init_worker_logging,
+                             initargs=(log_level,)) as executor:
+        futures = {executor.submit(process_file_task, mdd_filepath, kwargs): mdd_filepath for mdd_filepath in mdd_files}
+        for future in as_completed(futures):
+            try:
+                done(future.result())
+            except BrokenProcessPool:
+                unfinished.append(futures[future])
+            except Exception as e:
+                done((futures[future], f"{type(e).__name__}: {e}", None))
+
+    if unfinished:
+        logger.warning(f"A worker process died, processing the {len(unfinished)} unfinished files again, one per process")
+        for result in process_files_isolated(unfinished, kwargs, log_level, jobs):
+            done(result)
+
+    order = {mdd_filepath: i for i, mdd_filepath in enumerate(mdd_files)}
+    return sorted(results, key=lambda r: order[r[0]])
+
+
+def print_summary(results, wall_time):
+    width = max([len(str(r[0])) for r in results] + [4])
+    print(f"{'File':<{width}}  {'Status':<6}  {'Time, s':>8}")
+    for mdd_filepath, error, seconds in results:
+        took = "" if seconds is None else f"{seconds:.1f}"
+        print(f"{str(mdd_filepath):<{width}}  {'FAILED' if error else 'OK':<6}  {took:>8}" + (f"  {error}" if error else ""))
+
+    failed = sum(error is not None for _, error, _ in results)
+    cpu_time = sum(seconds for _, _, seconds in results if seconds is not None)
+    print(f"{len(results) - failed} of {len(results)} files processed, {failed} failed, "
+          f"{wall_time:.1f} s wall time, {cpu_time:.1f} s summed over the files")
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Run preprocessing"
@@ -46,8 +269,23 @@ def main():
     parser.add_argument("-o", "--output", type=str, help="Path to save the result CSV")
     parser.add_argument("--systeminfo_filepath", type=str, help="Path to the systeminfo TXT file (magnetometer configuration file)")
     parser.add_argument("-t", "--datetime", type=str, help="Date string in format YYYYMMDD_HHMMSS.S")
-    parser.add_argument("--gnss", type=str, help="Use external GNSS")
+    parser.add_argument("--gnss", type=str, nargs="+", help="Use external GNSS logs, e.g. base and rover")
     parser.add_argument("--mdd_dir", type=str, help="Path to directory with MDD files")
+    parser.add_argument("--no_intermediate", action="store_true", help="Don't save the decoded MDD products (_RF, _OF)")
+    parser.add_argument("--mdd_format", type=str, choices=["csv", "parquet", "arrow", "npz"], help="Format of the decoded MDD products (_RF, _OF)")
+    parser.add_argument("-j", "--jobs", type=int, help="Number of files from --mdd_dir processed in parallel")
+    parser.add_argument("--cache_dir", type=str, help="Directory of the result cache, outputs of unchanged inputs are reused")
+    parser.add_argument("--no_cache", action="store_true", help="Don't use the result cache")
+    parser.add_argument("--checkpoint_dir", type=str, help="Directory for the checkpoints saved after the preprocessing steps")
+    parser.add_argument("--resume-from", dest="resume_from", type=float, metavar="STEP",
+                        help="Continue from the latest valid checkpoint before this step")
+    parser.add_argument("--reference_grid_dir", type=str, help="Directory of the cached WMM reference grids")
+    parser.add_argument("--local_frame", action="store_true",
+                        help="Solve headings, offsets and interpolation in a local East-North-Up frame of the flight")
+    parser.add_argument("--residual_method", type=str, choices=list(RESIDUAL_METHODS),
+                        help="Trend removal of the residual field: running median or zero-phase low-pass per line")
+    parser.add_argument("--clock_drift_fit", action="store_true",
+                        help="Fit the drift of the device clock to all GPS times instead of anchoring it at the first one")
 
     args = parser.parse_args()
 
@@ -58,24 +296,50 @@ def main():
     systeminfo_filepath = args.systeminfo_filepath or config["systeminfo_filepath"]
     datetime = args.datetime or config["datetime"]
     gnss = args.gnss or config["gnss"]
+    if isinstance(gnss, list) and len(gnss) == 1:
+        gnss = gnss[0]
+    mdd_format = args.mdd_format or config["mdd_format"]
+    save_intermediate = not args.no_intermediate
+    jobs = args.jobs or config.get("jobs", 1)
+    cache_dir = None if args.no_cache else args.cache_dir or config.get("cache_dir")
+    cache = ResultCache(cache_dir, config.get("cache_size_mb", DEFAULT_MAX_SIZE_MB)) if cache_dir else None
+    checkpoint_dir = args.checkpoint_dir or config.get("checkpoint_dir")
+    checkpoint_steps = config.get("checkpoint_steps", DEFAULT_CHECKPOINT_STEPS)
+    reference_grid_dir = args.reference_grid_dir or config.get("reference_grid_dir")
+    use_local_frame = args.local_frame or config.get("local_frame", False)
+    residual_method = args.residual_method or config.get("residual_method", "median")
+    clock_drift_fit = args.clock_drift_fit or config.get("clock_drift_fit", False)
+    if args.resume_from is not None and not checkpoint_dir:
+        parser.error("--resume-from needs --checkpoint_dir or checkpoint_dir in the config")
 
     if args.mdd_dir:
         full_path = os.path.abspath(args.mdd_dir)
         print(full_path)
-        mdd_files = glob.glob(os.path.join(args.mdd_dir, "*.mdd"))
+        mdd_files = sorted(glob.glob(os.path.join(args.mdd_dir, "*.mdd")))
         logger.info(f"Found {len(mdd_files)} MDD files in directory '{args.mdd_dir}'")
 
-        for mdd_filepath in mdd_files:
-            logger.info(f"Processing file: {mdd_filepath}")
-
-            process_single_file(
-                mdd_filepath=mdd_filepath,
-                result_filepath=None,
-                delimiter=delim,
-                systeminfo_filepath=systeminfo_filepath,
-                datetime=datetime,
-                gnss=gnss
-            )
+        start = time.perf_counter()
+        results = process_files(
+            mdd_files,
+            jobs=jobs,
+            result_filepath=None,
+            delimiter=delim,
+            systeminfo_filepath=systeminfo_filepath,
+            datetime=datetime,
+            gnss=gnss,
+            mdd_format=mdd_format,
+            save_intermediate=save_intermediate,
+            cache=cache,
+            checkpoint_dir=checkpoint_dir,
+            checkpoint_steps=checkpoint_steps,
+            resume_from=args.resume_from,
+            reference_grid_dir=reference_grid_dir,
+            use_local_frame=use_local_frame,
+            residual_method=residual_method,
+            clock_drift_fit=clock_drift_fit
+        )
+        if results:
+            print_summary(results, time.perf_counter() - start)
 
     else:
         mdd_filepath = args.mdd or config["mdd"]
@@ -89,15 +353,23 @@ def main():
             delimiter=delim,
             systeminfo_filepath=systeminfo_filepath,
             datetime=datetime,
-            gnss=gnss
+            gnss=gnss,
+            mdd_format=mdd_format,
+            save_intermediate=save_intermediate,
+            cache=cache,
+            checkpoint_dir=checkpoint_dir,
+            checkpoint_steps=checkpoint_steps,
+            resume_from=args.resume_from,
+            reference_grid_dir=reference_grid_dir,
+            use_local_frame=use_local_frame,
+            residual_method=residual_method,
+            clock_drift_fit=clock_drift_fit
         )
 
 
 if __name__ == "__main__":
     logging.basicConfig(
         level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s'
+        format=LOG_FORMAT
     )
-    logger = logging.getLogger(__name__)
-
     main()
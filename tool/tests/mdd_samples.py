@@ -0,0 +1,76 @@
+"""Synthetic MDD files for the converter tests."""
+import numpy as np
+
+from mddConverter.decoder import RECORD_DTYPE
+from mddConverter.magRow import MagRowType
+
+MARKER = 0xAA
+FIRST_TIMESTAMP = 100_000
+TICK_MS = 5
+GPS_EVERY_TICKS = 40
+
+
+def sample_records(n_ticks: int, seed: int = 0) -> np.ndarray:
+    """
+    Records of a flight logged every TICK_MS: an ACC record close in time and the MAG records of both
+    channels at every tick, a GPS fix every GPS_EVERY_TICKS ticks.
+    """
+    rng = np.random.default_rng(seed)
+    ticks = np.arange(n_ticks)
+    ts = FIRST_TIMESTAMP + TICK_MS * ticks
+    gps_ticks = ticks[::GPS_EVERY_TICKS]
+
+    parts = [
+        # tick, slot in the tick, type, channel, timestamp, values, trailer
+        (ticks, 0, MagRowType.ACC, 0, ts + rng.integers(-2, 3, n_ticks), rng.uniform(-1, 1, (n_ticks, 3)), 21.5),
+        (ticks, 1, MagRowType.MAG, 1, ts, rng.uniform(-5e4, 5e4, (n_ticks, 3)), 21.3),
+        (ticks, 2, MagRowType.MAG, 2, ts, rng.uniform(-5e4, 5e4, (n_ticks, 3)), 21.4),
+        (gps_ticks, 3, MagRowType.GPS, 0, ts[gps_ticks] + rng.integers(-1, 2, len(gps_ticks)),
+         np.column_stack([50 + rng.uniform(0, 1e-3, len(gps_ticks)), 30 + rng.uniform(0, 1e-3, len(gps_ticks)),
+                          rng.uniform(100, 200, len(gps_ticks))]),
+         121959.2 + gps_ticks * TICK_MS / 1000),
+    ]
+
+    tick = np.concatenate([p[0] for p in parts])
+    slot = np.concatenate([np.full(len(p[0]), p[1]) for p in parts])
+    order = np.lexsort((slot, tick))
+
+    records = np.zeros(len(tick), dtype=RECORD_DTYPE)
+    records['first'] = MARKER
+    records['data_type'] = np.concatenate([np.full(len(p[0]), int(p[2])) for p in parts])[order]
+    records['channel'] = np.concatenate([np.full(len(p[0]), p[3]) for p in parts])[order]
+    records['timestamp'] = np.concatenate([p[4] for p in parts])[order]
+    values = np.concatenate([p[5] for p in parts])[order]
+    for i, name in enumerate(('value1', 'value2', 'value3')):
+        records[name] = values[:, i]
+    records['trailer'] = np.concatenate([np.broadcast_to(p[6], len(p[0])) for p in parts])[order]
+    return records
+
+
+def write_mdd(path, records: np.ndarray):
+    path.write_bytes(records.tobytes())
+    return path
+
+
+def survey_records(n_ticks: int, line_m: float = 60.0, spacing_m: float = 2.0, speed_m_s: float = 5.0,
+                   seed: int = 0) -> np.ndarray:
+    """
+    sample_records of a survey flown north and south along lines `spacing_m` apart, with the
+    magnetometer of channel 1 facing the way it flies, so the preprocessing finds tracks in it.
+    """
+    records = sample_records(n_ticks, seed)
+    t = (records['timestamp'].astype(float) - FIRST_TIMESTAMP) / 1000
+    line = np.floor(t * speed_m_s / line_m)
+    along = t * speed_m_s - line * line_m
+    along = np.where(line % 2 == 0, along, line_m - along)
+    heading = np.where(line % 2 == 0, 0.0, 180.0)
+
+    gps = records['data_type'] == MagRowType.GPS
+    records['value1'][gps] = 50.45 + along[gps] / 111_320
+    records['value2'][gps] = 30.52 + line[gps] * spacing_m / (111_320 * np.cos(np.radians(50.45)))
+    # the horizontal field about 8 deg east of north, seen from the heading
+    mag1 = (records['data_type'] == MagRowType.MAG) & (records['channel'] == 1)
+    body = np.radians(8.0 - heading[mag1])
+    records['value1'][mag1] = 2e4 * np.cos(body) + records['value1'][mag1] * 1e-3
+    records['value2'][mag1] = 2e4 * np.sin(body) + records['value2'][mag1] * 1e-3
+    return records
@@ -0,0 +1,145 @@
+import logging
+import pickle
+
+import pandas as pd
+import pytest
+
+from mddConverter.combiner import combine_records
+from mddConverter.decoder import decode_records
+from preprocessing import geomagnetic, main
+from preprocessing.Data import DataOwn
+from preprocessing.checkpoint import CHECKPOINT_VERSION, CheckpointStore, PipelineState, step_key
+from preprocessing.main import preprocess_data
+from tests.mdd_samples import survey_records
+
+STEPS = (4, 5, 9, 10)
+
+
+class _Reference:
+    """The WMM evaluated directly, under another name."""
+    declination = staticmethod(geomagnetic.declination)
+
+    def __repr__(self):
+        return "_Reference()"
+
+
+@pytest.fixture(scope="module")
+def flight():
+    return combine_records(decode_records(survey_records(20000).tobytes())).to_dataframe()
+
+
+def _data(flight):
+    # the date and time come from the file name
+    return DataOwn(flight.copy(), filepath="/flights/20250325_121959_MD-R3_#0055_RF.csv")
+
+
+def _run(flight, store, caplog, resume_from=None, **kwargs):
+    """The result and the step the run resumed after, None if it started from the beginning."""
+    caplog.clear()
+    with caplog.at_level(logging.INFO, logger="preprocessing.main"):
+        result = preprocess_data(_data(flight), None, None, checkpoints=store, resume_from=resume_from, **kwargs)
+    resumed = [r.message for r in caplog.records if r.message.startswith("Resuming after step")]
+    return result.df, float(resumed[0].split()[3]) if resumed else None
+
+
+@pytest.fixture
+def store(tmp_path, flight, caplog):
+    """A store with the checkpoints of a full run."""
+    store = CheckpointStore(tmp_path / "checkpoints", STEPS)
+    _run(flight, store, caplog)
+    assert {p.name for p in store.directory.iterdir()} == {f"step_{s}.pkl" for s in STEPS}
+    return store
+
+
+@pytest.fixture(scope="module")
+def fresh(flight):
+    return preprocess_data(_data(flight), None, None).df
+
+
+@pytest.mark.parametrize("resume_from, after", [(5, 4), (6, 5), (9, 5), (10, 9), (11, 10), (12, 10), (4, None)])
+def test_resumed_run_matches_a_fresh_one(flight, fresh, store, caplog, resume_from, after):
+    result, resumed = _run(flight, store, caplog, resume_from)
+    assert resumed == after
+    pd.testing.assert_frame_equal(result, fresh)
+
+
+def test_a_changed_parameter_invalidates_its_step_and_the_later_ones(flight, store, caplog):
+    # step 11 only: everything before is still valid
+    _, resumed = _run(flight, store, caplog, 12, residual_method='butterworth')
+    assert resumed == 10
+    # step 5
+    _, resumed = _run(flight, store, caplog, 12, reference=_Reference())
+    assert resumed == 4
+
+
+def test_a_changed_segmentation_invalidates_all(flight, store, caplog, monkeypatch):
+    monkeypatch.setattr(main, 'SEGMENT_MAX_ANGLE_DIFF', main.SEGMENT_MAX_ANGLE_DIFF + 1)
+    _, resumed = _run(flight, store, caplog, 12)
+    assert resumed is None
+
+
+def test_changed_step_code_invalidates_its_step_and_the_later_ones(flight, store, caplog, monkeypatch):
+    add_facings = main._add_facings
+
+    def _changed_add_facings(state, **kwargs):
+        add_facings(state, **kwargs)
+
+    monkeypatch.setattr(main, '_add_facings', _changed_add_facings)
+    _, resumed = _run(flight, store, caplog, 12)
+    assert resumed == 5
+
+
+def test_a_changed_input_invalidates_all(flight, store, caplog):
+    changed = flight.copy()
+    changed.iloc[100, 1] += 1
+    _, resumed = _run(changed, store, caplog, 12)
+    assert resumed is None
+
+
+@pytest.mark.parametrize("damage", ["garbage", "truncated", "empty"])
+def test_a_corrupt_checkpoint_is_ignored(flight, fresh, store, caplog, damage):
+    path = store.path(10)
+    data = path.read_bytes()
+    path.write_bytes({"garbage": b"not a pickle" * 10, "truncated": data[:len(data) // 2], "empty": b""}[damage])
+
+    result, resumed = _run(flight, store, caplog, 12)
+    assert resumed == 9
+    pd.testing.assert_frame_equal(result, fresh)
+
+
+def test_an_outdated_checkpoint_is_ignored(flight, store, caplog):
+    for step in (9, 10):
+        with open(store.path(step), 'rb') as f:
+            checkpoint = pickle.load(f)
+        checkpoint['version'] = CHECKPOINT_VERSION - 1
+        with open(store.path(step), 'wb') as f:
+            pickle.dump(checkpoint, f)
+
+    _, resumed = _run(flight, store, caplog, 12)
+    assert resumed == 5
+
+
+def test_store_round_trip(tmp_path, flight):
+    store = CheckpointStore(tmp_path, STEPS)
+    state = PipelineState(_data(flight))
+    store.save(4, "key", state)
+    assert store.load(4, "other key") is None
+    assert store.load(5, "key") is None
+    pd.testing.assert_frame_equal(store.load(4, "key").data.df, state.data.df)
+
+
+def test_step_key_chain():
+    def one():
+        return 1
+
+    def other():
+        return 2
+
+    key = step_key("input", 1, [one], {'a': 1})
+    assert step_key("input", 1, [one], {'a': 1}) == key
+    assert step_key("other input", 1, [one], {'a': 1}) != key
+    assert step_key("input", 2, [one], {'a': 1}) != key
+    assert step_key("input", 1, [other], {'a': 1}) != key
+    assert step_key("input", 1, [one], {'a': 2}) != key
+    # a changed key changes all the ones chained after it
+    assert step_key(key, 2, [one], {}) != step_key(step_key("input", 1, [one], {'a': 2}), 2, [one], {})
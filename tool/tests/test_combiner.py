@@ -0,0 +1,28 @@
+import numpy as np
+
+from mddConverter.combiner import combine_records
+from mddConverter.decoder import decode_records
+from mddConverter.magRow import MagRowType
+from tests.mdd_samples import FIRST_TIMESTAMP, TICK_MS, sample_records
+
+
+def test_combine_records():
+    n_ticks = 200
+    records = sample_records(n_ticks)
+    table = combine_records(decode_records(records.tobytes()))
+
+    mag = records[records['data_type'] == MagRowType.MAG]
+    mag1, mag2 = mag[mag['channel'] == 1], mag[mag['channel'] == 2]
+    acc = records[records['data_type'] == MagRowType.ACC]
+    gps = records[records['data_type'] == MagRowType.GPS]
+
+    assert len(table) == n_ticks
+    assert np.array_equal(table['timestamp'], np.arange(n_ticks) * TICK_MS)
+    assert np.array_equal(table['b1x'], mag1['value1'])
+    assert np.array_equal(table['b2z'], mag2['value3'])
+    # every tick has its ACC record within the pairing tolerance
+    assert np.array_equal(table['acc_y'], acc['value2'])
+    # a fix goes to the row of its tick, the others have none
+    fixed = np.flatnonzero(~np.isnan(table['latitude']))
+    assert np.array_equal(table['timestamp'][fixed] + FIRST_TIMESTAMP, (gps['timestamp'] + 1) // TICK_MS * TICK_MS)
+    assert np.array_equal(table['latitude'][fixed], gps['value1'])
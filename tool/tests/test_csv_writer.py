@@ -0,0 +1,53 @@
+import io
+
+import numpy as np
+import pytest
+
+from mddConverter.combinedTable import RF_HEADER
+from mddConverter.combiner import combine_records
+from mddConverter.csvWriter import write_of_csv, write_rf_csv, write_rf_header
+from mddConverter.decoder import decode_records
+from mddConverter.magRow import MagRowType
+from tests.mdd_samples import sample_records
+
+
+def _records_with_gaps(seed=0):
+    """A flight where some ticks have no ACC record, with DATA and unknown records and odd float values."""
+    rng = np.random.default_rng(seed)
+    records = sample_records(1000, seed)
+    acc = np.flatnonzero(records['data_type'] == MagRowType.ACC)
+    records = np.delete(records, rng.choice(acc, 300, replace=False))
+
+    odd = rng.choice(len(records), 50, replace=False)
+    records['value2'][odd[:10]] = np.nan
+    records['value3'][odd[10:20]] = -0.0
+    records['value1'][odd[20:30]] = rng.uniform(-1, 1, 10) * 1e300
+    records['trailer'][odd[30:40]] = np.float32(1e-40)
+    other = rng.choice(len(records), 20, replace=False)
+    records['data_type'][other[:10]] = MagRowType.DATA
+    records['data_type'][other[10:]] = 7
+    return records
+
+
+@pytest.mark.parametrize("block_rows", [1, 7, 100_000])
+def test_rf_csv_matches_the_row_export(block_rows):
+    records = sample_records(1000)
+    acc = np.flatnonzero(records['data_type'] == MagRowType.ACC)
+    table = combine_records(decode_records(np.delete(records, acc[::3]).tobytes()))
+
+    f = io.StringIO()
+    write_rf_header(f)
+    write_rf_csv(f, table, block_rows=block_rows)
+    expected = RF_HEADER + "\n" + "".join(row.export_to_csv(";") + "\n" for row in table.rows())
+    assert f.getvalue() == expected
+    # rows without ACC and without a GPS fix have empty fields
+    assert ";;;" in f.getvalue()
+
+
+@pytest.mark.parametrize("block_rows", [1, 7, 100_000])
+def test_of_csv_matches_the_row_export(block_rows):
+    decoded = decode_records(_records_with_gaps().tobytes())
+
+    f = io.StringIO()
+    write_of_csv(f, decoded, block_rows=block_rows)
+    assert f.getvalue() == "".join(str(row) + "\n" for row in decoded.rows())
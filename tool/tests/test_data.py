@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+from preprocessing.Data import DataFinal, GroupIndex
+
+
+def _data():
+    c = DataFinal.DEFAULT_CONFIG
+    return DataFinal(pd.DataFrame({c.line_id_col: [0, 0, 1, np.nan, 1, 2, 0],
+                                   c.total_field_col: np.arange(7.0)}))
+
+
+def test_group_like_a_mask():
+    data = _data()
+    col = data.config.line_id_col
+    for value in (0, 1, 2, 3):
+        pd.testing.assert_frame_equal(data.group(col, value), data.df[data.df[col] == value])
+    assert [len(g) for g in data.groups(col, range(4))] == [3, 2, 1, 0]
+
+
+def test_group_index():
+    index = GroupIndex(np.array([2, 0, 2, np.nan, 0]))
+    assert list(index.values) == [0, 2]
+    assert list(index.positions(2)) == [0, 2]
+    assert len(index.positions(5)) == 0
+    assert [list(v) for v in index.split(np.arange(5) * 10)] == [[10, 40], [0, 20]]
+
+
+def test_group_after_changes():
+    data = _data()
+    col = data.config.line_id_col
+    data.group(col, 0)
+
+    # in place, keeping the buffer of the column
+    data.df.loc[0, col] = 2
+    assert list(data.group(col, 2).index) == [0, 5]
+    data.df[col] = data.df[col].replace(1, 0)
+    assert list(data.group(col, 0).index) == [1, 2, 4, 6]
+    data.df = data.df.iloc[::-1].reset_index(drop=True)
+    assert list(data.group(col, 2).index) == [1, 6]
@@ -0,0 +1,39 @@
+import numpy as np
+
+from mddConverter.decoder import RECORD_WIDTH, decode_records
+from mddConverter.magRow import MagRowAcc, MagRowB, MagRowGps, MagRowType
+from tests.mdd_samples import sample_records
+
+
+def test_decode_records_fields():
+    records = sample_records(100)
+    decoded = decode_records(records.tobytes(), first_id=7)
+
+    assert len(decoded) == len(records)
+    assert np.array_equal(decoded.records, records)
+    assert np.array_equal(decoded.ids, np.arange(7, 7 + len(records)))
+
+    mag = decoded.of_type(MagRowType.MAG)
+    assert np.array_equal(mag['Bx'], records['value1'][records['data_type'] == MagRowType.MAG])
+    gps = decoded.of_type(MagRowType.GPS)
+    assert np.array_equal(gps['gps_time'], records['trailer'][records['data_type'] == MagRowType.GPS])
+
+
+def test_decode_records_ignores_a_trailing_partial_record():
+    data = sample_records(10).tobytes()
+    decoded = decode_records(data + data[:RECORD_WIDTH - 1])
+    assert np.array_equal(decoded.records, decode_records(data).records)
+
+
+def test_rows_match_the_columns():
+    records = sample_records(50)
+    decoded = decode_records(records.tobytes())
+    rows = list(decoded.rows())
+
+    assert [r.id for r in rows] == list(decoded.ids)
+    classes = {MagRowType.MAG: MagRowB, MagRowType.ACC: MagRowAcc, MagRowType.GPS: MagRowGps}
+    for row, record in zip(rows, records):
+        assert type(row) is classes[record['data_type']]
+        assert row.timestamp == record['timestamp']
+    mag = [r for r in rows if isinstance(r, MagRowB)]
+    assert [r.channel for r in mag[:4]] == [1, 2, 1, 2]
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from mddConverter.combinedTable import RF_COLUMNS, RF_PRECISIONS, round_like_csv
+from mddConverter.main import convert_mdd_to_csv, decode_mdd
+from preprocessing.Data import read_table
+from mddConverter.magRow import MagRowType
+from tests.mdd_samples import sample_records, write_mdd
+
+# decimals of value1..3 in the _RF product, by record type
+VALUE_DECIMALS = {MagRowType.MAG: (2, 2, 2), MagRowType.ACC: (3, 3, 3), MagRowType.GPS: (7, 7, 1)}
+
+
+def _near_halves(records):
+    """Moves every value onto a half of its last decimal in the _RF product, where rounding is the hardest."""
+    for data_type, decimals in VALUE_DECIMALS.items():
+        rows = records['data_type'] == data_type
+        for name, d in zip(('value1', 'value2', 'value3'), decimals):
+            records[name][rows] = (np.floor(records[name][rows] * 10.0**d) + 0.5) / 10.0**d
+    return records
+
+
+@pytest.mark.parametrize("output_format", ["parquet", "arrow", "npz"])
+def test_columns_round_trip_like_the_csv(tmp_path, output_format):
+    records = _near_halves(sample_records(2000))
+    csv_path = convert_mdd_to_csv(write_mdd(tmp_path / "flight.mdd", records), block_size=5000)
+    binary_dir = tmp_path / output_format
+    binary_dir.mkdir()
+    binary_path = convert_mdd_to_csv(write_mdd(binary_dir / "flight.mdd", records), block_size=5000,
+                                     output_format=output_format)
+
+    expected = pd.read_csv(csv_path, delimiter=';')
+    table = read_table(binary_path, ';')
+    assert list(table.columns) == list(RF_COLUMNS.values())
+    for label in RF_COLUMNS.values():
+        assert np.array_equal(table[label].to_numpy(dtype=float), expected[label].to_numpy(dtype=float),
+                              equal_nan=True), label
+
+
+def test_in_memory_table_matches_the_csv(tmp_path):
+    path = write_mdd(tmp_path / "flight.mdd", _near_halves(sample_records(2000, seed=3)))
+    df = decode_mdd(path, save_RF=True).to_dataframe()
+    expected = pd.read_csv(path.with_name("flight_RF.csv"), delimiter=';')
+    pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+
+
+@pytest.mark.parametrize("decimals", sorted(set(RF_PRECISIONS.values())))
+def test_round_like_csv_near_halves(decimals):
+    rng = np.random.default_rng(decimals)
+    # values next to a half of the last decimal, where scaling and rounding can go the other way
+    halves = (rng.integers(-10**6, 10**6, 10000) + 0.5) / 10.0**decimals
+    values = np.concatenate([halves, np.nextafter(halves, np.inf), np.nextafter(halves, -np.inf),
+                             rng.uniform(-1e5, 1e5, 10000)])
+    text = np.array([float(f'%.{decimals}f' % v) for v in values])
+    assert np.array_equal(round_like_csv(values, decimals), text)
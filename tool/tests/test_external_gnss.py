@@ -0,0 +1,185 @@
+from dataclasses import replace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from preprocessing.Data import DataExternalGNSS, DataOwn
+from preprocessing import external_gnss
+from preprocessing.external_gnss import merge_gnss_into_data, nearest_rows, read_gnss_window
+
+GNSS_CONFIG = replace(DataExternalGNSS.DEFAULT_CONFIG, alt_col='altitude')
+
+
+def _old_merge_gnss_into_data(main_data, external_data, max_diff_ms=None, clear=True):
+    """merge_gnss_into_data before the as-of join, with its loop over the external rows."""
+    main_df = main_data.df
+    external_df = external_data.df
+
+    main_ts_col = main_data.config.utc_timestamp_col
+    external_ts_col = external_data.config.utc_timestamp_col
+
+    main_lat_col = main_data.config.lat_col
+    main_lon_col = main_data.config.lon_col
+    main_alt_col = main_data.config.alt_col
+    main_gps_time_col = main_data.config.gps_time_col
+
+    # the old function took a single log; `clear` is False for the logs after the first one
+    if clear:
+        main_df[main_lat_col] = np.nan
+        main_df[main_lon_col] = np.nan
+        main_df[main_alt_col] = np.nan
+        main_df[main_gps_time_col] = np.nan
+
+    ext_lat_col = external_data.config.lat_col
+    ext_lon_col = external_data.config.lon_col
+    ext_alt_col = external_data.config.alt_col
+
+    main_ts = main_df[main_ts_col].values
+    last_main_idx = 0
+
+    for ext_idx, row in external_df.iterrows():
+        ts = row[external_ts_col]
+        if pd.isna(ts):
+            continue
+
+        while last_main_idx + 1 < len(main_ts) and main_ts[last_main_idx + 1] < ts:
+            last_main_idx += 1
+
+        candidates = [last_main_idx]
+        if last_main_idx + 1 < len(main_ts):
+            candidates.append(last_main_idx + 1)
+
+        best_idx = min(candidates, key=lambda i: abs(main_ts[i] - ts))
+        time_diff = abs(main_ts[best_idx] - ts)
+
+        if max_diff_ms is not None and time_diff > max_diff_ms:
+            continue
+
+        if not pd.isna(row.get(ext_lat_col, np.nan)):
+            main_df.at[best_idx, main_lat_col] = row[ext_lat_col]
+        if not pd.isna(row.get(ext_lon_col, np.nan)):
+            main_df.at[best_idx, main_lon_col] = row[ext_lon_col]
+        if not pd.isna(row.get(ext_alt_col, np.nan)):
+            main_df.at[best_idx, main_alt_col] = row[ext_alt_col]
+
+    main_data.df = main_df
+
+
+def _main(rng, n):
+    c = DataOwn.DEFAULT_CONFIG
+    # sorted, with repeated timestamps
+    utc = 1_742_900_000_000 + np.cumsum(rng.integers(0, 8, n))
+    return pd.DataFrame({
+        c.utc_timestamp_col: utc,
+        c.lat_col: rng.uniform(50, 51, n), c.lon_col: rng.uniform(30, 31, n), c.alt_col: rng.uniform(100, 200, n),
+        c.gps_time_col: rng.uniform(120000, 130000, n),
+    })
+
+
+def _log(rng, main_utc, n):
+    """A sorted GNSS log around the flight: fixes before, inside and after it, with missing values."""
+    c = GNSS_CONFIG
+    ts = np.sort(rng.uniform(main_utc[0] - 50, main_utc[-1] + 50, n)).round(int(rng.integers(0, 2)))
+    df = pd.DataFrame({c.utc_timestamp_col: ts, c.lat_col: rng.uniform(50, 51, n),
+                       c.lon_col: rng.uniform(30, 31, n), 'altitude': rng.uniform(100, 200, n)})
+    for col in df.columns:
+        df.loc[rng.random(n) < 0.05, col] = np.nan
+    return DataExternalGNSS(df, config=GNSS_CONFIG)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_merge_matches_the_old_loop(seed):
+    rng = np.random.default_rng(seed)
+    main_df = _main(rng, int(rng.integers(1, 800)))
+    utc = main_df[DataOwn.DEFAULT_CONFIG.utc_timestamp_col].to_numpy()
+    logs = [_log(rng, utc, int(rng.integers(0, 600))) for _ in range(1 + seed % 3)]
+    max_diff_ms = None if seed % 4 == 0 else float(rng.integers(0, 10))
+
+    new = DataOwn(main_df.copy())
+    merge_gnss_into_data(new, logs if len(logs) > 1 else logs[0], max_diff_ms)
+    old = DataOwn(main_df.copy())
+    for i, log in enumerate(logs):
+        _old_merge_gnss_into_data(old, log, max_diff_ms, clear=i == 0)
+
+    pd.testing.assert_frame_equal(new.df, old.df)
+
+
+def test_nearest_rows():
+    main = [0, 10, 20, 20, 30]
+    assert list(nearest_rows(main, [-3, 5, 6, 20, 24, 26, 100, np.nan])) == [0, 0, 1, 2, 3, 4, 4, -1]
+    assert list(nearest_rows(main, [-3, 6, 26, 100], max_diff_ms=4)) == [0, 1, 4, -1]
+    # a source doesn't go back, the next one starts over
+    assert list(nearest_rows(main, [30, 1, 1], sources=[0, 0, 1])) == [4, 3, 0]
+    assert list(nearest_rows([], [1, 2])) == [-1, -1]
+
+
+def _window_log(rng, n, gaps=True):
+    """A log ordered by time with all the columns of a real one; the wanted ones may have gaps."""
+    c = GNSS_CONFIG
+    df = pd.DataFrame({c.utc_timestamp_col: 1_742_900_000_000 + np.cumsum(rng.integers(1, 200, n)).astype(float),
+                       c.lat_col: rng.uniform(50, 51, n), c.lon_col: rng.uniform(30, 31, n),
+                       'altitude': rng.uniform(100, 200, n), 'quality': rng.integers(0, 6, n)})
+    if gaps:
+        df.loc[rng.random(n) < 0.05, c.lat_col] = np.nan
+    return df
+
+
+def _expected_window(df, start, end, margin):
+    c = GNSS_CONFIG
+    ts = df[c.utc_timestamp_col]
+    window = df[(ts >= start - margin) & (ts <= end + margin)]
+    return window[[c.utc_timestamp_col, c.lat_col, c.lon_col, c.alt_col]].reset_index(drop=True)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_read_gnss_window_csv(tmp_path, monkeypatch, seed):
+    # small chunks and bisection steps, so the window starts and ends inside them
+    monkeypatch.setattr(external_gnss, 'CHUNK_ROWS', 37)
+    monkeypatch.setattr(external_gnss, 'BISECT_BYTES', 256)
+    rng = np.random.default_rng(seed)
+    df = _window_log(rng, 2000)
+    path = tmp_path / "log.csv"
+    df.to_csv(path, index=False)
+
+    ts = df[GNSS_CONFIG.utc_timestamp_col].to_numpy()
+    start, end = np.sort(rng.uniform(ts[0] - 1000, ts[-1] + 1000, 2))
+    data = read_gnss_window(path, start, end, margin_ms=500, config=GNSS_CONFIG)
+    pd.testing.assert_frame_equal(data.df, _expected_window(df, start, end, 500), check_dtype=False)
+
+
+def test_read_gnss_window_outside_the_log(tmp_path):
+    df = _window_log(np.random.default_rng(0), 500)
+    path = tmp_path / "log.csv"
+    df.to_csv(path, index=False)
+    ts = df[GNSS_CONFIG.utc_timestamp_col]
+    assert read_gnss_window(path, ts.max() + 10, ts.max() + 20, config=GNSS_CONFIG).df.empty
+    assert read_gnss_window(path, ts.min() - 20, ts.min() - 10, config=GNSS_CONFIG).df.empty
+
+
+def test_read_gnss_window_unordered_csv_is_loaded_whole(tmp_path, monkeypatch):
+    monkeypatch.setattr(external_gnss, 'CHUNK_ROWS', 37)
+    df = _window_log(np.random.default_rng(1), 500).sample(frac=1, random_state=0)
+    path = tmp_path / "log.csv"
+    df.to_csv(path, index=False)
+
+    data = read_gnss_window(path, 0, 1, config=GNSS_CONFIG)
+    assert len(data.df) == len(df)
+
+
+@pytest.mark.parametrize("suffix", [".parquet", ".feather", ".npz"])
+def test_read_gnss_window_binary(tmp_path, suffix):
+    rng = np.random.default_rng(2)
+    df = _window_log(rng, 1000)
+    path = tmp_path / f"log{suffix}"
+    if suffix == ".parquet":
+        df.to_parquet(path, row_group_size=100)
+    elif suffix == ".feather":
+        df.to_feather(path)
+    else:
+        np.savez(path, **{col: df[col].to_numpy() for col in df.columns})
+
+    ts = df[GNSS_CONFIG.utc_timestamp_col].to_numpy()
+    start, end = ts[300], ts[450]
+    data = read_gnss_window(path, start, end, margin_ms=100, config=GNSS_CONFIG)
+    pd.testing.assert_frame_equal(data.df, _expected_window(df, start, end, 100), check_dtype=False)
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from mddConverter import main
+from mddConverter.decoder import RECORD_WIDTH
+from mddConverter.main import convert_mdd_to_csv, follow_mdd
+from tests.mdd_samples import sample_records, write_mdd
+
+
+class GrowingFile:
+    """Appends the next piece of `data` to `path` on every poll of follow_mdd, on a clock of its own."""
+
+    def __init__(self, path, data, cuts):
+        self.path = path
+        self.pieces = [data[a:b] for a, b in zip([0] + cuts, cuts + [len(data)])]
+        self.now = 0.0
+        path.write_bytes(self.pieces.pop(0))
+
+    def sleep(self, seconds):
+        self.now += seconds
+        if self.pieces:
+            with open(self.path, 'ab') as f:
+                f.write(self.pieces.pop(0))
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("output_format", ["csv", "npz"])
+@pytest.mark.parametrize("partial_tail", [0, 20])
+def test_follow_matches_batch(tmp_path, monkeypatch, seed, output_format, partial_tail):
+    rng = np.random.default_rng(seed)
+    data = sample_records(3000, seed).tobytes()
+    # the writer may stop in the middle of a record
+    data += data[:partial_tail]
+    # cuts inside records too, so reads end on partial records
+    cuts = sorted(set(rng.integers(1, len(data), 30).tolist()) | {RECORD_WIDTH * 10 + 5, len(data) - 7})
+
+    batch_dir = tmp_path / "batch"
+    batch_dir.mkdir()
+    expected = convert_mdd_to_csv(write_mdd(batch_dir / "flight.mdd", np.frombuffer(data, np.uint8)),
+                                  save_OF=True, output_format=output_format)
+
+    growing = GrowingFile(tmp_path / "flight.mdd", data, cuts)
+    monkeypatch.setattr(main.time, 'sleep', growing.sleep)
+    monkeypatch.setattr(main.time, 'monotonic', growing.monotonic)
+    result = follow_mdd(tmp_path / "flight.mdd", save_OF=True, output_format=output_format,
+                        poll_interval=0.5, idle_timeout=2.0, block_size=1000)
+
+    assert not growing.pieces
+    assert result.read_bytes() == expected.read_bytes()
+    of = "_OF" + expected.suffix
+    assert (tmp_path / ("flight" + of)).read_bytes() == (batch_dir / ("flight" + of)).read_bytes()
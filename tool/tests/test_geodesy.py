@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+from geographiclib.geodesic import Geodesic
+
+from preprocessing import geodesy
+
+
+def _angle_diff(a, b):
+    return np.abs((np.asarray(a) - b + 180) % 360 - 180)
+
+
+def _pairs(rng, n, scale):
+    lat1 = rng.uniform(-80, 80, n)
+    lon1 = rng.uniform(-180, 180, n)
+    lat2 = np.clip(lat1 + rng.normal(0, scale, n), -89.9, 89.9)
+    lon2 = lon1 + rng.normal(0, scale, n)
+    return lat1, lon1, lat2, lon2
+
+
+@pytest.mark.parametrize("scale", [0.001, 1.0, 60.0])
+def test_inverse_matches_geographiclib(scale):
+    lat1, lon1, lat2, lon2 = _pairs(np.random.default_rng(0), 500, scale)
+    s12, azi1, azi2 = geodesy.inverse(lat1, lon1, lat2, lon2)
+
+    expected = [Geodesic.WGS84.Inverse(*p) for p in zip(lat1, lon1, lat2, lon2)]
+    # Vincenty's formulae are good to 0.1 mm
+    np.testing.assert_allclose(s12, [g['s12'] for g in expected], rtol=0, atol=1e-4)
+    assert _angle_diff(azi1, [g['azi1'] for g in expected]).max() < 1e-7
+    assert _angle_diff(azi2, [g['azi2'] for g in expected]).max() < 1e-7
+    np.testing.assert_array_equal(geodesy.distance(lat1, lon1, lat2, lon2), s12)
+
+
+@pytest.mark.parametrize("scale", [0.001, 1.0, 60.0])
+def test_direct_matches_geographiclib(scale):
+    rng = np.random.default_rng(1)
+    lat1, lon1, _, _ = _pairs(rng, 500, scale)
+    azi1 = rng.uniform(-180, 180, 500)
+    s12 = rng.uniform(0, scale * 1e5, 500)
+    lat2, lon2, azi2 = geodesy.direct(lat1, lon1, azi1, s12)
+
+    expected = [Geodesic.WGS84.Direct(*p) for p in zip(lat1, lon1, azi1, s12)]
+    np.testing.assert_allclose(lat2, [g['lat2'] for g in expected], rtol=0, atol=1e-9)
+    assert _angle_diff(lon2, [g['lon2'] for g in expected]).max() < 1e-9
+    assert _angle_diff(azi2, [g['azi2'] for g in expected]).max() < 1e-9
+    assert ((-180 <= lon2) & (lon2 < 180)).all()
+
+
+def test_nearly_antipodal_points_fall_back_to_geographiclib(monkeypatch):
+    calls = []
+    original = Geodesic.WGS84.Inverse
+
+    def inverse(*args):
+        calls.append(args)
+        return original(*args)
+
+    monkeypatch.setattr(Geodesic.WGS84, "Inverse", inverse)
+    lat1 = np.array([0.0, 50.45, 0.0, 10.0])
+    lon1 = np.array([0.0, 30.52, 0.0, 0.0])
+    lat2 = np.array([0.5, 50.46, 0.0, -10.0])
+    lon2 = np.array([179.7, 30.53, 179.5, 179.9])
+    s12, azi1, azi2 = geodesy.inverse(lat1, lon1, lat2, lon2)
+
+    # only the points Vincenty's iteration doesn't converge for
+    assert len(calls) >= 1 and all(args[:2] != (50.45, 30.52) for args in calls)
+    for i in range(len(lat1)):
+        g = original(lat1[i], lon1[i], lat2[i], lon2[i])
+        assert abs(s12[i] - g['s12']) < 1e-4
+        assert _angle_diff(azi1[i], g['azi1']) < 1e-7
+        assert _angle_diff(azi2[i], g['azi2']) < 1e-7
+
+
+def test_special_points_and_shapes():
+    # coincident points get geographiclib's azimuths, NaN gives NaN
+    s12, azi1, azi2 = geodesy.inverse([10.0, -10.0, np.nan], [20.0, 20.0, 0.0], [10.0, -10.0, 1.0], [20.0, 20.0, 1.0])
+    for i, (lat, lon) in enumerate(((10.0, 20.0), (-10.0, 20.0))):
+        g = Geodesic.WGS84.Inverse(lat, lon, lat, lon)
+        assert (s12[i], azi1[i], azi2[i]) == (g['s12'], g['azi1'], g['azi2'])
+    assert np.isnan([s12[2], azi1[2], azi2[2]]).all()
+    assert np.isnan(geodesy.direct(np.nan, 0.0, 90.0, 10.0)[0])
+
+    # broadcasting, and a point gives the same result alone as in a batch
+    lat1, lon1, lat2, lon2 = _pairs(np.random.default_rng(2), 12, 1.0)
+    s12, _, _ = geodesy.inverse(lat1.reshape(3, 4), lon1.reshape(3, 4), lat2.reshape(3, 4), lon2.reshape(3, 4))
+    assert s12.shape == (3, 4)
+    assert [float(geodesy.distance(*p)) for p in zip(lat1, lon1, lat2, lon2)] == s12.ravel().tolist()
+    assert geodesy.direct(50.45, 30.52, [0.0, 90.0], 100.0)[0].shape == (2,)
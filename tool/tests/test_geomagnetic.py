@@ -0,0 +1,69 @@
+from datetime import date, datetime
+
+import numpy as np
+import pytest
+from ahrs.utils import WMM
+
+from preprocessing import geomagnetic
+
+
+def _points(rng, n):
+    # the whole globe short of the poles, heights from below sea level up to a few km
+    lat = rng.uniform(-89.0, 89.0, n)
+    lon = rng.uniform(-180.0, 180.0, n)
+    height = rng.uniform(-0.5, 5.0, n)
+    return lat, lon, height
+
+
+def _scalar(lat, lon, height, d):
+    out = []
+    for la, lo, h in zip(lat, lon, height):
+        wmm = WMM(date=d, latitude=la, longitude=lo, height=h)
+        out.append((wmm.X, wmm.Y, wmm.Z, wmm.D))
+    return np.array(out).T
+
+
+@pytest.mark.parametrize("d", [date(2025, 3, 25), date(2022, 11, 2)])
+def test_reference_field_matches_scalar_wmm(d):
+    lat, lon, height = _points(np.random.default_rng(0), 300)
+    X, Y, Z, D = _scalar(lat, lon, height, d)
+
+    x, y, z = geomagnetic.reference_field(lat, lon, height, d)
+    np.testing.assert_allclose(x, X, rtol=0, atol=1e-6)
+    np.testing.assert_allclose(y, Y, rtol=0, atol=1e-6)
+    np.testing.assert_allclose(z, Z, rtol=0, atol=1e-6)
+
+    # D of the WMM is in (-180, 180]
+    declination = geomagnetic.declination(lat, lon, height, d)
+    np.testing.assert_allclose((declination - D + 180) % 360 - 180, 0, atol=1e-9)
+
+
+def test_reference_field_chunks_and_shapes(monkeypatch):
+    lat, lon, height = _points(np.random.default_rng(1), 120)
+    d = datetime(2025, 3, 25, 12, 19, 59)
+    whole = geomagnetic.reference_field(lat, lon, height, d)
+
+    monkeypatch.setattr(geomagnetic, "CHUNK_SIZE", 7)
+    chunked = geomagnetic.reference_field(lat, lon, height, d)
+    for a, b in zip(whole, chunked):
+        np.testing.assert_array_equal(a, b)
+
+    # the shape of the broadcast inputs is kept, a datetime is taken by its date
+    x, y, z = geomagnetic.reference_field(lat.reshape(12, 10), lon.reshape(12, 10), 0.0, d)
+    assert x.shape == y.shape == z.shape == (12, 10)
+    np.testing.assert_array_equal(x.ravel(), geomagnetic.reference_field(lat, lon, 0.0, d.date())[0])
+
+    scalar = geomagnetic.declination(50.45, 30.52, 0.0, d)
+    assert np.ndim(scalar) == 0
+
+
+def test_model_epoch_groups_dates():
+    model, epoch = geomagnetic.model_epoch(date(2025, 3, 25))
+    assert model.startswith("WMM")
+    assert geomagnetic.model_epoch(date(2025, 3, 27)) == (model, epoch)
+    assert geomagnetic.model_epoch(date(2025, 9, 1))[1] != epoch
+
+    # dates of one epoch give the same field
+    a = geomagnetic.reference_field(50.45, 30.52, 0.0, date(2025, 3, 25))
+    b = geomagnetic.reference_field(50.45, 30.52, 0.0, date(2025, 3, 27))
+    assert a == b
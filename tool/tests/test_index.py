@@ -0,0 +1,123 @@
+from functools import partial
+
+import numpy as np
+import pytest
+
+import mddConverter.main
+from mddConverter.decoder import RECORD_WIDTH
+from mddConverter.index import build_index, index_path, load_or_build_index
+from mddConverter.magRow import MagRowType
+from mddConverter.main import decode_mdd
+from tests.mdd_samples import FIRST_TIMESTAMP, TICK_MS, sample_records, write_mdd
+
+N_TICKS = 20000
+BLOCK_RECORDS = 1000
+
+
+@pytest.fixture
+def flight(tmp_path, monkeypatch):
+    # small index blocks, so the windows start and end in many of them
+    monkeypatch.setattr(mddConverter.main, 'load_or_build_index',
+                        partial(load_or_build_index, block_records=BLOCK_RECORDS))
+    records = sample_records(N_TICKS)
+    return write_mdd(tmp_path / "flight.mdd", records), records
+
+
+def test_build_index(flight):
+    path, records = flight
+    index = build_index(path, BLOCK_RECORDS)
+
+    # the blocks are about BLOCK_RECORDS long, the stream holds records back across them
+    assert index.offsets[0] == 0 and np.all(np.diff(index.offsets) > 0)
+    assert np.all(index.offsets % RECORD_WIDTH == 0)
+    bounds = np.append(index.offsets, index.file_size) // RECORD_WIDTH
+    blocks = [records['timestamp'][a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+    assert np.array_equal(index.ts_min, [b.min() for b in blocks])
+    assert np.array_equal(index.ts_max, [b.max() for b in blocks])
+    assert np.array_equal(index.counts.sum(axis=1), [len(b) for b in blocks])
+    counts = index.type_counts()
+    for t in (MagRowType.MAG, MagRowType.ACC, MagRowType.GPS):
+        assert counts[t] == np.count_nonzero(records['data_type'] == t)
+    assert index.first_timestamp == FIRST_TIMESTAMP
+
+
+def test_index_is_reused_until_the_file_changes(flight):
+    path, records = flight
+    index = load_or_build_index(path, BLOCK_RECORDS)
+    assert index_path(path).exists()
+    assert load_or_build_index(path, BLOCK_RECORDS).is_valid_for(path)
+
+    write_mdd(path, records[:len(records) // 2])
+    assert not index.is_valid_for(path)
+    assert load_or_build_index(path, BLOCK_RECORDS).file_size == len(records) // 2 * RECORD_WIDTH
+
+
+def test_byte_range(flight):
+    path, records = flight
+    index = build_index(path, BLOCK_RECORDS)
+    assert index.byte_range(None, None) == (0, index.file_size)
+    assert index.byte_range(int(index.ts_max[-1]) + 1, None) == (0, 0)
+
+    start_ts, end_ts = FIRST_TIMESTAMP + 20_000, FIRST_TIMESTAMP + 30_000
+    start, stop = index.byte_range(start_ts, end_ts)
+    boundaries = list(index.offsets) + [index.file_size]
+    assert start in boundaries and stop in boundaries
+    inside = np.flatnonzero((records['timestamp'] >= start_ts) & (records['timestamp'] <= end_ts))
+    assert start <= inside[0] * RECORD_WIDTH and (inside[-1] + 1) * RECORD_WIDTH <= stop
+
+
+LAST = (N_TICKS - 1) * TICK_MS
+WINDOWS = [
+    (12_345, 23_456),  # inside
+    (0, 1_000),  # the start of the flight
+    (LAST - 1_000, LAST),  # the end
+    (-500, 250),  # partly before the start
+    (LAST - 10, LAST + 10_000),  # partly after the end
+    (5_000, 5_000),  # a single row
+    (5_001, 5_004),  # between two rows
+    (LAST + 1, LAST + 1_000),  # after the end
+]
+
+
+def _assert_window(path, full, window):
+    ts = full['timestamp']
+    expected = full.take((ts >= window[0]) & (ts <= window[1]))
+
+    table = decode_mdd(path, time_window=window)
+    assert len(table) == len(expected)
+    for key, values in expected.columns.items():
+        assert np.array_equal(table[key], values, equal_nan=True), (window, key)
+
+
+@pytest.mark.parametrize("window", WINDOWS)
+def test_time_window(flight, window):
+    path, _ = flight
+    _assert_window(path, decode_mdd(path), window)
+
+
+def test_time_window_at_block_edges(flight):
+    path, _ = flight
+    full = decode_mdd(path)
+    index = load_or_build_index(path, BLOCK_RECORDS)
+    for block in range(1, len(index.offsets)):
+        # the last timestamp of the block before and the first of this one, in RF time
+        before = int(index.ts_max[block - 1]) - FIRST_TIMESTAMP
+        after = int(index.ts_min[block]) - FIRST_TIMESTAMP
+        for window in [(before, after), (before - 50, before), (after, after + 50)]:
+            _assert_window(path, full, window)
+
+
+def test_time_window_reads_only_part_of_the_file(flight, monkeypatch):
+    path, _ = flight
+    ranges = []
+    iter_blocks = mddConverter.main.iter_mdd_blocks
+
+    def recording(input_path, block_size, start, stop, **kwargs):
+        ranges.append((start, stop))
+        return iter_blocks(input_path, block_size, start, stop, **kwargs)
+
+    monkeypatch.setattr(mddConverter.main, 'iter_mdd_blocks', recording)
+    decode_mdd(path, time_window=(40_000, 41_000))
+    start, stop = ranges[0]
+    assert 0 < start and stop < path.stat().st_size
+    assert stop - start < path.stat().st_size / 10
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from preprocessing import geodesy
+from preprocessing.Data import DataFinal
+from preprocessing.interpolation import interpolate_all_lines, interpolate_for_lines
+from preprocessing.local_frame import LocalFrame
+
+
+def _lines(rng, n_tracks):
+    """Rows of both sensors of every track, GNSS fixes every few rows and the rows between them without one."""
+    c = DataFinal.DEFAULT_CONFIG
+    parts = []
+    for track in range(n_tracks):
+        for sensor in (1, 2):
+            n = int(rng.integers(0, 200))
+            fix = rng.random(n) < rng.uniform(0.05, 1)
+            parts.append(pd.DataFrame({
+                c.timestamp_col: np.cumsum(rng.integers(1, 10, n)),
+                c.track_id_col: track, c.sensor_id_col: sensor, c.line_id_col: track * 2 + sensor - 1,
+                c.lat_col: np.where(fix, 50.45 + np.cumsum(rng.normal(0, 1e-5, n)), np.nan),
+                c.lon_col: np.where(fix, 30.52 + np.cumsum(rng.normal(0, 1e-5, n)), np.nan),
+                c.alt_col: np.where(fix, rng.uniform(100, 120, n), np.nan),
+                c.total_field_col: rng.normal(50000, 10, n),
+            }))
+    # the lines are interleaved in time
+    return pd.concat(parts, ignore_index=True).sort_values(c.timestamp_col, kind='stable').reset_index(drop=True)
+
+
+@pytest.mark.parametrize("seed", range(15))
+@pytest.mark.parametrize("local", [False, True])
+def test_interpolate_all_lines_matches_the_loop(seed, local):
+    rng = np.random.default_rng(seed)
+    df = _lines(rng, int(rng.integers(1, 6)))
+    if df.empty or df[DataFinal.DEFAULT_CONFIG.lat_col].isna().all():
+        pytest.skip("no fixes")
+    data = DataFinal(df)
+    geometry = geodesy
+    if local:
+        c = data.config
+        frame = LocalFrame.for_flight(df[c.lat_col], df[c.lon_col])
+        east, north = frame.to_plane(df[c.lat_col], df[c.lon_col])
+        data.add_column(c.east_col, east)
+        data.add_column(c.north_col, north)
+        geometry = frame.plane
+
+    pd.testing.assert_frame_equal(interpolate_all_lines(data, geometry), interpolate_for_lines(data, geometry))
@@ -0,0 +1,39 @@
+import numpy as np
+
+from preprocessing.local_frame import LocalFrame
+
+
+def _flight(rng, n, extent_deg):
+    lat = 50.45 + np.cumsum(rng.normal(0, extent_deg / np.sqrt(n), n))
+    lon = 30.52 + np.cumsum(rng.normal(0, extent_deg / np.sqrt(n), n))
+    return lat, lon
+
+
+def test_plane_round_trip():
+    lat, lon = _flight(np.random.default_rng(0), 2000, 0.02)
+    frame = LocalFrame.for_flight(lat, lon)
+    east, north = frame.to_plane(lat, lon)
+    back_lat, back_lon = frame.from_plane(east, north)
+    assert np.abs(back_lat - lat).max() < 1e-10
+    assert np.abs(back_lon - lon).max() < 1e-10
+
+
+def test_deviation_from_the_geodesics():
+    lat, lon = _flight(np.random.default_rng(1), 5000, 0.02)
+    frame = LocalFrame.for_flight(lat, lon, check_samples=500)
+    east, north = frame.to_plane(lat, lon)
+
+    frame.compare_inverse(lat[:-1], lon[:-1], lat[1:], lon[1:], north[:-1], east[:-1], north[1:], east[1:])
+    frame.compare_direct(lat, lon, north, east, np.full(len(lat), 30.0), 0.5)
+    d = frame.max_deviation
+    # a flight a few km across: the azimuths turn with the meridians, the lengths and positions stay well below a mm
+    assert 0 < d['azimuth'] < 0.05
+    assert d['distance'] < 1e-3
+    assert 0 < d['position'] < 1e-3
+    assert 'azimuth' in frame.report()
+
+    # the plane of a frame far away is visibly wrong
+    far = LocalFrame(frame.lat0 + 1, frame.lon0 + 1)
+    east, north = far.to_plane(lat, lon)
+    far.compare_inverse(lat[:-1], lon[:-1], lat[1:], lon[1:], north[:-1], east[:-1], north[1:], east[1:])
+    assert far.max_deviation['azimuth'] > 0.5
@@ -0,0 +1,45 @@
+import multiprocessing
+import os
+import time
+
+import pytest
+
+import run_preprocessing
+from run_preprocessing import print_summary, process_files
+
+pytestmark = pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                                reason="the workers have to inherit the patched process_single_file")
+
+
+def _fake_process_single_file(mdd_filepath, **_):
+    if 'crash' in mdd_filepath:
+        time.sleep(0.1)
+        os._exit(1)  # like a worker killed for running out of memory
+    if 'error' in mdd_filepath:
+        raise ValueError("bad file")
+    time.sleep(0.3)
+
+
+@pytest.mark.parametrize("jobs", [2, 4])
+def test_a_dead_worker_only_fails_its_file(monkeypatch, capsys, jobs):
+    monkeypatch.setattr(run_preprocessing, 'process_single_file', _fake_process_single_file)
+    files = ['a.mdd', 'crash.mdd', 'b.mdd', 'error.mdd', 'c.mdd', 'd.mdd', 'e.mdd']
+
+    results = process_files(files, jobs=jobs)
+
+    assert [r[0] for r in results] == files
+    errors = {mdd_filepath: error for mdd_filepath, error, _ in results}
+    assert errors.pop('crash.mdd').startswith('BrokenProcessPool')
+    assert errors.pop('error.mdd') == 'ValueError: bad file'
+    assert set(errors.values()) == {None}
+    # every time is the file's own
+    assert all(seconds is not None and seconds < 5 for _, _, seconds in results)
+
+    print_summary(results, 1.0)
+    assert "5 of 7 files processed, 2 failed" in capsys.readouterr().out
+
+
+def test_summary_without_a_time(capsys):
+    print_summary([('a.mdd', None, 1.5), ('b.mdd', 'PicklingError: x', None)], 2.0)
+    out = capsys.readouterr().out
+    assert "1.5 s summed over the files" in out
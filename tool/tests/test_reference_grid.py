@@ -0,0 +1,139 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+from preprocessing import geomagnetic
+from preprocessing.reference_grid import GRID_VERSION, GridReference, ReferenceGrid
+
+DATE = date(2025, 3, 25)
+
+
+def _flight(rng, n, lat0=50.45, lon0=30.52, extent=0.05):
+    lat = lat0 + rng.uniform(-extent, extent, n)
+    lon = lon0 + rng.uniform(-extent, extent, n)
+    height = rng.uniform(0.0, 0.3, n)
+    return lat, lon, height
+
+
+def _files(cache_dir):
+    return sorted(p.name for p in cache_dir.glob("wmm_*.npz"))
+
+
+@pytest.mark.parametrize("spacing", [0.01, 0.05])
+def test_grid_within_stated_error(tmp_path, spacing):
+    reference = GridReference(tmp_path, spacing=spacing)
+    lat, lon, height = _flight(np.random.default_rng(0), 2000)
+
+    approx = reference.reference_field(lat, lon, height, DATE)
+    exact = geomagnetic.reference_field(lat, lon, height, DATE)
+    grid = reference.grid_for(lat, lon, height, DATE)
+    assert 0 < grid.max_error < 1.0
+    for a, e in zip(approx, exact):
+        assert np.abs(a - e).max() <= grid.max_error
+
+    d_approx = reference.declination(lat, lon, height, DATE)
+    d_exact = geomagnetic.declination(lat, lon, height, DATE)
+    assert np.abs((d_approx - d_exact + 180) % 360 - 180).max() <= grid.max_declination_error
+
+
+def test_grid_reused_inside_coverage(tmp_path):
+    reference = GridReference(tmp_path)
+    rng = np.random.default_rng(1)
+    reference.reference_field(*_flight(rng, 100), DATE)
+    files = _files(tmp_path)
+    assert len(files) == 1
+
+    # another flight over the same tile and a date of the same epoch
+    lat, lon, height = _flight(rng, 100, extent=0.03)
+    reference.reference_field(lat, lon, height, date(2025, 3, 27))
+    assert _files(tmp_path) == files
+
+    # a new instance finds the saved grid
+    x, _, _ = GridReference(tmp_path).reference_field(lat, lon, height, DATE)
+    assert _files(tmp_path) == files
+    np.testing.assert_allclose(x, geomagnetic.reference_field(lat, lon, height, DATE)[0], atol=1e-3)
+
+
+def test_grid_rebuilt_outside_coverage(tmp_path):
+    reference = GridReference(tmp_path)
+    rng = np.random.default_rng(2)
+    first = reference.grid_for(*_flight(rng, 100), DATE)
+
+    # next to the first grid: replaced by one covering both
+    lat, lon, height = _flight(rng, 100, lon0=30.62)
+    x, _, _ = reference.reference_field(lat, lon, height, DATE)
+    assert len(_files(tmp_path)) == 1
+    grid = reference.grid_for(lat, lon, height, DATE)
+    assert grid.covers(first.bounds)
+    np.testing.assert_allclose(x, geomagnetic.reference_field(lat, lon, height, DATE)[0], atol=1e-3)
+
+    # far away: a grid of its own
+    lat, lon, height = _flight(rng, 100, lat0=48.0, lon0=24.0)
+    x, _, _ = reference.reference_field(lat, lon, height, DATE)
+    assert len(_files(tmp_path)) == 2
+    np.testing.assert_allclose(x, geomagnetic.reference_field(lat, lon, height, DATE)[0], atol=1e-3)
+
+    # heights above the grid
+    x, _, _ = reference.reference_field(lat, lon, height + 1.0, DATE)
+    np.testing.assert_allclose(x, geomagnetic.reference_field(lat, lon, height + 1.0, DATE)[0], atol=1e-3)
+
+
+def test_grid_per_epoch_and_eviction(tmp_path):
+    reference = GridReference(tmp_path, max_epoch_age=1.0)
+    lat, lon, height = _flight(np.random.default_rng(3), 100)
+
+    old = reference.grid_for(lat, lon, height, date(2023, 3, 25))
+    grid = reference.grid_for(lat, lon, height, date(2023, 9, 1))
+    assert grid.epoch != old.epoch
+    assert len(_files(tmp_path)) == 2
+
+    # the field of another date is not answered from the grid of the first one
+    d = date(2024, 6, 1)
+    x, y, z = reference.reference_field(lat, lon, height, d)
+    for a, e in zip((x, y, z), geomagnetic.reference_field(lat, lon, height, d)):
+        np.testing.assert_allclose(a, e, atol=1e-3)
+    # the 2023.2 grid is more than a year older and goes
+    epochs = sorted(g.epoch for _, g in reference._grids())
+    assert epochs == [2023.7, 2024.4]
+
+    reference.max_grids = 1
+    reference.evict(2024.4)
+    assert [g.epoch for _, g in reference._grids()] == [2024.4]
+
+
+def test_nan_points_and_unreadable_grids(tmp_path):
+    reference = GridReference(tmp_path)
+    lat, lon, height = _flight(np.random.default_rng(4), 50)
+    lat[[3, 10]] = np.nan
+    x, y, z = reference.reference_field(lat, lon, height, DATE)
+    assert np.isnan(x[[3, 10]]).all() and np.isnan(z[[3, 10]]).all()
+    assert not np.isnan(np.delete(x, [3, 10])).any()
+
+    (tmp_path / "wmm_broken.npz").write_bytes(b"not a grid")
+    reference.reference_field(lat, lon, height, DATE)
+    assert len(reference._grids()) == 1
+
+    # all NaN: nothing to build
+    x, _, _ = GridReference(tmp_path / "empty").reference_field([np.nan], [np.nan], 0.0, DATE)
+    assert np.isnan(x).all() and not (tmp_path / "empty").exists()
+
+
+def test_grid_save_load(tmp_path):
+    grid = ReferenceGrid.build(DATE, (50.4, 50.5, 30.5, 30.6, 0.0, 0.2))
+    path = tmp_path / "grid.npz"
+    grid.save(path)
+    loaded = ReferenceGrid.load(path)
+    assert (loaded.model, loaded.epoch, loaded.bounds) == (grid.model, grid.epoch, grid.bounds)
+    assert (loaded.max_error, loaded.max_declination_error) == (grid.max_error, grid.max_declination_error)
+    np.testing.assert_array_equal(loaded.Z, grid.Z)
+
+    # outside the grid
+    x, _, _ = grid.interpolate([50.45, 50.55], [30.55, 30.55], [0.1, 0.1])
+    assert not np.isnan(x[0]) and np.isnan(x[1])
+
+    with np.load(path) as f:
+        data = dict(f)
+    data['version'] = GRID_VERSION + 1
+    np.savez(path, **data)
+    assert ReferenceGrid.load(path) is None
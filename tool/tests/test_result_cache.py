@@ -0,0 +1,104 @@
+import os
+
+import pytest
+
+from result_cache import META_FILE, ResultCache
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    directory = tmp_path / "inputs"
+    directory.mkdir()
+    for name, text in (("a.mdd", "flight a"), ("a_copy.mdd", "flight a"), ("b.mdd", "flight b"),
+                       ("SystemInfo.txt", "calibration"), ("rover.csv", "rover"), ("base.csv", "base")):
+        (directory / name).write_text(text)
+    return directory
+
+
+def _outputs(directory, text, size=0):
+    directory.mkdir(exist_ok=True)
+    outputs = {'RF': directory / "flight_RF.csv", 'prep': directory / "flight_prep.csv"}
+    for role, path in outputs.items():
+        path.write_text(f"{role} {text}" + "x" * size)
+    return outputs
+
+
+def test_make_key_follows_content_and_settings(tmp_path, inputs):
+    cache = ResultCache(tmp_path / "cache")
+    key = cache.make_key(inputs / "a.mdd", inputs / "SystemInfo.txt", None, datetime=None, delimiter=';')
+
+    # the key is of the content, not of the paths
+    assert cache.make_key(inputs / "a_copy.mdd", inputs / "SystemInfo.txt", None, datetime=None, delimiter=';') == key
+    assert cache.make_key(inputs / "b.mdd", inputs / "SystemInfo.txt", None, datetime=None, delimiter=';') != key
+    assert cache.make_key(inputs / "a.mdd", None, None, datetime=None, delimiter=';') != key
+    assert cache.make_key(inputs / "a.mdd", inputs / "SystemInfo.txt", None, datetime=None, delimiter=',') != key
+    assert cache.make_key(inputs / "a.mdd", inputs / "SystemInfo.txt", inputs / "rover.csv",
+                          datetime=None, delimiter=';') != key
+
+    logs = [inputs / "rover.csv", inputs / "base.csv"]
+    with_logs = cache.make_key(inputs / "a.mdd", None, logs, local_frame=False)
+    assert cache.make_key(inputs / "a.mdd", None, list(logs), local_frame=False) == with_logs
+    assert cache.make_key(inputs / "a.mdd", None, logs[::-1], local_frame=False) != with_logs
+
+    (inputs / "a.mdd").write_text("flight a, longer")
+    assert cache.make_key(inputs / "a.mdd", inputs / "SystemInfo.txt", None, datetime=None, delimiter=';') != key
+
+
+def test_restore_missing_and_changed_outputs(tmp_path):
+    cache = ResultCache(tmp_path / "cache")
+    outputs = _outputs(tmp_path / "out", "result")
+    cache.store("k", outputs)
+
+    assert not cache.restore("other", outputs)
+    assert not cache.restore("k", {**outputs, 'OF': tmp_path / "out" / "flight_OF.csv"})
+
+    outputs['RF'].unlink()
+    outputs['prep'].write_text("edited by hand")
+    assert cache.restore("k", {'RF': outputs['RF']})
+    assert outputs['RF'].read_text() == "RF result"
+    assert outputs['prep'].read_text() == "edited by hand"
+
+    assert cache.restore("k", outputs)
+    assert outputs['prep'].read_text() == "prep result"
+    # an output that is still the restored file is left alone
+    restored = os.stat(outputs['prep'])
+    assert cache.restore("k", outputs)
+    assert os.stat(outputs['prep']).st_ino == restored.st_ino
+
+    # to a different place
+    elsewhere = {role: tmp_path / "elsewhere" / path.name for role, path in outputs.items()}
+    elsewhere['RF'].parent.mkdir()
+    assert cache.restore("k", elsewhere)
+    assert elsewhere['RF'].read_text() == "RF result"
+
+
+def test_broken_entries_are_misses(tmp_path):
+    cache = ResultCache(tmp_path / "cache")
+    outputs = _outputs(tmp_path / "out", "result")
+    cache.store("k", outputs)
+
+    (cache.cache_dir / "k" / META_FILE).write_text("{not json")
+    assert not cache.restore("k", outputs)
+    cache.store("k2", outputs)
+    (cache.cache_dir / "k2" / "RF").unlink()
+    outputs['RF'].unlink()
+    assert not cache.restore("k2", outputs)
+
+
+def test_evict_least_recently_used(tmp_path):
+    size = 1000  # per output, two per entry
+    cache = ResultCache(tmp_path / "cache", max_size_mb=6.5 * size / 1024 / 1024)
+    for i, key in enumerate("abc"):
+        cache.store(key, _outputs(tmp_path / key, key, size))
+        # distinct times of last use, a is the oldest
+        os.utime(cache.cache_dir / key / META_FILE, (1000 + i, 1000 + i))
+    assert sorted(p.name for p in cache.cache_dir.iterdir()) == ['a', 'b', 'c']
+
+    # using a makes b the least recently used one
+    assert cache.restore("a", _outputs(tmp_path / "a", "a", size))
+    cache.store("d", _outputs(tmp_path / "d", "d", size))
+    assert sorted(p.name for p in cache.cache_dir.iterdir()) == ['a', 'c', 'd']
+
+    # an entry larger than the limit on its own is kept while it's the most recent
+    cache.store("big", _outputs(tmp_path / "big", "big", 10 * size))
+    assert sorted(p.name for p in cache.cache_dir.iterdir()) == ['big']
@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+import pytest
+from geographiclib.geodesic import Geodesic
+
+from preprocessing.local_frame import LocalFrame, PlaneGeometry
+from preprocessing.trajectory_segmentation import (OnlineSegmenter, segment_by_heading, segment_by_heading_incremental,
+                                                   segments_to_arrays)
+
+
+def _baseline_segmentation(df, lat_col, lon_col, max_angle_diff=50, min_segment_len=10):
+    """The incremental loop as it was before segment_by_heading, on geographiclib."""
+    def heading(i):
+        g = Geodesic.WGS84.Inverse(df.iloc[i][lat_col], df.iloc[i][lon_col], df.iloc[i + 1][lat_col], df.iloc[i + 1][lon_col])
+        return g['azi1'] % 360
+
+    n = len(df)
+    track_ids = np.full(n, np.nan)
+    headings = np.full(n, np.nan)
+    i = 0
+    track = 0
+    while i < n - 1:
+        j = i + 1
+        while j < n - 1:
+            h_ref, h_curr = heading(i), heading(j)
+            if i == j - 1:
+                headings[i] = h_ref
+            headings[j] = h_curr
+            if min(abs(h_ref - h_curr), 360 - abs(h_ref - h_curr)) > max_angle_diff:
+                break
+            j += 1
+        geo = Geodesic.WGS84.Inverse(df[lat_col].iloc[i], df[lon_col].iloc[i], df[lat_col].iloc[j], df[lon_col].iloc[j])
+        if geo['s12'] >= min_segment_len:
+            track_ids[i:j] = track
+            track += 1
+        i = j
+    return track_ids, headings
+
+
+def _assert_same_headings(headings, expected):
+    np.testing.assert_array_equal(np.isnan(headings), np.isnan(expected))
+    d = np.abs(headings - expected)[~np.isnan(expected)]
+    # headings of points a few cm apart, where Vincenty and geographiclib differ most
+    assert np.minimum(d, 360 - d).max(initial=0) < 1e-5
+
+
+def survey_flight(n, line_len=150, speed=0.5, noise_deg=2e-7, seed=0):
+    """Lawnmower lines near Kyiv with GNSS noise, every few lines broken by a short zigzag."""
+    rng = np.random.default_rng(seed)
+    line, along = np.divmod(np.arange(n), line_len)
+    along = np.where(line % 2 == 0, along, line_len - 1 - along)
+    north = along * speed
+    east = line * 20.0 + np.where((line % 3 == 1) & (along % 7 < 3), 3.0 * (along % 7), 0.0)
+    lat = 50.45 + north / 111320 + rng.normal(0, noise_deg, n)
+    lon = 30.52 + east / (111320 * np.cos(np.radians(50.45))) + rng.normal(0, noise_deg, n)
+    return lat, lon
+
+
+@pytest.mark.parametrize("max_angle_diff, min_segment_len", [(50, 10), (30, 40), (90, 5)])
+def test_same_segments_as_the_baseline_loop(max_angle_diff, min_segment_len):
+    lat, lon = survey_flight(1200)
+    track_ids, headings = segment_by_heading(lat, lon, max_angle_diff, min_segment_len)
+
+    df = pd.DataFrame({'lat': lat, 'lon': lon})
+    ref_ids, ref_headings = _baseline_segmentation(df, 'lat', 'lon', max_angle_diff, min_segment_len)
+    assert len(np.unique(ref_ids[~np.isnan(ref_ids)])) > 3
+    np.testing.assert_array_equal(track_ids, ref_ids)
+    _assert_same_headings(headings, ref_headings)
+
+
+def staircase_flight(max_run=200, step=1.0):
+    """Runs of 1..max_run steps, alternately north and east, so turns fall at every offset of the search windows."""
+    runs = np.arange(1, max_run + 1)
+    north_steps = np.repeat(np.arange(len(runs)) % 2 == 0, runs)
+    north = np.concatenate([[0.0], np.cumsum(np.where(north_steps, step, 0.0))])
+    east = np.concatenate([[0.0], np.cumsum(np.where(north_steps, 0.0, step))])
+    return 50.45 + north / 111320, 30.52 + east / (111320 * np.cos(np.radians(50.45)))
+
+
+def test_turns_at_every_offset():
+    lat, lon = staircase_flight()
+    track_ids, headings = segment_by_heading(lat, lon, 45, 5)
+    ref_ids, ref_headings = _baseline_segmentation(pd.DataFrame({'lat': lat, 'lon': lon}), 'lat', 'lon', 45, 5)
+    np.testing.assert_array_equal(track_ids, ref_ids)
+    _assert_same_headings(headings, ref_headings)
+    # every run of at least 5 m is a track
+    assert len(np.unique(track_ids[~np.isnan(track_ids)])) > 190
+
+
+def test_long_lines_and_short_flights():
+    # segments much longer than the first search window
+    lat, lon = survey_flight(900, line_len=300, noise_deg=0)
+    df = pd.DataFrame({'lat': lat, 'lon': lon})
+    for n in (0, 1, 2, 3, 4, 900):
+        track_ids, headings = segment_by_heading(lat[:n], lon[:n], 30, 10)
+        ref_ids, ref_headings = _baseline_segmentation(df.iloc[:n], 'lat', 'lon', 30, 10)
+        np.testing.assert_array_equal(track_ids, ref_ids)
+        _assert_same_headings(headings, ref_headings)
+    assert np.max(np.unique(track_ids, return_counts=True)[1]) >= 4 * 64
+
+
+def test_plane_geometry_matches_the_incremental_loop():
+    lat, lon = survey_flight(600, seed=1)
+    frame = LocalFrame.for_flight(lat, lon)
+    east, north = frame.to_plane(lat, lon)
+    geometry = PlaneGeometry()
+
+    track_ids, headings = segment_by_heading(north, east, 50, 10, geometry)
+    df = pd.DataFrame({'north': north, 'east': east})
+    ref_ids, ref_headings = segment_by_heading_incremental(df, 'north', 'east', 50, 10, geometry)
+    np.testing.assert_array_equal(track_ids, ref_ids)
+    np.testing.assert_array_equal(headings, ref_headings)
+    # and the same segments as on the ellipsoid
+    np.testing.assert_array_equal(track_ids, segment_by_heading(lat, lon, 50, 10)[0])
+
+
+def _segment_online(lat, lon, chunk_sizes, *args):
+    segmenter = OnlineSegmenter(*args)
+    segments = []
+    start = 0
+    for size in chunk_sizes:
+        closed = segmenter.push_batch(lat[start:start + size], lon[start:start + size])
+        start += size
+        # only segments that can't change anymore, in order and without gaps
+        for segment in closed:
+            assert segment.end < segmenter.count
+            assert segment.start == (segments[-1].end if segments else 0)
+            segments.append(segment)
+    assert start == len(lat)
+    segments.extend(segmenter.finish())
+    return segments
+
+
+def _random_chunks(rng, n):
+    sizes = []
+    while sum(sizes) < n:
+        sizes.append(int(rng.choice([0, 1, 2, 3, 17, 64, 250])))
+    sizes[-1] -= sum(sizes) - n
+    return sizes
+
+
+@pytest.mark.parametrize("flight", ["survey", "staircase"])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_online_segmenter_matches_batch(flight, seed):
+    lat, lon = survey_flight(3000, seed=seed) if flight == "survey" else staircase_flight(100)
+    expected_ids, expected_headings = segment_by_heading(lat, lon, 45, 10)
+
+    segments = _segment_online(lat, lon, _random_chunks(np.random.default_rng(seed), len(lat)), 45, 10)
+    track_ids, headings = segments_to_arrays(segments, len(lat))
+    np.testing.assert_array_equal(track_ids, expected_ids)
+    np.testing.assert_array_equal(headings, expected_headings)
+    # the segments came out while the positions were arriving
+    assert len(segments) > 10 and segments[-1].start > 0
+
+
+def test_online_segmenter_single_points_and_short_flights():
+    lat, lon = survey_flight(400, seed=3)
+    for n in (0, 1, 2, 3, 4, 400):
+        expected_ids, expected_headings = segment_by_heading(lat[:n], lon[:n], 50, 10)
+        segmenter = OnlineSegmenter(50, 10)
+        segments = [segment for i in range(n) for segment in segmenter.push(lat[i], lon[i])]
+        segments += segmenter.finish()
+        track_ids, headings = segments_to_arrays(segments, n)
+        np.testing.assert_array_equal(track_ids, expected_ids)
+        np.testing.assert_array_equal(headings, expected_headings)
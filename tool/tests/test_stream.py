@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from mddConverter.combiner import combine_records
+from mddConverter import functions
+from mddConverter.decoder import RECORD_WIDTH, DecodedRecords, decode_records
+from mddConverter.functions import create_combined_rows, create_rows
+from mddConverter.main import decode_mdd
+from mddConverter.stream import RecordStream, iter_mdd_blocks
+from tests.mdd_samples import sample_records, write_mdd
+
+BLOCK_SIZES = [257, 1000, RECORD_WIDTH * 100, RECORD_WIDTH * 100 + 1, 4096, 100003]
+
+
+@pytest.mark.parametrize("block_size", BLOCK_SIZES)
+def test_blocks_decode_like_the_whole_file(tmp_path, block_size):
+    records = sample_records(3000)
+    path = write_mdd(tmp_path / "flight.mdd", records)
+
+    blocks = list(iter_mdd_blocks(path, block_size))
+    decoded = DecodedRecords.concat(blocks)
+    assert np.array_equal(decoded.records, records)
+    assert np.array_equal(decoded.ids, np.arange(len(records)))
+    assert [b.byte_offset for b in blocks] == [int(b.ids[0]) * RECORD_WIDTH for b in blocks]
+
+
+@pytest.mark.parametrize("block_size", BLOCK_SIZES)
+def test_blocks_combine_like_the_whole_file(tmp_path, block_size):
+    records = sample_records(3000)
+    path = write_mdd(tmp_path / "flight.mdd", records)
+
+    expected = combine_records(decode_records(records.tobytes()))
+    table = decode_mdd(path, block_size=block_size)
+    for key, values in expected.columns.items():
+        assert np.array_equal(table[key], values, equal_nan=True), key
+
+
+@pytest.mark.parametrize("chunk_size", [1, 35, 37, 1001])
+def test_record_stream_chunks(chunk_size):
+    records = sample_records(300)
+    data = records.tobytes()
+
+    stream = RecordStream()
+    parts = [stream.feed(data[i:i + chunk_size]) for i in range(0, len(data), chunk_size)]
+    parts.append(stream.finish())
+    assert np.array_equal(DecodedRecords.concat(parts).records, records)
+    assert stream.report.ok
+
+
+@pytest.mark.parametrize("rows_per_block", [1, 333, 100_000])
+def test_create_combined_rows_streams_like_the_whole_file(tmp_path, monkeypatch, rows_per_block):
+    monkeypatch.setattr(functions, 'ROWS_PER_BLOCK', rows_per_block)
+    records = sample_records(500)
+    path = write_mdd(tmp_path / "flight.mdd", records)
+
+    expected = [row.export_to_csv(";") for row in combine_records(decode_records(records.tobytes())).rows()]
+    from_rows = create_combined_rows(create_rows(records.tobytes()))
+    assert [row.export_to_csv(";") for row in from_rows] == expected
+    assert [row.export_to_csv(";") for row in create_combined_rows(path)] == expected
+    assert [row.export_to_csv(";") for row in create_combined_rows(str(path))] == expected
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from preprocessing.Data import DataAsc, DataOwn
+from preprocessing.handle_date_time import (add_utc_timestamps, get_date_and_time_by_filepath,
+                                            get_date_and_time_by_str, get_time_by_str, get_timestamp_utc)
+from preprocessing.time_base import drift_corrected_timestamps, fit_clock_drift, parse_gps_times
+
+FILEPATH = "/flights/20250325_121959_MD-R3_#0055_RF.csv"
+
+
+def _old_add_utc_timestamps(data, datetime=None):
+    """add_utc_timestamps before the time base was vectorized, with its loops over the rows."""
+    if datetime:
+        date, time = get_date_and_time_by_str(datetime)
+    else:
+        date, time = get_date_and_time_by_filepath(data.filepath)
+
+    if data.date is None:
+        data.set_date(date)
+
+    first_valid_index = 0
+    gps_time_col = data.config.gps_time_col
+    timestamp_col = data.config.timestamp_col
+    if gps_time_col in data.df.columns and data.df[gps_time_col].notna().any():
+        valid_mask = data.df[gps_time_col].notna() & (data.df[gps_time_col] != 0)
+        valid_values = data.df[gps_time_col][valid_mask]
+        first_valid_index = valid_values.index[0]
+        first_valid_time = valid_values.iloc[0]
+        first_tmst = get_timestamp_utc(date, get_time_by_str(first_valid_time))
+
+    elif isinstance(data, DataAsc):
+        day_timestamps = data.df[timestamp_col]
+        timestamps = get_timestamp_utc(date) + day_timestamps
+        data.add_column(data.config.utc_timestamp_col, timestamps)
+        return
+
+    timestamps = [None] * len(data.df)
+    timestamps[first_valid_index] = first_tmst
+
+    for i in range(first_valid_index, len(data.df) - 1):
+        delta = data.df[timestamp_col].iloc[i + 1] - data.df[timestamp_col].iloc[i]
+        timestamps[i + 1] = timestamps[i] + delta
+
+    for i in range(first_valid_index, 0, -1):
+        delta = data.df[timestamp_col].iloc[i] - data.df[timestamp_col].iloc[i - 1]
+        timestamps[i - 1] = timestamps[i] - delta
+    data.add_column(data.config.utc_timestamp_col, timestamps)
+
+
+def _flight(rng, n):
+    """Device timestamps and GPS times (hhmmss.sss) of a flight, with rows before the first fix."""
+    c = DataOwn.DEFAULT_CONFIG
+    timestamps = 123_456 + np.cumsum(rng.integers(4, 7, n))
+    gps = np.full(n, np.nan)
+    fixes = np.sort(rng.choice(np.arange(int(rng.integers(0, n // 2)), n), size=max(1, n // 40), replace=False))
+    # hours from 10 on, the old parser reads 'hmmss' with a single hour digit differently
+    start_s = rng.uniform(10, 23) * 3600
+    seconds = start_s + (timestamps[fixes] - timestamps[0]) / 1000 + rng.normal(0, 0.02, len(fixes))
+    seconds = np.round(seconds, int(rng.integers(1, 4)))
+    hours, rest = np.divmod(seconds, 3600)
+    minutes, secs = np.divmod(rest, 60)
+    gps[fixes] = np.round(hours * 10000 + minutes * 100 + secs, 3)
+    # seconds that round up to 60 aren't a time of the day
+    gps[fixes[np.round(secs, 3) >= 60]] = np.nan
+    gps[:fixes[0]][rng.random(fixes[0]) < 0.5] = 0
+    return pd.DataFrame({c.timestamp_col: timestamps, c.gps_time_col: gps})
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_add_utc_timestamps_matches_the_old_loops(seed):
+    rng = np.random.default_rng(seed)
+    df = _flight(rng, int(rng.integers(2, 3000)))
+    datetime = "20250325_121959.0" if seed % 4 == 0 else None
+
+    new = DataOwn(df.copy(), filepath=FILEPATH)
+    add_utc_timestamps(new, datetime)
+    old = DataOwn(df.copy(), filepath=FILEPATH)
+    _old_add_utc_timestamps(old, datetime)
+
+    col = new.config.utc_timestamp_col
+    assert np.array_equal(new.df[col].to_numpy(), old.df[col].to_numpy().astype(np.int64))
+    assert new.date == old.date
+
+
+@pytest.mark.parametrize("value", ["121959.203", 121959.203, "235959.999999", "000000.5", 95959.25])
+def test_parse_gps_times(value):
+    expected = get_time_by_str(value)
+    us = ((expected.hour * 60 + expected.minute) * 60 + expected.second) * 10**6 + expected.microsecond
+    assert parse_gps_times([value])[0] == us
+
+
+@pytest.mark.parametrize("value", [np.nan, "", "abc", 126000.0, 246000.0, -1.0])
+def test_parse_invalid_gps_times(value):
+    assert np.isnan(parse_gps_times([value])[0])
+
+
+def test_clock_drift_fit():
+    rng = np.random.default_rng(0)
+    device = np.arange(0, 3_600_000, 200.0)
+    drift = 1_700_000_000_000 + 0.00005 * device + 20 * np.sin(device / 1_000_000)
+    utc = device + drift + rng.normal(0, 2, len(device))
+    utc[::500] += 5000  # wrong fixes
+
+    knots, offsets = fit_clock_drift(device, utc)
+    corrected = drift_corrected_timestamps(device, knots, offsets)
+    assert np.abs(corrected - (device + drift)).max() < 2
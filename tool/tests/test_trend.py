@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from preprocessing.magnetic_field import calculate_residual
+from preprocessing.trend import FILTER_KINDS, lowpass, median_trends, rolling_median
+
+
+def _old_calculate_residual(tf_series: pd.Series, window_size: int):
+    """calculate_residual before the running median, one window at a time."""
+    N = len(tf_series)
+    trend = []
+
+    half = window_size // 2
+
+    start_window_mean = tf_series.iloc[0:window_size].mean()
+    trend.extend([start_window_mean] * half)
+
+    for i in range(half, N - half):
+        window = tf_series.iloc[i - half: i + half + 1]
+        trend.append(window.median())
+
+    end_window_mean = tf_series.iloc[-window_size:].median()
+    trend.extend([end_window_mean] * (N - len(trend)))
+
+    residual = tf_series - pd.Series(trend, index=tf_series.index)
+    return residual.round(2), pd.Series(trend, index=tf_series.index).round(2)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_calculate_residual_matches_the_old_loop(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(5, 1500))
+    window = int(rng.integers(1, min(n, 300) + 1))
+    values = 50000 + np.cumsum(rng.normal(0, 0.5, n)) + rng.normal(0, 2, n)
+    values = np.round(values, int(rng.integers(0, 3)))  # ties between samples
+    if seed % 3 == 0:
+        values[rng.random(n) < 0.05] = np.nan
+    # a slice of a frame, as add_residual_field passes the rows of one sensor
+    series = pd.Series(values, index=np.arange(n) * 2 + 1)
+
+    residual, trend = calculate_residual(series, window)
+    old_residual, old_trend = _old_calculate_residual(series, window)
+    pd.testing.assert_series_equal(trend, old_trend)
+    pd.testing.assert_series_equal(residual, old_residual)
+
+
+def test_median_trends_of_several_windows():
+    values = np.random.default_rng(0).normal(size=500)
+    trends = median_trends(values, [3, 10, 51])
+    for window, trend in trends.items():
+        assert np.array_equal(median_trends(values, [window])[window], trend)
+        half = window // 2
+        assert np.array_equal(trend[half:-half], rolling_median(values, window)[half:-half])
+
+
+def test_median_trend_window_too_long():
+    with pytest.raises(ValueError):
+        median_trends(np.zeros(10), [30])
+
+
+@pytest.mark.parametrize("kind", FILTER_KINDS)
+@pytest.mark.parametrize("n", [50, 1000, 5000])
+def test_lowpass_keeps_a_line(kind, n):
+    # the main field level and a regional gradient must pass unchanged, also at the ends of short lines
+    line = 50000 + 0.01 * np.arange(n)
+    assert np.abs(lowpass(line, 0.33, 200, kind) - line).max() < 1e-6
+
+
+@pytest.mark.parametrize("kind", FILTER_KINDS)
+def test_lowpass_bridges_nan(kind):
+    values = np.sin(np.arange(2000) / 200)
+    values[500:520] = np.nan
+    result = lowpass(values, 1.0, 200, kind)
+    assert not np.isnan(result).any()
+    assert np.all(np.isnan(lowpass(np.full(10, np.nan), 1.0, 200, kind)))
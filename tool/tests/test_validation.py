@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+from mddConverter.decoder import RECORD_WIDTH, DecodedRecords
+from mddConverter.stream import iter_mdd_blocks
+from mddConverter.validation import FramingReport, TIMESTAMP_JUMP_MS, detect_marker, validate_framing
+from tests.mdd_samples import MARKER, sample_records, write_mdd
+
+DAMAGED = 500  # record the corruption starts in
+GARBAGE = np.random.default_rng(1).integers(0, 256, 200, dtype=np.uint8).tobytes()
+
+
+def _corrupt(data: bytes, case: str):
+    """
+    The corrupted bytes, the records that are lost with them and the ones that are kept with broken
+    values: a record with bytes inserted after its header still looks valid.
+    """
+    inside = DAMAGED * RECORD_WIDTH + 10
+    boundary = DAMAGED * RECORD_WIDTH
+    if case == 'inserted_byte':
+        return data[:inside] + b'\x00' + data[inside:], [], [DAMAGED]
+    if case == 'inserted_bytes':
+        return data[:inside] + bytes(17) + data[inside:], [], [DAMAGED]
+    if case == 'deleted_byte':
+        return data[:inside] + data[inside + 1:], [DAMAGED], []
+    if case == 'deleted_bytes':
+        return data[:inside] + data[inside + 50:], [DAMAGED, DAMAGED + 1], []
+    if case == 'garbage':
+        return data[:boundary] + GARBAGE + data[boundary:], [], []
+    if case == 'truncated':
+        return data[:-20], [len(data) // RECORD_WIDTH - 1], []
+    raise ValueError(case)
+
+
+CASES = ['inserted_byte', 'inserted_bytes', 'deleted_byte', 'deleted_bytes', 'garbage', 'truncated']
+
+
+def _assert_recovered(decoded: DecodedRecords, records: np.ndarray, lost, garbled):
+    expected = np.delete(records, lost)
+    assert len(decoded) == len(expected)
+    intact = np.ones(len(expected), dtype=bool)
+    intact[garbled] = False
+    assert np.array_equal(decoded.records[intact], expected[intact])
+
+
+def test_clean_data():
+    records = sample_records(300)
+    decoded, report, consumed = validate_framing(records.tobytes())
+    assert np.array_equal(decoded.records, records)
+    assert report.ok and report.marker == MARKER
+    assert consumed == len(records) * RECORD_WIDTH
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_resync(case):
+    records = sample_records(400)
+    data, lost, garbled = _corrupt(records.tobytes(), case)
+
+    decoded, report, _ = validate_framing(data)
+    _assert_recovered(decoded, records, lost, garbled)
+    assert report.dropped_timestamps == 0
+    if case == 'truncated':
+        assert report.resyncs == 0
+        assert report.trailing_bytes == RECORD_WIDTH - 20
+    else:
+        assert report.resyncs >= 1
+        assert not report.ok
+
+
+@pytest.mark.parametrize("block_size", [257, 4096, 100003])
+@pytest.mark.parametrize("case", CASES)
+def test_resync_in_blocks(tmp_path, case, block_size):
+    records = sample_records(400)
+    data, lost, garbled = _corrupt(records.tobytes(), case)
+    path = tmp_path / "flight.mdd"
+    path.write_bytes(data)
+
+    report = FramingReport()
+    decoded = DecodedRecords.concat(list(iter_mdd_blocks(path, block_size, report=report)))
+    whole, whole_report, _ = validate_framing(data)
+    _assert_recovered(decoded, records, lost, garbled)
+    assert np.array_equal(decoded.records, whole.records)
+    assert report.resyncs == whole_report.resyncs
+    assert report.skipped_bytes == whole_report.skipped_bytes
+
+
+def test_timestamp_spike_is_dropped(tmp_path):
+    records = sample_records(400)
+    broken = records.copy()
+    broken['timestamp'][DAMAGED] += 10 * TIMESTAMP_JUMP_MS
+
+    decoded, report, _ = validate_framing(broken.tobytes())
+    assert np.array_equal(decoded.records, np.delete(records, DAMAGED))
+    assert report.dropped_timestamps == 1
+
+    # also when the spike is the last record of a block
+    path = write_mdd(tmp_path / "flight.mdd", broken)
+    blocks = list(iter_mdd_blocks(path, (DAMAGED + 1) * RECORD_WIDTH))
+    assert np.array_equal(DecodedRecords.concat(blocks).records, np.delete(records, DAMAGED))
+
+
+def test_detect_marker_off_the_record_boundary():
+    data = sample_records(100).tobytes()
+    assert detect_marker(np.frombuffer(data[13:], dtype=np.uint8)) == MARKER
+    assert detect_marker(np.frombuffer(GARBAGE * 20, dtype=np.uint8)) is None